@@ -1,2 +1,10 @@
-from .main import main
+# main is imported on first use: an eager import would load refurb.main (and
+# with it every test module) before runpy executes python3 -m refurb.erase or
+# refurb.nettest, which warns and runs those modules twice.
 
+
+def __getattr__(name: str):
+    if name == "main":
+        from .main import main
+        return main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
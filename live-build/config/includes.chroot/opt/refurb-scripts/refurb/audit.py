@@ -1,67 +1,244 @@
+import json
+import os
+import threading
+import time
 import xml.etree.ElementTree as ET
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
+from . import backend, probe, trace
+from .fingerprint import DMI_FIELDS
+from .model import Audit, Battery, Collector, Disk, LshwNode, pack
 from .utils import run_cmd, ts
-from .xmlio import write_xml, new_root
-
-
-def _lshw_xml() -> str:
-    code, out, err = run_cmd(["lshw", "-xml"])
+from .xmlio import write_xml
+
+COLLECTOR_TIMEOUT = 120
+MAX_WORKERS = 8
+
+
+def _lshw(timeout: Optional[int] = None) -> Tuple[List[LshwNode], str]:
+    code, out, err = run_cmd(["lshw", "-json"], timeout)
+    if code == 0:
+        try:
+            data = json.loads(out)
+            return [LshwNode.from_json(d) for d in (data if isinstance(data, list) else [data])], ""
+        except ValueError:
+            pass
+    # Some lshw releases emit broken JSON; the XML output is always well formed.
+    code, out, err = run_cmd(["lshw", "-xml"], timeout)
     if code != 0:
-        return f"<error time='{ts()}'>lshw failed: {err}</error>"
-    return out
+        return [], f"lshw failed: {err}"
+    try:
+        el = ET.fromstring(out)
+    except ET.ParseError as e:
+        return [], f"lshw output not parseable: {e}"
+    nodes = el.findall("node") if el.tag == "list" else [el]
+    return [LshwNode.from_xml(n) for n in nodes], ""
 
 
-def _dmidecode() -> str:
-    code, out, err = run_cmd(["dmidecode"])
-    if code != 0:
-        return f"dmidecode failed: {err}"
-    return out
+def _dmidecode(timeout: Optional[int] = None) -> Optional[str]:
+    code, out, err = run_cmd(["dmidecode"], timeout)
+    return pack(out if code == 0 else f"dmidecode failed: {err}")
 
 
-def _list_disks() -> List[str]:
-    code, out, _ = run_cmd(["bash", "-lc", "lsblk -nd -o NAME,TYPE | awk '$2==\"disk\"{print $1}'"])
-    if code != 0:
-        return []
-    return [f"/dev/{n.strip()}" for n in out.strip().splitlines() if n.strip()]
+def _smartctl(dev: str, keep_raw: bool, timeout: Optional[int] = None) -> Disk:
+    code, out, err = run_cmd(["smartctl", "--json", "-a", dev], timeout)
+    try:
+        data = json.loads(out)
+    except ValueError:
+        data = {}
+    disk = Disk.from_smartctl_json(dev, code, data)
+    if keep_raw:
+        disk.raw = pack(out or err)
+    return disk
 
 
-def _smartctl(dev: str) -> Tuple[bool, str]:
-    code, out, err = run_cmd(["smartctl", "-a", dev])
-    ok = code == 0 or code == 4
-    return ok, out if out else err
+def _read(path: str) -> str:
+    try:
+        with open(backend.path(path), "r", errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
 
 
-def gather_audit() -> ET.Element:
-    root = new_root("audit", {"time": ts()})
-    lshw_raw = _lshw_xml()
+def _num(path: str) -> Optional[float]:
+    try:
+        return float(_read(path))
+    except ValueError:
+        return None
+
+
+def read_battery(name: str) -> Battery:
+    base = f"/sys/class/power_supply/{name}"
+
+    def wh(what: str) -> Optional[float]:
+        energy = _num(f"{base}/energy_{what}")
+        if energy is not None:
+            return round(energy / 1e6, 2)
+        # Some packs only report charge (uAh); convert with the design voltage.
+        charge = _num(f"{base}/charge_{what}")
+        volts = _num(f"{base}/voltage_min_design") or _num(f"{base}/voltage_now")
+        return round(charge * volts / 1e12, 2) if charge is not None and volts else None
+
+    capacity = _num(f"{base}/capacity")
+    cycles = _num(f"{base}/cycle_count")
+    return Battery(
+        name=name,
+        path=probe.upower_path(name),
+        manufacturer=_read(f"{base}/manufacturer"),
+        model=_read(f"{base}/model_name"),
+        serial=_read(f"{base}/serial_number"),
+        technology=_read(f"{base}/technology"),
+        status=_read(f"{base}/status"),
+        capacity_pct=int(capacity) if capacity is not None else None,
+        energy_now_wh=wh("now"),
+        energy_full_wh=wh("full"),
+        energy_full_design_wh=wh("full_design"),
+        cycle_count=int(cycles) if cycles is not None else None,
+    )
+
+
+def _battery(name: str, timeout: Optional[int] = None) -> Battery:
+    return read_battery(name)
+
+
+def read_dmi() -> Dict[str, str]:
+    return {f: _read(f"/sys/class/dmi/id/{f}") for f in DMI_FIELDS}
+
+
+def _timed(name: str, fn: Callable, *args) -> Tuple[object, float]:
+    start = time.monotonic()
+    with trace.span(name, "collector"):
+        res = fn(*args)
+    return res, time.monotonic() - start
+
+
+def _run_collectors(jobs: List[Tuple[str, Callable, tuple]], max_workers: int, timeout: int):
+    # Collectors are subprocess-bound, so threads are enough; each one passes
+    # its own timeout down to run_cmd, which kills the child on expiry.
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        futures = [(name, pool.submit(_timed, name, fn, *args, timeout)) for name, fn, args in jobs]
+        for name, fut in futures:
+            try:
+                results[name] = fut.result(timeout=timeout + 5)
+            except Exception as e:
+                results[name] = (e, float(timeout))
+    return results
+
+
+def collect_audit(keep_raw: bool = False, max_workers: int = MAX_WORKERS, timeout: int = COLLECTOR_TIMEOUT) -> Audit:
+    started = time.monotonic()
+    audit = Audit(time=ts(), dmi=read_dmi())
+    disks = probe.block_devices()
+    bats = probe.batteries()
+    jobs: List[Tuple[str, Callable, tuple]] = [("lshw", _lshw, ())]
+    if keep_raw:
+        jobs.append(("dmidecode", _dmidecode, ()))
+    jobs += [(f"smartctl:{dev}", _smartctl, (dev, keep_raw)) for dev in disks]
+    jobs += [(f"battery:{b}", _battery, (b,)) for b in bats]
+    results = _run_collectors(jobs, max_workers, timeout)
+
+    def value(name: str, default):
+        res = results[name][0]
+        return default if isinstance(res, Exception) else res
+
+    audit.lshw, audit.lshw_error = value("lshw", ([], "lshw failed: timeout"))
+    if keep_raw:
+        audit.dmidecode_raw = value("dmidecode", None)
+    audit.disks = [value(f"smartctl:{dev}", Disk(device=dev)) for dev in disks]
+    audit.batteries = [value(f"battery:{b}", Battery(name=b, path=probe.upower_path(b))) for b in bats]
+    for name, _, _ in jobs:
+        res, dur = results[name]
+        err = (str(res) or type(res).__name__) if isinstance(res, Exception) else ""
+        audit.collectors.append(Collector(name, dur, not err, err))
+    audit.duration = time.monotonic() - started
+    return audit
+
+
+def gather_audit(keep_raw: bool = False) -> ET.Element:
+    return collect_audit(keep_raw).to_xml()
+
+
+BOOT_CACHE_DIR = "/run/refurb"
+_cached: Optional[Audit] = None
+_cache_lock = threading.Lock()
+
+
+def boot_id() -> str:
     try:
-        lshw_el = ET.fromstring(lshw_raw)
-    except ET.ParseError:
-        lshw_el = ET.Element("lshw_raw")
-        lshw_el.text = lshw_raw
-    root.append(lshw_el)
-
-    dmi_el = ET.SubElement(root, "dmidecode")
-    dmi_el.text = _dmidecode()
-
-    disks_el = ET.SubElement(root, "disks")
-    for dev in _list_disks():
-        ok, txt = _smartctl(dev)
-        d = ET.SubElement(disks_el, "disk", {"device": dev, "smart_ok": str(ok).lower()})
-        d.text = txt
-
-    bat_el = ET.SubElement(root, "battery")
-    code, out, _ = run_cmd(["bash", "-lc", "upower -e | grep -i battery || true"]) 
-    bat_paths = [ln.strip() for ln in out.strip().splitlines() if ln.strip()]
-    for bp in bat_paths:
-        code, bout, _ = run_cmd(["upower", "-i", bp])
-        b = ET.SubElement(bat_el, "upower", {"path": bp})
-        b.text = bout
-
-    return root
-
-
-def save_audit(path: str) -> None:
-    root = gather_audit()
-    write_xml(path, root)
+        with open(backend.path("/proc/sys/kernel/random/boot_id"), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return "unknown"
+
+
+def prime(audit: Audit) -> None:
+    global _cached
+    with _cache_lock:
+        _cached = audit
+
+
+def forget() -> None:
+    # Drops the per-boot audit so the next audit_once() runs the collectors.
+    global _cached
+    with _cache_lock:
+        _cached = None
+        try:
+            os.remove(backend.path(os.path.join(BOOT_CACHE_DIR, f"audit-{boot_id()}.json")))
+        except OSError:
+            pass
+
+
+def audit_once(keep_raw: bool = False) -> Audit:
+    # The full audit runs at most once per boot: in-process it is memoized,
+    # across restarts of the suite it is reloaded from /run (tmpfs).
+    global _cached
+    with _cache_lock:
+        if _cached is not None:
+            return _cached
+        path = backend.path(os.path.join(BOOT_CACHE_DIR, f"audit-{boot_id()}.json"))
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _cached = Audit.from_json(f.read())
+                return _cached
+            except (OSError, ValueError, TypeError):
+                pass
+        _cached = collect_audit(keep_raw)
+        try:
+            _write_json(path, _cached)
+        except OSError:
+            pass
+        return _cached
+
+
+def _write_json(path: str, audit: Audit) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(audit.to_json())
+    os.replace(tmp, path)
+
+
+def write_audit(path: str, audit: Audit) -> None:
+    if path.endswith(".json"):
+        _write_json(path, audit)
+    else:
+        write_xml(path, audit.to_xml())
+
+
+def refresh_in_background(path: str, keep_raw: bool = False,
+                          on_done: Optional[Callable[[str], None]] = None) -> threading.Thread:
+    def run() -> None:
+        write_audit(path, collect_audit(keep_raw))
+        if on_done:
+            on_done(path)
+
+    t = threading.Thread(target=run, name="refurb-audit-refresh", daemon=True)
+    t.start()
+    return t
+
+
+def save_audit(path: str, keep_raw: bool = False) -> None:
+    write_audit(path, audit_once(keep_raw))
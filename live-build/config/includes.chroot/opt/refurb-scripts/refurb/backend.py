@@ -0,0 +1,341 @@
+import fnmatch
+import glob as _glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from . import runner
+
+# Everything the suite takes from the machine under test goes through the
+# active backend: commands, /sys, /proc and /dev paths, operator answers,
+# uevents and the final shutdown. Live is the machine itself, Replay serves a
+# recorded machine from a fixture directory and Record captures one:
+#
+#   REFURB_BACKEND=replay:fixtures/latitude-e7470   (or record:/tmp/new-machine)
+#
+# A fixture is machine.json ({"commands", "answers", "uevents"}) plus root/,
+# a copy of the sysfs/procfs files the suite reads. Disks are served as sparse
+# images sized from the recorded /sys/block/<disk>/size.
+HOST_DIRS = ("/sys", "/proc", "/dev", "/run")
+FIXTURE_FILE = "machine.json"
+
+# Stand-in for commands the suite starts itself (stress-ng, memtester):
+# prints the recorded output and exits with the recorded code.
+_PLAYER = """import sys, time
+time.sleep(float(sys.argv[4]))
+for path, stream in ((sys.argv[1], sys.stdout), (sys.argv[2], sys.stderr)):
+    with open(path, "r", encoding="utf-8") as f:
+        stream.write(f.read())
+sys.exit(int(sys.argv[3]))
+"""
+
+
+def _host(path: str) -> bool:
+    return any(path == d or path.startswith(d + "/") for d in HOST_DIRS)
+
+
+class Live:
+    name = "live"
+
+    def run(self, cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        res = runner.run(cmd, timeout=timeout)
+        return (1 if res.timed_out else res.code), res.out, res.err
+
+    def argv(self, cmd: List[str]) -> List[str]:
+        return list(cmd)
+
+    def path(self, path: str) -> str:
+        return path
+
+    def glob(self, pattern: str) -> List[str]:
+        return _glob.glob(pattern)
+
+    def has_bin(self, name: str) -> bool:
+        return shutil.which(name) is not None
+
+    def ask(self, prompt: str) -> str:
+        return input(prompt)
+
+    def uevents(self, subsystem: str, on_event: Callable[[Dict[str, str]], None]) -> Optional[Callable[[], None]]:
+        # None: listen on the real netlink socket / udevadm.
+        return None
+
+    def shutdown(self, delay: float) -> None:
+        time.sleep(delay)
+        os.system("shutdown -h now")
+
+    def close(self) -> None:
+        pass
+
+
+class Replay(Live):
+    # Commands are matched against the recorded argv patterns (fnmatch per
+    # argument, first match wins; an entry with "once" is used up by its first
+    # match, for output that changes during a run, such as a self-test log).
+    # Unknown commands fail like a missing binary.
+    # Answers are handed out in order; running out is an error, not an
+    # endless prompt loop. time_scale multiplies the recorded durations.
+    name = "replay"
+
+    def __init__(self, fixture: str, answers: Optional[List[str]] = None, time_scale: float = 0.0) -> None:
+        self.fixture = os.path.abspath(fixture)
+        self.root = os.path.join(self.fixture, "root")
+        with open(os.path.join(self.fixture, FIXTURE_FILE), "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        self.description = spec.get("description", "")
+        self.commands: List[Dict] = spec.get("commands", [])
+        self.events: List[Dict] = spec.get("uevents", [])
+        self.answers = list(spec.get("answers", []) if answers is None else answers)
+        self.time_scale = time_scale
+        self.scratch = tempfile.mkdtemp(prefix="refurb-replay-")
+        self.missing: List[List[str]] = []
+        self._used: Set[int] = set()
+        self.asked: List[str] = []
+        self._lock = threading.Lock()
+
+    def _lookup(self, cmd: List[str]) -> Tuple[int, str, str, float]:
+        for i, c in enumerate(self.commands):
+            pat = c["argv"]
+            if len(pat) == len(cmd) and all(fnmatch.fnmatchcase(a, p) for a, p in zip(cmd, pat)):
+                if c.get("once"):
+                    with self._lock:
+                        if i in self._used:
+                            continue
+                        self._used.add(i)
+                return (int(c.get("code", 0)), self._text(c.get("stdout", "")), self._text(c.get("stderr", "")),
+                        float(c.get("duration", 0.0)) * self.time_scale)
+        with self._lock:
+            self.missing.append(list(cmd))
+        return 127, "", f"{cmd[0] if cmd else '?'}: not recorded in {self.fixture}", 0.0
+
+    def _text(self, value: str) -> str:
+        # "@out/lshw.json" refers to a file in the fixture.
+        if not value.startswith("@"):
+            return value
+        with open(os.path.join(self.fixture, value[1:]), "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+
+    def run(self, cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        code, out, err, duration = self._lookup(cmd)
+        if timeout is not None and duration > timeout:
+            time.sleep(timeout)
+            return 1, out, f"{err}\nCommand {cmd!r} timed out after {timeout} seconds"
+        time.sleep(duration)
+        return code, out, err
+
+    def argv(self, cmd: List[str]) -> List[str]:
+        code, out, err, duration = self._lookup(cmd)
+        fd, base = tempfile.mkstemp(dir=self.scratch, prefix="cmd-")
+        os.close(fd)
+        for suffix, text in ((".out", out), (".err", err)):
+            with open(base + suffix, "w", encoding="utf-8") as f:
+                f.write(text)
+        return [sys.executable, "-c", _PLAYER, base + ".out", base + ".err", str(code), str(duration)]
+
+    def path(self, path: str) -> str:
+        if not _host(path):
+            return path
+        if path == "/run" or path.startswith("/run/"):
+            return os.path.join(self.scratch, path.lstrip("/"))
+        if path.startswith("/dev/"):
+            image = self._disk_image(path[5:])
+            if image:
+                return image
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _disk_image(self, name: str) -> str:
+        # The fixture has no device nodes; a disk in sys/block gets an empty
+        # sparse file of its recorded size in the scratch dir instead.
+        try:
+            with open(os.path.join(self.root, "sys/block", name, "size"), "r") as f:
+                size = int(f.read().strip() or 0) * 512
+        except (OSError, ValueError):
+            return ""
+        image = os.path.join(self.scratch, "dev", name)
+        with self._lock:
+            if not os.path.exists(image):
+                os.makedirs(os.path.dirname(image), exist_ok=True)
+                with open(image, "wb") as f:
+                    f.truncate(size)
+        return image
+
+    def glob(self, pattern: str) -> List[str]:
+        if not _host(pattern):
+            return _glob.glob(pattern)
+        return ["/" + os.path.relpath(p, self.root) for p in _glob.glob(self.path(pattern))]
+
+    def has_bin(self, name: str) -> bool:
+        return any(c["argv"] and c["argv"][0] == name for c in self.commands)
+
+    def ask(self, prompt: str) -> str:
+        with self._lock:
+            if not self.answers:
+                raise RuntimeError(f"no scripted answer left for prompt {prompt!r}")
+            ans = self.answers.pop(0)
+            self.asked.append(prompt)
+        print(f"{prompt}{ans}")
+        return ans
+
+    def uevents(self, subsystem: str, on_event: Callable[[Dict[str, str]], None]) -> Optional[Callable[[], None]]:
+        # Recorded events of the subsystem, "after" seconds after listening starts.
+        stop = threading.Event()
+
+        def play() -> None:
+            start = time.monotonic()
+            for ev in self.events:
+                if ev.get("SUBSYSTEM") != subsystem:
+                    continue
+                if stop.wait(max(0.0, start + float(ev.get("after", 0)) - time.monotonic())):
+                    return
+                on_event({k: str(v) for k, v in ev.items() if k != "after"})
+
+        threading.Thread(target=play, name=f"refurb-replay-{subsystem}", daemon=True).start()
+        return stop.set
+
+    def shutdown(self, delay: float) -> None:
+        pass
+
+    def close(self) -> None:
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+class Record(Live):
+    # Runs on the real machine and writes a fixture as it goes: command
+    # output, every sysfs/procfs path the suite touches (directories as their
+    # listing, symlinks as symlinks) and the operator's answers. Commands the
+    # suite starts itself through argv() (stress-ng, memtester) are not
+    # captured; add those entries by hand. A command whose output changes is
+    # recorded again, the earlier entry marked "once".
+    name = "record"
+
+    def __init__(self, fixture: str) -> None:
+        self.fixture = os.path.abspath(fixture)
+        self.root = os.path.join(self.fixture, "root")
+        os.makedirs(os.path.join(self.fixture, "out"), exist_ok=True)
+        self.spec: Dict = {"description": "", "commands": [], "answers": [], "uevents": []}
+        self._seen: Dict[Tuple[str, ...], Tuple[Dict, int, str]] = {}
+        self._lock = threading.Lock()
+        self._save()
+
+    def _save(self) -> None:
+        tmp = os.path.join(self.fixture, FIXTURE_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.spec, f, indent=1)
+        os.replace(tmp, os.path.join(self.fixture, FIXTURE_FILE))
+
+    def run(self, cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        start = time.monotonic()
+        try:
+            code, out, err = super().run(cmd, timeout)
+        except OSError as e:
+            # Missing binary: replayed the way run_cmd reports it.
+            code, out, err = 1, "", str(e)
+        with self._lock:
+            last = self._seen.get(tuple(cmd))
+            if last is None or last[1:] != (code, out):
+                if last is not None:
+                    last[0]["once"] = True
+                entry = {"argv": list(cmd), "code": code, "stdout": out, "stderr": err,
+                         "duration": round(time.monotonic() - start, 3)}
+                if len(out) > 4096:
+                    name = f"out/{len(self.spec['commands']):03d}-{os.path.basename(cmd[0])}.txt"
+                    with open(os.path.join(self.fixture, name), "w", encoding="utf-8") as f:
+                        f.write(out)
+                    entry["stdout"] = "@" + name
+                self._seen[tuple(cmd)] = (entry, code, out)
+                self.spec["commands"].append(entry)
+                self._save()
+        return code, out, err
+
+    def _capture(self, path: str, depth: int = 0) -> None:
+        dst = os.path.join(self.root, path.lstrip("/"))
+        if os.path.lexists(dst) or depth > 8:
+            return
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), dst)
+            self._capture(os.path.realpath(path), depth + 1)
+        elif os.path.isdir(path):
+            os.makedirs(dst, exist_ok=True)
+            for name in os.listdir(path):
+                sub = os.path.join(path, name)
+                if os.path.islink(sub) or os.path.isdir(sub):
+                    self._capture(sub, depth + 1)
+        elif os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read(1 << 20)
+            except OSError:
+                return
+            with open(dst, "wb") as f:
+                f.write(data)
+
+    def path(self, path: str) -> str:
+        if _host(path) and not path.startswith(("/dev/", "/run/")):
+            with self._lock:
+                try:
+                    self._capture(path)
+                except OSError:
+                    pass
+        return path
+
+    def glob(self, pattern: str) -> List[str]:
+        return [self.path(p) for p in _glob.glob(pattern)]
+
+    def ask(self, prompt: str) -> str:
+        ans = input(prompt)
+        with self._lock:
+            self.spec["answers"].append(ans)
+            self._save()
+        return ans
+
+    def shutdown(self, delay: float) -> None:
+        pass
+
+
+def from_spec(spec: str) -> Live:
+    kind, _, arg = spec.partition(":")
+    if kind == "replay":
+        return Replay(arg)
+    if kind == "record":
+        return Record(arg)
+    return Live()
+
+
+_active: Live = from_spec(os.getenv("REFURB_BACKEND", ""))
+
+
+def active() -> Live:
+    return _active
+
+
+def use(backend: Live) -> Live:
+    # Returns the previous backend so callers can restore it.
+    global _active
+    previous, _active = _active, backend
+    return previous
+
+
+def run(cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, str, str]:
+    return _active.run(cmd, timeout)
+
+
+def argv(cmd: List[str]) -> List[str]:
+    return _active.argv(cmd)
+
+
+def path(p: str) -> str:
+    return _active.path(p)
+
+
+def glob(pattern: str) -> List[str]:
+    return _active.glob(pattern)
+
+
+def close() -> None:
+    _active.close()
@@ -0,0 +1,157 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Dict, List, Optional
+
+from . import backend, probe
+
+# energy_now alone only gives a usable slope over a longer window: many packs
+# update it once per percent. Shorter windows use the mean of power_now.
+MIN_FIT_SEC = 120.0
+
+
+def _read(path: str) -> str:
+    try:
+        with open(backend.path(path), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        return int(_read(path))
+    except ValueError:
+        return None
+
+
+def on_ac() -> bool:
+    return any(_read(p) == "1" and _read(p.rsplit("/", 1)[0] + "/type") == "Mains"
+               for p in backend.glob("/sys/class/power_supply/*/online"))
+
+
+class _Series:
+    def __init__(self) -> None:
+        self.times = array("f")
+        self.energy_mwh = array("I")
+        self.power_mw = array("I")
+        self.voltage_mv = array("I")
+        self.discharging = array("B")
+
+
+class Discharge:
+    def __init__(self, samples: int, window: float, discharging: bool, rate_w: float = 0.0, method: str = "",
+                 runtime_min: Optional[float] = None, remaining_min: Optional[float] = None) -> None:
+        self.samples = samples
+        self.window = window
+        self.discharging = discharging
+        self.rate_w = rate_w
+        self.method = method
+        self.runtime_min = runtime_min
+        self.remaining_min = remaining_min
+
+    @property
+    def measured(self) -> bool:
+        return self.discharging and self.rate_w > 0
+
+
+def _slope(xs: List[float], ys: List[float]) -> float:
+    n = len(xs)
+    mx, my = sum(xs) / n, sum(ys) / n
+    var = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var if var else 0.0
+
+
+class BatterySampler:
+    # Samples energy, power and voltage of every system battery from a
+    # background thread while something else loads the machine (the CPU
+    # stress run). done is set on stop(), so a passive task can wait for the
+    # window to close before judging the packs.
+    def __init__(self, interval: float = 10.0) -> None:
+        self.interval = interval
+        self.names = probe.batteries()
+        self.series: Dict[str, _Series] = {n: _Series() for n in self.names}
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = 0.0
+
+    def start(self) -> None:
+        self._t0 = time.monotonic()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="refurb-battery", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.sample()
+        self.done.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        now = time.monotonic() - self._t0
+        for name in self.names:
+            base = f"/sys/class/power_supply/{name}"
+            volts = _read_int(f"{base}/voltage_now") or 0
+            energy = _read_int(f"{base}/energy_now")
+            if energy is None:
+                # Charge-only packs (uAh).
+                charge = _read_int(f"{base}/charge_now")
+                energy = charge * volts // 1000000 if charge is not None else 0
+            power = _read_int(f"{base}/power_now")
+            if power is None:
+                current = _read_int(f"{base}/current_now")
+                power = current * volts // 1000000 if current is not None else 0
+            s = self.series[name]
+            with self._lock:
+                s.times.append(now)
+                s.energy_mwh.append(max(0, energy // 1000))
+                s.power_mw.append(max(0, abs(power) // 1000))
+                s.voltage_mv.append(volts // 1000)
+                s.discharging.append(_read(f"{base}/status") == "Discharging")
+
+    def discharge(self, name: str, full_wh: Optional[float]) -> Discharge:
+        s = self.series[name]
+        with self._lock:
+            times, energy, power = list(s.times), list(s.energy_mwh), list(s.power_mw)
+            discharging = bool(s.discharging) and all(s.discharging)
+        window = times[-1] - times[0] if times else 0.0
+        d = Discharge(len(times), window, discharging)
+        if not discharging:
+            return d
+        pts = [(t, e) for t, e in zip(times, energy) if e]
+        if window >= MIN_FIT_SEC and len(pts) > 2 and pts[0][1] > pts[-1][1]:
+            # mWh per second to W.
+            d.rate_w, d.method = -_slope([t for t, _ in pts], [e for _, e in pts]) * 3.6, "energy"
+        else:
+            p = [v for v in power if v]
+            if p:
+                d.rate_w, d.method = sum(p) / len(p) / 1000, "power_now"
+        if d.rate_w > 0:
+            if full_wh:
+                d.runtime_min = full_wh / d.rate_w * 60
+            if energy and energy[-1]:
+                d.remaining_min = energy[-1] / 1000 / d.rate_w * 60
+        return d
+
+    def log(self, logger, parent: ET.Element, name: str, d: Discharge) -> ET.Element:
+        s = self.series[name]
+        with self._lock:
+            energy, power, volts = array("I", s.energy_mwh), array("I", s.power_mw), array("I", s.voltage_mv)
+        el = logger.add(parent, "discharge", interval=f"{self.interval:g}", samples=d.samples,
+                        window=f"{d.window:.0f}", discharging=str(d.discharging).lower(), method=d.method,
+                        rate_w=f"{d.rate_w:.2f}" if d.rate_w > 0 else "",
+                        runtime_min=f"{d.runtime_min:.0f}" if d.runtime_min is not None else "",
+                        remaining_min=f"{d.remaining_min:.0f}" if d.remaining_min is not None else "")
+        logger.add(el, "energy", " ".join(str(v) for v in energy), unit="mWh")
+        if any(power):
+            logger.add(el, "power", " ".join(str(v) for v in power), unit="mW")
+        logger.add(el, "voltage", " ".join(str(v) for v in volts), unit="mV")
+        return el
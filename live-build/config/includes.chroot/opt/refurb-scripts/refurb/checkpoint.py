@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .utils import ts
+
+# Step names as used in progress.json and REFURB_FORCE_RERUN; "auto" and
+# "interactive" stand for every step of that phase.
+AUTO_STEPS = ("cpu", "mem", "membw", "storage", "network", "battery")
+INTERACTIVE_STEPS = ("video_ports", "usb_ports", "audio", "laptop_screen", "keyboard", "wireless", "sdcard", "webcam",
+                     "physical")
+STEPS = ("delta", "audit") + AUTO_STEPS + ("erase", "handoff") + INTERACTIVE_STEPS + ("final",)
+GROUPS = {"auto": AUTO_STEPS, "interactive": INTERACTIVE_STEPS, "all": STEPS}
+
+
+def expand(names: Iterable[str]) -> Set[str]:
+    out: Set[str] = set()
+    for n in names:
+        n = n.strip()
+        if not n:
+            continue
+        if n in GROUPS:
+            out.update(GROUPS[n])
+        elif n in STEPS:
+            out.add(n)
+        else:
+            raise ValueError(f"onbekende stap: {n}")
+    return out
+
+
+class Checkpoint:
+    # Completion state of the current test cycle of one device. Every change
+    # rewrites the file atomically; a finished cycle starts over on next boot.
+    def __init__(self, path: str, on_write: Optional[Callable[[str], None]] = None) -> None:
+        self.path = path
+        self.on_write = on_write
+        self._lock = threading.Lock()
+        self.state = {"cycle": ts(), "finished": False, "steps": {}}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            if isinstance(loaded.get("steps"), dict):
+                self.state = loaded
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.state.get("finished"))
+
+    def completed(self) -> List[str]:
+        with self._lock:
+            return [s for s in STEPS if s in self.state["steps"]]
+
+    def done(self, step: str) -> bool:
+        with self._lock:
+            return step in self.state["steps"]
+
+    def get(self, step: str) -> Dict:
+        with self._lock:
+            return dict(self.state["steps"].get(step, {}))
+
+    def mark(self, step: str, ok: bool = True, **info) -> None:
+        with self._lock:
+            self.state["steps"][step] = {"ok": bool(ok), "time": ts(), **info}
+            self._write()
+
+    def reset(self, steps: Iterable[str]) -> None:
+        with self._lock:
+            for s in steps:
+                self.state["steps"].pop(s, None)
+            self._write()
+
+    def new_cycle(self) -> None:
+        with self._lock:
+            self.state = {"cycle": ts(), "finished": False, "steps": {}}
+            self._write()
+
+    def finish(self) -> None:
+        with self._lock:
+            self.state["finished"] = True
+            self._write()
+
+    def _write(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if self.on_write:
+            self.on_write(self.path)
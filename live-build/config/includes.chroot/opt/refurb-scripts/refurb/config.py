@@ -2,6 +2,57 @@ import os
 from typing import Dict
 
 
+# Built-in values; /etc/refurb.conf overrides them and environment variables
+# that are actually set override both.
+DEFAULTS: Dict[str, str] = {
+    "REFURB_SMB_URL": "//SERVER/Refurbish",
+    "REFURB_SMB_USER": "",
+    "REFURB_SMB_PASS": "",
+    "REFURB_SMB_DOMAIN": "",
+    "REFURB_MOUNTPOINT": "/mnt/refurbish",
+    "REFURB_FAST": "0",
+    "REFURB_AUDIT_REFRESH": "background",
+    "REFURB_AUDIT_RAW": "0",
+    "REFURB_FORCE_RERUN": "",
+    "REFURB_TRACE": "1",
+    "REFURB_CPU_MODE": "adaptive",
+    "REFURB_CPU_MIN_SEC": "180",
+    "REFURB_CPU_MAX_SEC": "900",
+    "REFURB_CPU_TEMP_LIMIT": "95",
+    "REFURB_BATTERY_INTERVAL": "10",
+    "REFURB_BATTERY_MAX_WEAR": "30",
+    "REFURB_BATTERY_MIN_RUNTIME": "30",
+    "REFURB_PERF_BAND": "2,98",
+    "REFURB_PERF_MIN_SAMPLES": "5",
+    "REFURB_MEM_MODE": "coverage",
+    "REFURB_MEM_COVERAGE": "0.85",
+    "REFURB_MEM_WORKERS": "0",
+    "REFURB_MEM_PASS_MBS": "1.5",
+    "REFURB_MEMBW_MIN_RATIO": "0.5",
+    "REFURB_MEMBW_FAIL_LAYOUT": "1",
+    "REFURB_AUTO_BUDGET": "1800",
+    "REFURB_SMART_TEST": "short",
+    "REFURB_DISKBENCH_SECONDS": "20",
+    "REFURB_DISKBENCH_NVME": "800,10000,5",
+    "REFURB_DISKBENCH_SSD": "200,3000,20",
+    "REFURB_DISKBENCH_HDD": "50,60,150",
+    "REFURB_ERASE": "0",
+    "REFURB_ERASE_METHOD": "auto",
+    "REFURB_ERASE_VERIFY_SAMPLES": "1024",
+    "REFURB_NET_SERVER": "",
+    "REFURB_NET_SECONDS": "10",
+    "REFURB_NET_STREAMS": "4",
+    "REFURB_NET_MIN_SPEED": "1000",
+    "REFURB_NET_MIN_RATIO": "0.7",
+    "REFURB_NET_MAX_RTT_MS": "5",
+    "REFURB_NET_MAX_RETRANS_PCT": "1",
+    "REFURB_SPOOL_DIR": "/run/refurb-spool",
+    "REFURB_SPOOL_DRAIN_TIMEOUT": "600",
+    "REFURB_CAS": "1",
+    "REFURB_INDEX_DB": "refurb-index.sqlite",
+}
+
+
 def _load_file(path: str) -> Dict[str, str]:
     conf: Dict[str, str] = {}
     if not os.path.exists(path):
@@ -21,14 +72,5 @@ def _load_file(path: str) -> Dict[str, str]:
 
 
 def load_config() -> Dict[str, str]:
-    env = {
-        "REFURB_SMB_URL": os.getenv("REFURB_SMB_URL", "//SERVER/Refurbish"),
-        "REFURB_SMB_USER": os.getenv("REFURB_SMB_USER", ""),
-        "REFURB_SMB_PASS": os.getenv("REFURB_SMB_PASS", ""),
-        "REFURB_SMB_DOMAIN": os.getenv("REFURB_SMB_DOMAIN", ""),
-        "REFURB_MOUNTPOINT": os.getenv("REFURB_MOUNTPOINT", "/mnt/refurbish"),
-        "REFURB_FAST": os.getenv("REFURB_FAST", "0"),
-    }
-    file_conf = _load_file("/etc/refurb.conf")
-    cfg = {**env, **file_conf, **env}
-    return cfg
+    env = {k: v for k in DEFAULTS if (v := os.environ.get(k)) is not None}
+    return {**DEFAULTS, **_load_file("/etc/refurb.conf"), **env}
@@ -1,24 +1,117 @@
 import xml.etree.ElementTree as ET
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
+TRACKED_CLASSES = {"processor", "memory", "display", "network", "storage", "disk", "power", "multimedia", "communication"}
+FIELDS = ("description", "product", "vendor", "serial", "size", "capacity", "clock", "version", "businfo", "slot")
+_BOGUS_SERIALS = {"", "0", "none", "unknown", "not specified", "to be filled by o.e.m.", "default string", "0000000000000000"}
 
-def _summarize_lshw(root: ET.Element) -> List[str]:
-    summary: List[str] = []
-    for node in root.findall(".//node"):
-        cls = node.get("class") or ""
-        prod = (node.findtext("product") or "").strip()
-        size = node.find("size")
-        sizev = size.text.strip() if size is not None and size.text else ""
-        if cls in {"processor", "memory", "display", "network", "storage", "disk"}:
-            summary.append(f"{cls}:{prod}:{sizev}")
-    return sorted(set(summary))
+# Which tests cover a component class, as (automated task names, interactive test names).
+TESTS_BY_CLASS: Dict[str, Tuple[Set[str], Set[str]]] = {
+    "processor": ({"cpu", "membw"}, set()),
+    "memory": ({"mem", "membw"}, set()),
+    "disk": ({"storage"}, set()),
+    "storage": ({"storage"}, set()),
+    "power": ({"battery"}, set()),
+    "display": (set(), {"video_ports", "laptop_screen"}),
+    "network": ({"network"}, {"wireless"}),
+    "communication": (set(), {"wireless"}),
+    "multimedia": (set(), {"audio", "webcam"}),
+}
+
+
+class Change:
+    def __init__(self, kind: str, key: str, cls: str, label: str, fields: Optional[Dict[str, Tuple[str, str]]] = None) -> None:
+        self.kind = kind
+        self.key = key
+        self.cls = cls
+        self.label = label
+        self.fields = fields or {}
+
+    def __str__(self) -> str:
+        if self.kind == "added":
+            return f"[+] {self.label}"
+        if self.kind == "removed":
+            return f"[-] {self.label}"
+        detail = ", ".join(f"{k}: {o or '-'} -> {n or '-'}" for k, (o, n) in sorted(self.fields.items()))
+        return f"[~] {self.label} ({detail})"
+
+
+def _lshw_root(audit: ET.Element) -> ET.Element:
+    for tag in ("list", "lshw"):
+        el = audit.find(tag)
+        if el is not None:
+            return el
+    return audit
+
+
+def _component_key(cls: str, fields: Dict[str, str], path: str) -> str:
+    serial = fields.get("serial", "")
+    if serial.strip().lower() not in _BOGUS_SERIALS:
+        return f"{cls}/serial:{serial}"
+    if fields.get("businfo"):
+        return f"{cls}/bus:{fields['businfo']}"
+    if fields.get("slot"):
+        return f"{cls}/slot:{fields['slot']}"
+    return f"{cls}/path:{path}"
+
+
+def index_components(audit: ET.Element) -> Dict[str, Tuple[str, Dict[str, str]]]:
+    # key -> (class, fields); keys prefer serial, then bus path, then slot,
+    # then the node's id path in the lshw tree.
+    index: Dict[str, Tuple[str, Dict[str, str]]] = {}
+
+    def walk(node: ET.Element, path: str) -> None:
+        for child in node.findall("node"):
+            cpath = f"{path}/{child.get('id') or ''}"
+            cls = child.get("class") or ""
+            if cls in TRACKED_CLASSES:
+                fields = {f: (child.findtext(f) or "").strip() for f in FIELDS}
+                fields = {k: v for k, v in fields.items() if v}
+                key = _component_key(cls, fields, cpath)
+                n = 1
+                while key in index:
+                    n += 1
+                    key = f"{_component_key(cls, fields, cpath)}#{n}"
+                index[key] = (cls, fields)
+            walk(child, cpath)
+
+    walk(_lshw_root(audit), "")
+    return index
+
+
+def _label(key: str, fields: Dict[str, str]) -> str:
+    desc = fields.get("product") or fields.get("description") or ""
+    return f"{key} {desc}".strip()
+
+
+def diff_components(old_xml: ET.Element, new_xml: ET.Element) -> List[Change]:
+    old = index_components(old_xml)
+    new = index_components(new_xml)
+    changes: List[Change] = []
+    for key, (cls, fields) in old.items():
+        if key not in new:
+            changes.append(Change("removed", key, cls, _label(key, fields)))
+            continue
+        nfields = new[key][1]
+        diff = {f: (fields.get(f, ""), nfields.get(f, "")) for f in set(fields) | set(nfields)
+                if fields.get(f, "") != nfields.get(f, "")}
+        if diff:
+            changes.append(Change("changed", key, cls, _label(key, nfields), diff))
+    for key, (cls, fields) in new.items():
+        if key not in old:
+            changes.append(Change("added", key, cls, _label(key, fields)))
+    return sorted(changes, key=lambda c: (c.kind, c.key))
+
+
+def tests_for_changes(changes: List[Change]) -> Tuple[Set[str], Set[str]]:
+    auto: Set[str] = set()
+    interactive: Set[str] = set()
+    for c in changes:
+        a, i = TESTS_BY_CLASS.get(c.cls, (set(), set()))
+        auto |= a
+        interactive |= i
+    return auto, interactive
 
 
 def diff_audits(old_xml: ET.Element, new_xml: ET.Element) -> List[str]:
-    old_lshw = old_xml.find("list") or old_xml.find("lshw") or old_xml
-    new_lshw = new_xml.find("list") or new_xml.find("lshw") or new_xml
-    old_summary = _summarize_lshw(old_lshw)
-    new_summary = _summarize_lshw(new_lshw)
-    removed = [f"[-] {s}" for s in old_summary if s not in new_summary]
-    added = [f"[+] {s}" for s in new_summary if s not in old_summary]
-    return removed + added
+    return [str(c) for c in diff_components(old_xml, new_xml)]
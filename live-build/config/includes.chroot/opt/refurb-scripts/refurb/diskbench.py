@@ -0,0 +1,176 @@
+import mmap
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from . import backend
+
+SEQ_BLOCK = 1024 * 1024
+RAND_BLOCK = 4096
+QUEUE_DEPTH = 4
+# (sequential MB/s, 4K random-read IOPS at QUEUE_DEPTH, p99 latency ms)
+DEFAULT_THRESHOLDS: Dict[str, Tuple[float, float, float]] = {
+    "nvme": (800.0, 10000.0, 5.0),
+    "ssd": (200.0, 3000.0, 20.0),
+    "hdd": (50.0, 60.0, 150.0),
+}
+
+
+def _sys_block(dev: str, attr: str) -> str:
+    try:
+        with open(backend.path(f"/sys/block/{os.path.basename(dev)}/{attr}"), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def interface_type(dev: str) -> str:
+    if os.path.basename(dev).startswith("nvme"):
+        return "nvme"
+    return "hdd" if _sys_block(dev, "queue/rotational") == "1" else "ssd"
+
+
+def external(dev: str) -> str:
+    # USB and other removable media: sticks and readers have no place in the
+    # internal-disk thresholds.
+    if "/usb" in os.path.realpath(backend.path(f"/sys/block/{os.path.basename(dev)}")):
+        return "usb"
+    return "removable" if _sys_block(dev, "removable") == "1" else ""
+
+
+def _open(dev: str) -> Tuple[int, bool]:
+    try:
+        return os.open(backend.path(dev), os.O_RDONLY | os.O_DIRECT), True
+    except OSError:
+        return os.open(backend.path(dev), os.O_RDONLY), False
+
+
+def _percentile(sorted_vals: List[int], pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return float(sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * pct / 100))])
+
+
+class DiskBench:
+    # Read-only benchmark: sequential 1 MiB reads, then 4K random reads from
+    # QUEUE_DEPTH threads. Buffers come from anonymous mmaps, which are page
+    # aligned as O_DIRECT requires.
+    def __init__(self, dev: str, seconds: float) -> None:
+        self.dev = dev
+        self.seconds = seconds
+        self.kind = interface_type(dev)
+        self.size = int(_sys_block(dev, "size") or 0) * 512 or self._seek_size()
+        self.align = max(RAND_BLOCK, int(_sys_block(dev, "queue/logical_block_size") or 512))
+        self.direct = False
+        self.seq_mbs = 0.0
+        self.iops = 0.0
+        self.p50_ms = 0.0
+        self.p99_ms = 0.0
+        self.error = ""
+
+    def _seek_size(self) -> int:
+        try:
+            fd = os.open(backend.path(self.dev), os.O_RDONLY)
+        except OSError:
+            return 0
+        try:
+            return os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.close(fd)
+
+    def run(self) -> None:
+        try:
+            self._sequential(self.seconds / 2)
+            self._random(self.seconds / 2)
+        except OSError as e:
+            self.error = str(e)
+
+    def _sequential(self, seconds: float) -> None:
+        fd, self.direct = _open(self.dev)
+        buf = mmap.mmap(-1, SEQ_BLOCK)
+        done = 0
+        off = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        try:
+            while time.perf_counter() < deadline:
+                n = os.preadv(fd, [buf], off)
+                if n <= 0:
+                    break
+                done += n
+                off += SEQ_BLOCK
+                if off + SEQ_BLOCK > self.size:
+                    off = 0
+        finally:
+            os.close(fd)
+            buf.close()
+        elapsed = time.perf_counter() - start
+        self.seq_mbs = done / elapsed / 1e6 if elapsed > 0 else 0.0
+
+    def _random(self, seconds: float) -> None:
+        blocks = max(1, (self.size - RAND_BLOCK) // self.align)
+        lat_us: List[array] = []
+        deadline = time.perf_counter() + seconds
+        errors: List[str] = []
+
+        def worker(seed: int) -> None:
+            rng = random.Random(seed)
+            lats = array("I")
+            lat_us.append(lats)
+            fd, _ = _open(self.dev)
+            buf = mmap.mmap(-1, RAND_BLOCK)
+            try:
+                while time.perf_counter() < deadline:
+                    off = rng.randrange(blocks) * self.align
+                    t0 = time.perf_counter_ns()
+                    os.preadv(fd, [buf], off)
+                    lats.append(min(0xFFFFFFFF, (time.perf_counter_ns() - t0) // 1000))
+            except OSError as e:
+                errors.append(str(e))
+            finally:
+                os.close(fd)
+                buf.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(QUEUE_DEPTH)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise OSError(errors[0])
+        merged = sorted(v for lats in lat_us for v in lats)
+        self.iops = len(merged) / elapsed if elapsed > 0 else 0.0
+        self.p50_ms = _percentile(merged, 50) / 1000
+        self.p99_ms = _percentile(merged, 99) / 1000
+
+    def verdict(self, thresholds: Optional[Dict[str, Tuple[float, float, float]]] = None) -> bool:
+        seq, iops, p99 = (thresholds or DEFAULT_THRESHOLDS).get(self.kind, DEFAULT_THRESHOLDS[self.kind])
+        return not self.error and self.seq_mbs >= seq and self.iops >= iops and self.p99_ms <= p99
+
+
+def bench_all(devices: List[str], seconds: float) -> List[DiskBench]:
+    benches = [DiskBench(dev, seconds) for dev in devices]
+    threads = [threading.Thread(target=b.run, name=f"refurb-diskbench-{os.path.basename(b.dev)}", daemon=True)
+               for b in benches]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(seconds * 2 + 30)
+    return benches
+
+
+def parse_thresholds(cfg: Dict[str, str]) -> Dict[str, Tuple[float, float, float]]:
+    out = dict(DEFAULT_THRESHOLDS)
+    for kind in DEFAULT_THRESHOLDS:
+        raw = cfg.get(f"REFURB_DISKBENCH_{kind.upper()}", "")
+        try:
+            seq, iops, p99 = (float(v) for v in raw.split(","))
+            out[kind] = (seq, iops, p99)
+        except ValueError:
+            pass
+    return out
@@ -0,0 +1,279 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .utils import run_cmd
+
+# Full-screen patterns, in the order they are shown. Ramps show banding and
+# uneven backlight, the 1-pixel checker and line patterns make row/column
+# inversion flicker and stuck pixels stand out.
+PATTERNS = ("red", "green", "blue", "white", "black", "gray-ramp", "rgb-ramp", "checker", "lines")
+KEYBOARD_ROWS = (
+    ("Escape", "F1", "F2", "F3", "F4", "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "Delete"),
+    ("grave", "1", "2", "3", "4", "5", "6", "7", "8", "9", "0", "minus", "equal", "BackSpace"),
+    ("Tab", "q", "w", "e", "r", "t", "y", "u", "i", "o", "p", "bracketleft", "bracketright", "backslash"),
+    ("Caps_Lock", "a", "s", "d", "f", "g", "h", "j", "k", "l", "semicolon", "apostrophe", "Return"),
+    ("Shift_L", "z", "x", "c", "v", "b", "n", "m", "comma", "period", "slash", "Shift_R"),
+    ("Control_L", "Super_L", "Alt_L", "space", "Alt_R", "Control_R", "Left", "Up", "Down", "Right"),
+)
+_LABELS = {"grave": "`", "minus": "-", "equal": "=", "bracketleft": "[", "bracketright": "]", "backslash": "\\",
+           "semicolon": ";", "apostrophe": "'", "comma": ",", "period": ".", "slash": "/", "space": "Space",
+           "BackSpace": "Bksp", "Caps_Lock": "Caps", "Escape": "Esc", "Control_L": "Ctrl", "Control_R": "Ctrl",
+           "Shift_L": "Shift", "Shift_R": "Shift", "Alt_L": "Alt", "Alt_R": "AltGr", "Super_L": "Win",
+           "Return": "Enter", "Delete": "Del", "Left": "<", "Right": ">", "Up": "^", "Down": "v"}
+_RATE = re.compile(r"(\d+\.\d+)(\*?)")
+
+
+def refresh_rates() -> Tuple[float, float]:
+    # (current, best) refresh rate of the first output's active resolution.
+    code, out, _ = run_cmd(["xrandr", "--query"], timeout=10)
+    if code != 0:
+        return 0.0, 0.0
+    for line in out.splitlines():
+        if "*" not in line or not line.startswith(" "):
+            continue
+        rates = [(float(r), bool(cur)) for r, cur in _RATE.findall(line)]
+        if rates:
+            return next((r for r, cur in rates if cur), 0.0), max(r for r, _ in rates)
+    return 0.0, 0.0
+
+
+def _hex(r: int, g: int, b: int) -> str:
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+class DisplayHarness:
+    # One fullscreen window for every display and keyboard test; each test
+    # swaps what is on the canvas and runs the Tk loop until it calls quit().
+    # Between tests the window is withdrawn so the console stays usable.
+    def __init__(self) -> None:
+        import tkinter as tk  # only when a display test actually runs
+
+        self.tk = tk
+        self.root = tk.Tk()
+        self.root.title("Refurb display test")
+        self.root.attributes("-fullscreen", True)
+        self.root.configure(cursor="none")
+        self.width = self.root.winfo_screenwidth()
+        self.height = self.root.winfo_screenheight()
+        self.canvas = tk.Canvas(self.root, width=self.width, height=self.height, highlightthickness=0, bg="black")
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self._image = None
+        self._bindings: List[str] = []
+        self.root.withdraw()
+
+    def _activate(self) -> None:
+        self.root.deiconify()
+        self.root.attributes("-fullscreen", True)
+        self.root.update()
+        self.root.focus_force()
+
+    def _park(self) -> None:
+        self._unbind_all()
+        self.root.withdraw()
+        self.root.update()
+
+    def _bind(self, seq: str, fn) -> None:
+        self.root.bind(seq, fn)
+        self._bindings.append(seq)
+
+    def _unbind_all(self) -> None:
+        for seq in self._bindings:
+            self.root.unbind(seq)
+        self._bindings = []
+
+    def _tile(self, rows: List[List[str]]):
+        tile = self.tk.PhotoImage(width=len(rows[0]), height=len(rows))
+        tile.put(" ".join("{" + " ".join(r) + "}" for r in rows))
+        return tile
+
+    def _fill(self, img, tile, y0: int, y1: int) -> None:
+        # Tk tiles the source when the -to region is larger than it.
+        img.tk.call(img, "copy", tile, "-to", 0, y0, self.width, y1)
+
+    def _ramp(self, channel: Tuple[int, int, int]) -> List[str]:
+        n = max(2, self.width)
+        return [_hex(*(c * (x * 255 // (n - 1)) for c in channel)) for x in range(self.width)]
+
+    def show(self, pattern: str) -> None:
+        self.canvas.delete("all")
+        self._image = None
+        if pattern in ("red", "green", "blue", "white", "black"):
+            self.canvas.configure(bg=pattern)
+        else:
+            img = self.tk.PhotoImage(width=self.width, height=self.height)
+            if pattern == "gray-ramp":
+                self._fill(img, self._tile([self._ramp((1, 1, 1))]), 0, self.height)
+            elif pattern == "rgb-ramp":
+                band = self.height // 3
+                for i, ch in enumerate(((1, 0, 0), (0, 1, 0), (0, 0, 1))):
+                    self._fill(img, self._tile([self._ramp(ch)]), i * band, self.height if i == 2 else (i + 1) * band)
+            elif pattern == "checker":
+                self._fill(img, self._tile([["#000000", "#ffffff"], ["#ffffff", "#000000"]]), 0, self.height)
+            elif pattern == "lines":
+                self._fill(img, self._tile([["#000000"], ["#ffffff"]]), 0, self.height)
+            self._image = img
+            self.canvas.create_image(0, 0, image=img, anchor="nw")
+        self.root.update_idletasks()
+
+    def run_patterns(self, patterns=PATTERNS, seconds: float = 3.0) -> List[str]:
+        # Space/Right: next, Left: previous, F: flag a defect on the current
+        # pattern, Escape: stop. Without a key the pattern advances by timer.
+        state = {"i": 0, "timer": None}
+        flagged: List[str] = []
+
+        def go(i: int) -> None:
+            if state["timer"] is not None:
+                self.root.after_cancel(state["timer"])
+                state["timer"] = None
+            if i >= len(patterns):
+                self.root.quit()
+                return
+            state["i"] = max(0, i)
+            self.show(patterns[state["i"]])
+            state["timer"] = self.root.after(int(seconds * 1000), lambda: go(state["i"] + 1))
+
+        def flag(_event) -> None:
+            name = patterns[state["i"]]
+            if name not in flagged:
+                flagged.append(name)
+            go(state["i"])
+            self.canvas.create_text(40, 40, text=f"Defect: {name}", fill="magenta", anchor="nw",
+                                    font=("DejaVu Sans", 24, "bold"))
+
+        self._bind("<space>", lambda e: go(state["i"] + 1))
+        self._bind("<Right>", lambda e: go(state["i"] + 1))
+        self._bind("<Left>", lambda e: go(state["i"] - 1))
+        self._bind("<KeyPress-f>", flag)
+        self._bind("<Escape>", lambda e: go(len(patterns)))
+        self._activate()
+        go(0)
+        self.root.mainloop()
+        if state["timer"] is not None:
+            self.root.after_cancel(state["timer"])
+        self._park()
+        return flagged
+
+    def frame_timing(self, frames: int = 180) -> Dict[str, str]:
+        # Paced to the mode's refresh rate; each update changes a small patch
+        # and waits for an X server round trip. Tk cannot see vblank, so the
+        # lateness is that of the updates (sleep jitter plus a stalling X
+        # server/driver), not of scanned-out frames: informational only. A
+        # low current rate points at a panel or mode problem.
+        current, best = refresh_rates()
+        hz = current or 60.0
+        period = 1.0 / hz
+        self._activate()
+        self.show("black")
+        patch = self.canvas.create_rectangle(0, 0, 64, 64, fill="#202020", width=0)
+        lateness: List[float] = []
+        start = time.perf_counter()
+        for n in range(frames):
+            deadline = start + n * period
+            wait = deadline - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self.canvas.itemconfigure(patch, fill="#404040" if n % 2 else "#202020")
+            self.root.update_idletasks()
+            self.root.winfo_pointerxy()
+            lateness.append(max(0.0, time.perf_counter() - deadline))
+        self.canvas.delete(patch)
+        self._park()
+        lateness.sort()
+        late = sum(1 for v in lateness if v > period)
+        return {
+            "current_hz": f"{current:.2f}",
+            "best_hz": f"{best:.2f}",
+            "updates": str(frames),
+            "late_updates": str(late),
+            "p50_ms": f"{lateness[len(lateness) // 2] * 1000:.2f}",
+            "p99_ms": f"{lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))] * 1000:.2f}",
+            "max_ms": f"{lateness[-1] * 1000:.2f}",
+            "refresh_ok": str(not current or current >= best - 1.0).lower(),
+            "pacing_ok": str(late <= frames // 20).lower(),
+        }
+
+    def keyboard(self, idle_timeout: float = 30.0) -> Tuple[List[str], List[str], str]:
+        # Keys light up as they are pressed. Ends on Escape three times in a
+        # row, a mouse click (a keyboard without a working Escape), or
+        # idle_timeout seconds without a key. Returns (pressed, missing, how).
+        self._activate()
+        self.canvas.delete("all")
+        self.canvas.configure(bg="#101010")
+        pressed: List[str] = []
+        keys: Dict[str, int] = {}
+        unit = self.width // 16
+        top = self.height // 4
+        for r, row in enumerate(KEYBOARD_ROWS):
+            for c, sym in enumerate(row):
+                w = unit * (5 if sym == "space" else 1)
+                x = unit // 2 + c * unit + (4 * unit if c > 3 and "space" in row else 0)
+                y = top + r * unit
+                keys[sym] = self.canvas.create_rectangle(x + 2, y + 2, x + w - 2, y + unit - 2, fill="#303030",
+                                                         outline="#606060")
+                self.canvas.create_text(x + w // 2, y + unit // 2, text=_LABELS.get(sym, sym.upper()), fill="white",
+                                        font=("DejaVu Sans", max(8, unit // 5)))
+        status = self.canvas.create_text(self.width // 2, top // 2, fill="white", font=("DejaVu Sans", 18),
+                                         text=f"Press every key. Esc 3x or click to finish "
+                                              f"(ends after {idle_timeout:.0f} s without a key).")
+        escapes = [0]
+        state = {"how": "", "timer": None}
+
+        def finish(how: str) -> None:
+            if not state["how"]:
+                state["how"] = how
+                self.root.quit()
+
+        def arm() -> None:
+            if state["timer"] is not None:
+                self.root.after_cancel(state["timer"])
+            state["timer"] = self.root.after(int(idle_timeout * 1000), lambda: finish("idle"))
+
+        def on_key(event) -> None:
+            sym = event.keysym if len(event.keysym) > 1 else event.keysym.lower()
+            escapes[0] = escapes[0] + 1 if sym == "Escape" else 0
+            if sym not in pressed:
+                pressed.append(sym)
+            if sym in keys:
+                self.canvas.itemconfigure(keys[sym], fill="#2e8b57")
+            self.canvas.itemconfigure(status, text=f"{len(pressed)} keys, last: {sym}. Esc 3x or click to finish.")
+            arm()
+            if escapes[0] >= 3:
+                finish("escape")
+
+        self._bind("<Key>", on_key)
+        self._bind("<Button-1>", lambda e: finish("click"))
+        arm()
+        self.root.mainloop()
+        if state["timer"] is not None:
+            self.root.after_cancel(state["timer"])
+        self._park()
+        missing = [k for row in KEYBOARD_ROWS for k in row if k not in pressed]
+        return pressed, missing, state["how"]
+
+    def close(self) -> None:
+        try:
+            self.root.destroy()
+        except self.tk.TclError:
+            pass
+
+
+_harness: Optional[DisplayHarness] = None
+
+
+def harness() -> Optional[DisplayHarness]:
+    # None when there is no usable display (headless runs, no X server).
+    global _harness
+    if _harness is None:
+        try:
+            _harness = DisplayHarness()
+        except Exception:
+            return None
+    return _harness
+
+
+def close() -> None:
+    global _harness
+    if _harness is not None:
+        _harness.close()
+        _harness = None
@@ -0,0 +1,475 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import random
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import backend, probe
+from .diskbench import interface_type
+from .utils import ask, run_cmd, ts
+from .xmlio import write_xml
+
+CHUNK = 8 * 1024 * 1024
+# Writers per disk, so the queue never runs dry between two chunks.
+STREAMS = 2
+VERIFY_BLOCK = 4096
+VERIFY_SAMPLES = 1024
+METHODS = ("auto", "native", "overwrite")
+# Temporary ATA user password; a completed secure erase clears it again.
+ATA_PASSWORD = "refurb"
+SANITIZE_POLL = 5.0
+# Lower bound for how fast a native erase is expected to go, for its timeout.
+MIN_NATIVE_MBS = 20.0
+
+
+def _sys_block(dev: str, attr: str) -> str:
+    try:
+        with open(backend.path(f"/sys/block/{os.path.basename(dev)}/{attr}"), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def disk_size(dev: str) -> int:
+    size = int(_sys_block(dev, "size") or 0) * 512
+    if size:
+        return size
+    try:
+        fd = os.open(backend.path(dev), os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+
+def identity(dev: str) -> Dict[str, str]:
+    return {"model": _sys_block(dev, "device/model"),
+            "serial": _sys_block(dev, "device/serial") or _sys_block(dev, "device/wwid")}
+
+
+def _listdir(path: str) -> List[str]:
+    try:
+        return os.listdir(backend.path(path))
+    except OSError:
+        return []
+
+
+def busy(dev: str) -> str:
+    # Why a disk must not be erased: mounted (the live medium is), swap, or
+    # used by device-mapper/md. Empty when it is free.
+    name = os.path.basename(dev)
+    for table, what in (("/proc/mounts", "mounted"), ("/proc/swaps", "swap")):
+        try:
+            with open(backend.path(table), "r") as f:
+                sources = [ln.split()[0] for ln in f if ln.startswith("/dev/")]
+        except OSError:
+            continue
+        if any(probe.disk_of(s) == name for s in sources):
+            return what
+    parts = [f"{p}/" for p in _listdir(f"/sys/block/{name}") if p.startswith(name)]
+    if any(_listdir(f"/sys/block/{name}/{sub}holders") for sub in [""] + parts):
+        return "in use by device-mapper/md"
+    return ""
+
+
+def candidates() -> List[Tuple[str, str]]:
+    return [(dev, busy(dev)) for dev in probe.block_devices()]
+
+
+def snapshot(dev: str) -> Tuple[int, str]:
+    # What the operator confirmed: size and serial at the time of the prompt.
+    return disk_size(dev), identity(dev)["serial"]
+
+
+def recheck(dev: str, confirmed: Tuple[int, str]) -> str:
+    # Why a confirmed disk must be skipped now: it became busy, or the name
+    # points at another disk (swapped or re-enumerated). Empty when unchanged.
+    reason = busy(dev)
+    if reason:
+        return reason
+    size, serial = snapshot(dev)
+    if not size:
+        return "disappeared"
+    if (size, serial) != confirmed:
+        was = f"{confirmed[0]} bytes {confirmed[1] or '-'}"
+        return f"changed since confirmation ({was} -> {size} bytes {serial or '-'})"
+    return ""
+
+
+def _uniform(block: bytes) -> bool:
+    return block.count(block[:1]) == len(block)
+
+
+class Erase:
+    # One disk: snapshot VERIFY_SAMPLES random blocks, erase with the drive's
+    # own sanitize/secure erase when it has one (else overwrite with zeros
+    # from STREAMS O_DIRECT writers), then read the samples back. Zeros must
+    # read back as zeros; after a native erase a sample only fails when it
+    # still holds the same non-uniform data as before.
+    def __init__(self, dev: str, method: str = "auto", samples: int = VERIFY_SAMPLES) -> None:
+        if method not in METHODS:
+            raise ValueError(f"unknown erase method: {method}")
+        self.dev = dev
+        self.name = os.path.basename(dev)
+        self.requested = method
+        self.samples = samples
+        self.size = disk_size(dev)
+        self.kind = interface_type(dev) if dev.startswith("/dev/") else "file"
+        self.method = ""
+        self.level = ""
+        self.status = "pending"
+        self.done_bytes = 0
+        self.progress = 0.0
+        self.direct = False
+        self.started = 0.0
+        self.finished = 0.0
+        self.start_time = ""
+        self.end_time = ""
+        self.output = ""
+        self.notes: List[str] = []
+        self.error = ""
+        self.verify_failed = 0
+        self.verify_read = 0
+        self.verify_nonuniform = 0
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput_mbs(self) -> float:
+        done = self.done_bytes if self.method == "overwrite" else self.size * self.progress
+        return done / self.duration / 1e6 if self.duration > 0 else 0.0
+
+    @property
+    def result(self) -> str:
+        if self.status != "done" or self.error or self.verify_failed or not self.verify_read:
+            return "failed"
+        # A native erase is only verified against samples that held data: an
+        # empty or already zeroed disk reads back the same either way.
+        if self.method != "overwrite" and not self.verify_nonuniform:
+            return "inconclusive"
+        return "passed"
+
+    @property
+    def ok(self) -> bool:
+        return self.result == "passed"
+
+    def run(self) -> None:
+        self.status = "running"
+        self.started = time.monotonic()
+        self.start_time = ts()
+        try:
+            if self.size <= 0:
+                raise OSError(f"{self.dev}: unknown size")
+            offsets = self._offsets()
+            before = self._read_blocks(offsets)
+            if self.requested == "overwrite" or not self._native():
+                if self.requested == "native":
+                    raise OSError("no native erase available: " + "; ".join(self.notes))
+                self._overwrite()
+            self._verify(offsets, before)
+            self.status = "done"
+        except OSError as e:
+            self.status = "failed"
+            self.error = str(e)
+        self.finished = time.monotonic()
+        self.end_time = ts()
+
+    def _offsets(self) -> List[int]:
+        blocks = self.size // VERIFY_BLOCK
+        rng = random.Random(f"{self.name}:{self.size}")
+        # First and last blocks hold the partition tables.
+        picks = {0, max(0, blocks - 1)} | {rng.randrange(blocks) for _ in range(min(self.samples, blocks))}
+        return sorted(b * VERIFY_BLOCK for b in picks)
+
+    def _open(self, flags: int) -> int:
+        try:
+            fd = os.open(backend.path(self.dev), flags | os.O_DIRECT)
+            self.direct = True
+            return fd
+        except OSError:
+            self.direct = False
+            return os.open(backend.path(self.dev), flags)
+
+    def _read_blocks(self, offsets: List[int]) -> Dict[int, Tuple[bytes, bool]]:
+        fd = self._open(os.O_RDONLY)
+        buf = mmap.mmap(-1, VERIFY_BLOCK)
+        out: Dict[int, Tuple[bytes, bool]] = {}
+        try:
+            if not self.direct:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            for off in offsets:
+                n = os.preadv(fd, [buf], off)
+                block = buf[:n]
+                out[off] = (hashlib.sha1(block).digest(), _uniform(block))
+        finally:
+            os.close(fd)
+            buf.close()
+        return out
+
+    def _verify(self, offsets: List[int], before: Dict[int, Tuple[bytes, bool]]) -> None:
+        after = self._read_blocks(offsets)
+        zero = hashlib.sha1(bytes(VERIFY_BLOCK)).digest()
+        failed = 0
+        for off, (digest, _) in after.items():
+            if self.method == "overwrite":
+                failed += digest != zero
+            else:
+                # Block erase reads back a fill byte, crypto erase noise.
+                was, was_uniform = before[off]
+                failed += digest == was and not was_uniform
+        self.verify_read = len(after)
+        self.verify_failed = failed
+        self.verify_nonuniform = sum(not uniform for _, uniform in before.values())
+
+    def _native(self) -> bool:
+        if self.kind == "nvme":
+            return self._nvme()
+        if self.kind in {"ssd", "hdd"}:
+            return self._ata()
+        self.notes.append(f"no native erase for {self.kind}")
+        return False
+
+    def _nvme(self) -> bool:
+        ctrl = re.sub(r"n\d+$", "", self.dev)
+        code, out, err = run_cmd(["nvme", "id-ctrl", "-o", "json", ctrl], timeout=60)
+        try:
+            info = json.loads(out)
+        except ValueError:
+            self.notes.append(f"nvme id-ctrl failed: {(err or out).strip()[:200]}")
+            return False
+        sanicap, fna = int(info.get("sanicap", 0)), int(info.get("fna", 0))
+        timeout = max(1800.0, self.size / (MIN_NATIVE_MBS * 1e6))
+        if sanicap & 0b11:
+            crypto = bool(sanicap & 0b1)
+            self.method, self.level = ("nvme-sanitize-crypto" if crypto else "nvme-sanitize-block"), "purge"
+            code, out, err = run_cmd(["nvme", "sanitize", f"--sanact={4 if crypto else 2}", ctrl], timeout=120)
+            self.output = out + err
+            if code != 0:
+                raise OSError(f"nvme sanitize failed: {(err or out).strip()[:200]}")
+            self._poll_sanitize(ctrl, timeout)
+            return True
+        crypto = bool(fna & 0b100)
+        self.method, self.level = ("nvme-format-crypto" if crypto else "nvme-format"), "purge"
+        code, out, err = run_cmd(["nvme", "format", f"--ses={2 if crypto else 1}", "--force", self.dev],
+                                 timeout=int(timeout))
+        self.output = out + err
+        if code != 0:
+            raise OSError(f"nvme format failed: {(err or out).strip()[:200]}")
+        self.progress = 1.0
+        return True
+
+    def _poll_sanitize(self, ctrl: str, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(SANITIZE_POLL)
+            _, out, _ = run_cmd(["nvme", "sanitize-log", "-o", "json", ctrl], timeout=60)
+            try:
+                log = json.loads(out)
+            except ValueError:
+                continue
+            if len(log) == 1 and isinstance(next(iter(log.values())), dict):
+                log = next(iter(log.values()))
+            state = int(log.get("sstat", 0)) & 0b111
+            self.progress = int(log.get("sprog", 0)) / 65536
+            if state in {1, 4}:
+                self.progress = 1.0
+                return
+            if state == 3:
+                raise OSError("nvme sanitize failed (sanitize log)")
+        raise OSError(f"nvme sanitize still running after {timeout:.0f}s")
+
+    def _ata(self) -> bool:
+        # USB/SAS bridges pass ATA security commands badly; only direct SATA.
+        if "/ata" not in os.path.realpath(backend.path(f"/sys/block/{self.name}")):
+            self.notes.append("not a SATA disk")
+            return False
+        code, out, err = run_cmd(["hdparm", "-I", self.dev], timeout=60)
+        if code != 0 or "Security:" not in out:
+            self.notes.append(f"hdparm -I failed: {(err or out).strip()[:200]}")
+            return False
+        sec = [" ".join(ln.split()) for ln in out.split("Security:", 1)[1].splitlines()]
+        if "supported" not in sec:
+            self.notes.append("ATA security not supported")
+            return False
+        if "frozen" in sec or "locked" in sec:
+            self.notes.append("ATA security frozen" if "frozen" in sec else "ATA security locked")
+            return False
+        enhanced = "supported: enhanced erase" in sec
+        m = re.search(r"(\d+)min for ENHANCED SECURITY ERASE" if enhanced else r"(\d+)min for SECURITY ERASE",
+                      out.split("Security:", 1)[1])
+        estimate = int(m.group(1)) * 60 if m else self.size / (MIN_NATIVE_MBS * 1e6)
+        self.method, self.level = ("ata-secure-erase-enhanced" if enhanced else "ata-secure-erase"), "purge"
+        code, out, err = run_cmd(["hdparm", "--user-master", "u", "--security-set-pass", ATA_PASSWORD, self.dev],
+                                 timeout=60)
+        if code != 0:
+            raise OSError(f"hdparm --security-set-pass failed: {(err or out).strip()[:200]}")
+        stop = threading.Event()
+
+        def estimate_progress() -> None:
+            while not stop.wait(SANITIZE_POLL):
+                self.progress = min(0.99, self.duration / estimate) if estimate else 0.0
+
+        threading.Thread(target=estimate_progress, name=f"refurb-erase-{self.name}-eta", daemon=True).start()
+        try:
+            flag = "--security-erase-enhanced" if enhanced else "--security-erase"
+            code, out, err = run_cmd(["hdparm", "--user-master", "u", flag, ATA_PASSWORD, self.dev],
+                                     timeout=int(estimate * 2 + 600))
+        finally:
+            stop.set()
+        self.output = out + err
+        if code != 0:
+            # Leave no password behind on a drive that did not erase.
+            run_cmd(["hdparm", "--user-master", "u", "--security-disable", ATA_PASSWORD, self.dev], timeout=60)
+            raise OSError(f"hdparm {flag} failed: {(err or out).strip()[:200]}")
+        self.progress = 1.0
+        return True
+
+    def _overwrite(self) -> None:
+        self.method, self.level = "overwrite", "clear"
+        fd = self._open(os.O_WRONLY)
+        buf = mmap.mmap(-1, CHUNK)
+        view = memoryview(buf)
+        errors: List[str] = []
+        state = {"next": 0}
+
+        def writer() -> None:
+            while not errors:
+                with self._lock:
+                    off = state["next"]
+                    if off >= self.size:
+                        return
+                    state["next"] = off + CHUNK
+                n = min(CHUNK, self.size - off)
+                try:
+                    while n > 0:
+                        w = os.pwritev(fd, [view[:n]], off)
+                        if w <= 0:
+                            raise OSError(f"short write at {off}")
+                        off += w
+                        n -= w
+                        with self._lock:
+                            self.done_bytes += w
+                            self.progress = self.done_bytes / self.size
+                except OSError as e:
+                    errors.append(f"{e} (offset {off})")
+
+        threads = [threading.Thread(target=writer, name=f"refurb-erase-{self.name}-{i}", daemon=True)
+                   for i in range(STREAMS)]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if not errors:
+                os.fsync(fd)
+        finally:
+            view.release()
+            buf.close()
+            os.close(fd)
+        if errors:
+            raise OSError(errors[0])
+
+    def certificate(self, device_id: str = "") -> ET.Element:
+        ident = identity(self.dev)
+        root = ET.Element("erase_certificate", {
+            "device_id": device_id, "device": self.dev, "model": ident["model"], "serial": ident["serial"],
+            "size_bytes": str(self.size), "interface": self.kind, "method": self.method,
+            # NIST SP 800-88 sanitization level reached by the method.
+            "nist_800_88": self.level, "started": self.start_time, "finished": self.end_time,
+            "duration_s": f"{self.duration:.0f}", "throughput_mbs": f"{self.throughput_mbs:.1f}",
+            "direct_io": str(self.direct).lower(), "result": self.result})
+        ET.SubElement(root, "verify", {"samples": str(self.verify_read), "block": str(VERIFY_BLOCK),
+                                       "failed": str(self.verify_failed),
+                                       "nonuniform_before": str(self.verify_nonuniform)})
+        for note in self.notes:
+            ET.SubElement(root, "note").text = note
+        if self.output:
+            ET.SubElement(root, "tool").text = self.output[-4000:]
+        if self.error:
+            ET.SubElement(root, "error").text = self.error
+        return root
+
+
+def progress_line(erases: List[Erase]) -> str:
+    parts = []
+    for e in erases:
+        if e.status == "running":
+            parts.append(f"{e.name} {e.method or 'preparing'} {e.progress:.0%} {e.throughput_mbs:.0f} MB/s")
+        else:
+            parts.append(f"{e.name} {e.status}")
+    return " | ".join(parts)
+
+
+def run_all(erases: List[Erase], report: Optional[Callable[[List[Erase]], None]] = None,
+            interval: float = 30.0) -> List[Erase]:
+    threads = [threading.Thread(target=e.run, name=f"refurb-erase-{e.name}", daemon=True) for e in erases]
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(interval / len(threads))
+        if report is not None and any(t.is_alive() for t in threads):
+            report(erases)
+    return erases
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="python3 -m refurb.erase",
+                                 description="Erase disks in parallel and write an erase certificate per disk")
+    ap.add_argument("devices", nargs="*", help="devices or image files (default: every free disk)")
+    ap.add_argument("--method", choices=METHODS, default="auto")
+    ap.add_argument("--samples", type=int, default=VERIFY_SAMPLES, help="blocks read back for verification")
+    ap.add_argument("--out", default=".", help="directory for the erase_<disk>.xml certificates")
+    ap.add_argument("--id", default="", help="device ID recorded in the certificates")
+    ap.add_argument("--interval", type=float, default=2.0, help="seconds between progress lines")
+    ap.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    args = ap.parse_args(argv)
+
+    devices = args.devices
+    if not devices:
+        for dev, reason in candidates():
+            if reason:
+                print(f"{dev}: skipped ({reason})")
+            else:
+                devices.append(dev)
+    if not devices:
+        print("No disks to erase.")
+        return 1
+    confirmed = {dev: snapshot(dev) for dev in devices}
+    for dev in devices:
+        print(f"{dev}: {disk_size(dev) / 1e9:.1f} GB {' '.join(v for v in identity(dev).values() if v)}")
+    if not args.yes and ask("Type 'ERASE' to destroy all data on these devices: ").strip() != "ERASE":
+        return 1
+    for dev in list(devices):
+        reason = recheck(dev, confirmed[dev]) if dev.startswith("/dev/") else ""
+        if reason:
+            print(f"{dev}: skipped ({reason})")
+            devices.remove(dev)
+    if not devices:
+        return 1
+    erases = run_all([Erase(d, args.method, args.samples) for d in devices], lambda es: print(progress_line(es)),
+                     args.interval)
+    for e in erases:
+        path = os.path.join(os.path.abspath(args.out), f"erase_{e.name}.xml")
+        write_xml(path, e.certificate(args.id))
+        print(f"{e.dev}: {e.result if e.ok else e.result.upper()} {e.method} {e.duration:.0f}s "
+              f"{e.throughput_mbs:.0f} MB/s verify {e.verify_read - e.verify_failed}/{e.verify_read} {e.error}")
+    return 0 if all(e.ok for e in erases) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from . import backend
+
+DMI_FIELDS = ("sys_vendor", "product_name", "product_serial", "product_uuid", "board_vendor", "board_name",
+              "board_serial", "chassis_serial", "bios_version")
+SUPPLY_FIELDS = ("type", "manufacturer", "model_name", "serial_number", "energy_full_design", "charge_full_design")
+_SKIP_BLOCK = ("loop", "ram", "zram", "sr", "dm-", "md", "fd")
+
+
+def _read(path: str) -> str:
+    try:
+        with open(backend.path(path), "r", errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _listdir(path: str) -> List[str]:
+    try:
+        return sorted(os.listdir(backend.path(path)))
+    except OSError:
+        return []
+
+
+def _dmi() -> Dict[str, str]:
+    return {f: _read(f"/sys/class/dmi/id/{f}") for f in DMI_FIELDS}
+
+
+def _block() -> List[Dict[str, str]]:
+    disks = []
+    for name in _listdir("/sys/block"):
+        base = f"/sys/block/{name}"
+        if name.startswith(_SKIP_BLOCK) or _read(f"{base}/removable") == "1":
+            continue
+        disks.append({
+            "name": name,
+            "size": _read(f"{base}/size"),
+            "model": _read(f"{base}/device/model"),
+            "serial": _read(f"{base}/device/serial") or _read(f"{base}/serial"),
+            "wwid": _read(f"{base}/device/wwid") or _read(f"{base}/wwid"),
+        })
+    return disks
+
+
+def _meminfo() -> str:
+    for line in _read("/proc/meminfo").splitlines():
+        if line.startswith("MemTotal:"):
+            # Firmware/kernel reservations wobble a little between boots.
+            return str(int(line.split()[1]) // (64 * 1024))
+    return ""
+
+
+def _cpu() -> str:
+    models = [ln.split(":", 1)[1].strip() for ln in _read("/proc/cpuinfo").splitlines() if ln.startswith("model name")]
+    return f"{models[0]} x{len(models)}" if models else ""
+
+
+def _pci() -> List[str]:
+    devs = []
+    for slot in _listdir("/sys/bus/pci/devices"):
+        base = f"/sys/bus/pci/devices/{slot}"
+        devs.append(f"{slot} {_read(base + '/vendor')}:{_read(base + '/device')} {_read(base + '/class')}")
+    return devs
+
+
+def _power_supply() -> List[Dict[str, str]]:
+    out = []
+    for name in _listdir("/sys/class/power_supply"):
+        base = f"/sys/class/power_supply/{name}"
+        entry = {"name": name}
+        entry.update({f: _read(f"{base}/{f}") for f in SUPPLY_FIELDS})
+        out.append({k: v for k, v in entry.items() if v})
+    return out
+
+
+def collect() -> Dict[str, object]:
+    return {
+        "dmi": _dmi(),
+        "cpu": _cpu(),
+        "mem_total_64m": _meminfo(),
+        "block": _block(),
+        "pci": _pci(),
+        "power_supply": _power_supply(),
+    }
+
+
+def digest(fp: Dict[str, object]) -> str:
+    return hashlib.sha256(json.dumps(fp, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load(path: str) -> Optional[Dict[str, object]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(path: str, fp: Dict[str, object]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"digest": digest(fp), "components": fp}, f, sort_keys=True, indent=1)
+    os.replace(tmp, path)
+
+
+def matches(path: str, fp: Dict[str, object]) -> bool:
+    stored = load(path)
+    return bool(stored) and stored.get("digest") == digest(fp)
@@ -0,0 +1,332 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .cas import MANIFEST_SUFFIX, open_stream
+from .config import load_config
+from .delta import TRACKED_CLASSES
+
+# Which files of an ID-<device> folder are indexed, by kind.
+FILES = {
+    "audit_baseline.xml": "audit",
+    "auto_test.xml": "auto",
+    "interactive_test.xml": "interactive",
+    "summary.xml": "summary",
+}
+COMMIT_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, device TEXT NOT NULL, kind TEXT NOT NULL,
+    mtime REAL NOT NULL, size INTEGER NOT NULL, error TEXT
+);
+CREATE TABLE IF NOT EXISTS devices (
+    device TEXT PRIMARY KEY, vendor TEXT, model TEXT, serial TEXT, audited TEXT, status TEXT, notes TEXT
+);
+CREATE TABLE IF NOT EXISTS components (
+    file TEXT NOT NULL, device TEXT NOT NULL, class TEXT, path TEXT, product TEXT, vendor TEXT,
+    serial TEXT, size TEXT, description TEXT
+);
+CREATE TABLE IF NOT EXISTS disks (
+    file TEXT NOT NULL, device TEXT NOT NULL, dev TEXT, model TEXT, serial TEXT, smart_ok INTEGER,
+    smart_passed INTEGER, power_on_hours INTEGER, temperature_c INTEGER
+);
+CREATE TABLE IF NOT EXISTS batteries (
+    file TEXT NOT NULL, device TEXT NOT NULL, name TEXT, model TEXT, serial TEXT, capacity_pct INTEGER,
+    energy_full_wh REAL, energy_full_design_wh REAL, wear_pct REAL, cycle_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    file TEXT NOT NULL, device TEXT NOT NULL, tag TEXT NOT NULL, test TEXT, action TEXT, ok INTEGER,
+    status TEXT, time TEXT, attrs TEXT
+);
+CREATE INDEX IF NOT EXISTS components_file ON components(file);
+CREATE INDEX IF NOT EXISTS components_device ON components(device);
+CREATE INDEX IF NOT EXISTS disks_file ON disks(file);
+CREATE INDEX IF NOT EXISTS disks_device ON disks(device);
+CREATE INDEX IF NOT EXISTS batteries_file ON batteries(file);
+CREATE INDEX IF NOT EXISTS batteries_device ON batteries(device);
+CREATE INDEX IF NOT EXISTS results_file ON results(file);
+CREATE INDEX IF NOT EXISTS results_device ON results(device, tag);
+CREATE INDEX IF NOT EXISTS devices_model ON devices(model);
+"""
+_PER_FILE = ("components", "disks", "batteries", "results")
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def _bool(v: Optional[str]) -> Optional[int]:
+    return None if v in (None, "") else int(v == "true")
+
+
+def _num(v: Optional[str], conv=int):
+    try:
+        return conv(v) if v not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _iter_top(stream) -> Iterable[Tuple[ET.Element, ET.Element, int]]:
+    # (root, element, depth) for every end event; top-level elements are
+    # dropped from the root once handled so memory stays flat.
+    depth = 0
+    root = None
+    for event, el in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = el
+            depth += 1
+            continue
+        depth -= 1
+        yield root, el, depth
+        if depth == 1:
+            root.clear()
+
+
+def _parse_audit(db: sqlite3.Connection, file: str, device: str, stream) -> None:
+    ids: List[str] = []
+    system: Dict[str, str] = {}
+    dmi: Dict[str, str] = {}
+    audited = None
+    comps, disks, bats = [], [], []
+    for event, el in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if audited is None:
+                audited = el.get("time") or ""
+            if el.tag == "node":
+                ids.append(el.get("id") or "")
+            continue
+        if el.tag == "node":
+            cls = el.get("class") or ""
+            fields = {f: (el.findtext(f) or "").strip() for f in ("product", "vendor", "serial", "size", "description")}
+            if cls == "system" and not system:
+                system = fields
+            if cls in TRACKED_CLASSES:
+                comps.append((file, device, cls, "/".join(ids), fields["product"], fields["vendor"], fields["serial"],
+                              fields["size"], fields["description"]))
+            ids.pop()
+            el.clear()
+        elif el.tag == "dmi":
+            dmi = dict(el.attrib)
+        elif el.tag == "disk" and el.get("device"):
+            a = el.attrib
+            disks.append((file, device, a.get("device"), a.get("model"), a.get("serial"), _bool(a.get("smart_ok")),
+                          _bool(a.get("smart_passed")), _num(a.get("power_on_hours")), _num(a.get("temperature_c"))))
+            el.clear()
+        elif el.tag == "upower" and el.get("name"):
+            a = el.attrib
+            bats.append((file, device, a.get("name"), a.get("model"), a.get("serial"), _num(a.get("capacity_pct")),
+                         _num(a.get("energy_full_wh"), float), _num(a.get("energy_full_design_wh"), float),
+                         _num(a.get("wear_pct"), float), _num(a.get("cycle_count"))))
+            el.clear()
+    db.executemany("INSERT INTO components VALUES (?,?,?,?,?,?,?,?,?)", comps)
+    db.executemany("INSERT INTO disks VALUES (?,?,?,?,?,?,?,?,?)", disks)
+    db.executemany("INSERT INTO batteries VALUES (?,?,?,?,?,?,?,?,?,?)", bats)
+    db.execute("UPDATE devices SET vendor=?, model=?, serial=?, audited=? WHERE device=?",
+               (dmi.get("sys_vendor") or system.get("vendor"), dmi.get("product_name") or system.get("product"),
+                dmi.get("product_serial") or system.get("serial"), audited, device))
+
+
+def _parse_log(db: sqlite3.Connection, file: str, device: str, stream) -> None:
+    rows = []
+    for _, el, depth in _iter_top(stream):
+        if depth != 1:
+            continue
+        a = dict(el.attrib)
+        # "schedule" rows carry the final verdict of each automated task.
+        test = a.pop("task", None) if el.tag == "schedule" else el.tag
+        rows.append((file, device, el.tag, test, a.pop("action", None), _bool(a.pop("ok", None)),
+                     a.pop("status", None), a.pop("time", None), json.dumps(a, separators=(",", ":")) if a else None))
+        if len(rows) >= COMMIT_EVERY:
+            db.executemany("INSERT INTO results VALUES (?,?,?,?,?,?,?,?,?)", rows)
+            rows = []
+    db.executemany("INSERT INTO results VALUES (?,?,?,?,?,?,?,?,?)", rows)
+
+
+def _parse_summary(db: sqlite3.Connection, file: str, device: str, stream) -> None:
+    status = notes = None
+    for _, el, depth in _iter_top(stream):
+        if depth == 1 and el.tag == "status":
+            status = (el.text or "").strip()
+        elif depth == 1 and el.tag == "notes":
+            notes = (el.text or "").strip()
+    db.execute("UPDATE devices SET status=?, notes=? WHERE device=?", (status, notes, device))
+
+
+_PARSERS = {"audit": _parse_audit, "auto": _parse_log, "interactive": _parse_log, "summary": _parse_summary}
+
+
+def _scan(root: str) -> Iterable[Tuple[str, str, str, os.stat_result]]:
+    # (device, kind, path, stat) for every indexable file under the mountpoint;
+    # a "<name>.cas" manifest stands in for the XML it describes.
+    with os.scandir(root) as top:
+        for d in top:
+            if not d.name.startswith("ID-") or not d.is_dir(follow_symlinks=False):
+                continue
+            device = d.name[3:]
+            try:
+                with os.scandir(d.path) as it:
+                    entries = {e.name: e for e in it}
+            except OSError:
+                continue
+            for name, kind in FILES.items():
+                e = entries.get(name + MANIFEST_SUFFIX) or entries.get(name)
+                if e is None:
+                    continue
+                try:
+                    yield device, kind, e.path, e.stat()
+                except OSError:
+                    continue
+
+
+def _forget(db: sqlite3.Connection, path: str) -> None:
+    for table in _PER_FILE:
+        db.execute(f"DELETE FROM {table} WHERE file=?", (path,))
+
+
+def update(db: sqlite3.Connection, root: str) -> Dict[str, int]:
+    known = {p: (m, s) for p, m, s in db.execute("SELECT path, mtime, size FROM files")}
+    seen = set()
+    counts = {"indexed": 0, "unchanged": 0, "removed": 0, "errors": 0}
+    pending = 0
+    for device, kind, path, st in _scan(root):
+        seen.add(path)
+        if known.get(path) == (st.st_mtime, st.st_size):
+            counts["unchanged"] += 1
+            continue
+        _forget(db, path)
+        db.execute("INSERT OR IGNORE INTO devices(device) VALUES (?)", (device,))
+        error = None
+        try:
+            with open_stream(path) as stream:
+                _PARSERS[kind](db, path, device, stream)
+        except (OSError, ValueError, KeyError, ET.ParseError) as e:
+            # Keep the row so an unreadable file is retried only once it changes.
+            error = str(e) or type(e).__name__
+            counts["errors"] += 1
+        db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?)",
+                   (path, device, kind, st.st_mtime, st.st_size, error))
+        counts["indexed"] += 1
+        pending += 1
+        if pending >= COMMIT_EVERY:
+            db.commit()
+            pending = 0
+    for path in set(known) - seen:
+        _forget(db, path)
+        db.execute("DELETE FROM files WHERE path=?", (path,))
+        counts["removed"] += 1
+    db.execute("DELETE FROM devices WHERE device NOT IN (SELECT device FROM files)")
+    db.commit()
+    return counts
+
+
+UNITS_SQL = """
+SELECT d.device, d.vendor, d.model, d.serial, d.status,
+       (SELECT MIN(k.smart_passed) FROM disks k WHERE k.device = d.device) AS smart_passed,
+       (SELECT MAX(b.wear_pct) FROM batteries b WHERE b.device = d.device) AS battery_wear_pct,
+       (SELECT MIN(r.ok) FROM results r WHERE r.device = d.device AND r.tag = 'schedule') AS auto_ok
+FROM devices d
+"""
+
+PASS_RATES_SQL = """
+SELECT d.model, COUNT(*) AS units,
+       SUM(s.failed IS NOT NULL) AS tested,
+       SUM(s.failed = 0) AS passed,
+       ROUND(100.0 * SUM(s.failed = 0) / MAX(SUM(s.failed IS NOT NULL), 1), 1) AS pass_pct
+FROM devices d
+LEFT JOIN (SELECT device, MAX(ok = 0) AS failed FROM results WHERE tag = 'schedule' GROUP BY device) s
+       ON s.device = d.device
+GROUP BY d.model ORDER BY units DESC
+"""
+
+
+def units(db: sqlite3.Connection, model: str = "", smart_failed: bool = False, wear_above: Optional[float] = None,
+          status: str = "") -> sqlite3.Cursor:
+    where, args = [], []
+    if model:
+        where.append("d.model LIKE ?")
+        args.append(f"%{model}%")
+    if status:
+        where.append("d.status = ?")
+        args.append(status)
+    if smart_failed:
+        where.append("(EXISTS (SELECT 1 FROM disks k WHERE k.device = d.device AND k.smart_passed = 0)"
+                     " OR EXISTS (SELECT 1 FROM results r WHERE r.device = d.device AND r.tag = 'storage_test'"
+                     " AND r.action = 'smart_health' AND r.ok = 0))")
+    if wear_above is not None:
+        where.append("EXISTS (SELECT 1 FROM batteries b WHERE b.device = d.device AND b.wear_pct > ?)")
+        args.append(wear_above)
+    sql = UNITS_SQL + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY d.model, d.device"
+    return db.execute(sql, args)
+
+
+def _emit(cur: sqlite3.Cursor, as_csv: bool, out=sys.stdout) -> int:
+    cols = [c[0] for c in cur.description or ()]
+    rows = cur.fetchall()
+    if as_csv:
+        w = csv.writer(out)
+        w.writerow(cols)
+        w.writerows(rows)
+        return len(rows)
+    cells = [["" if v is None else str(v) for v in r] for r in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(cols)]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)), file=out)
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)), file=out)
+    return len(rows)
+
+
+def main(argv: Sequence[str]) -> int:
+    cfg = load_config()
+    ap = argparse.ArgumentParser(prog="python3 -m refurb.index", description="SQLite index over the refurb share")
+    ap.add_argument("--db", default=cfg.get("REFURB_INDEX_DB", "refurb-index.sqlite"))
+    ap.add_argument("--root", default=cfg["REFURB_MOUNTPOINT"], help="mountpoint with the ID-* folders")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("update", help="index new and changed files")
+    p = sub.add_parser("units", help="list units, optionally filtered")
+    p.add_argument("--model", default="")
+    p.add_argument("--status", default="")
+    p.add_argument("--smart-failed", action="store_true")
+    p.add_argument("--wear-above", type=float)
+    p.add_argument("--csv", action="store_true")
+    p = sub.add_parser("pass-rates", help="automated test pass rate per model")
+    p.add_argument("--csv", action="store_true")
+    p = sub.add_parser("sql", help="run a read-only query")
+    p.add_argument("query")
+    p.add_argument("--csv", action="store_true")
+    args = ap.parse_args(argv)
+
+    db = connect(args.db)
+    try:
+        if args.cmd == "update":
+            started = time.monotonic()
+            counts = update(db, args.root)
+            print(" ".join(f"{k}={v}" for k, v in counts.items()) + f" in {time.monotonic() - started:.1f}s")
+            return 0
+        if args.cmd == "units":
+            n = _emit(units(db, args.model, args.smart_failed, args.wear_above, args.status), args.csv)
+        elif args.cmd == "pass-rates":
+            n = _emit(db.execute(PASS_RATES_SQL), args.csv)
+        else:
+            db.execute("PRAGMA query_only=ON")
+            n = _emit(db.execute(args.query), args.csv)
+        if not args.csv:
+            print(f"({n} rijen)", file=sys.stderr)
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -1,103 +1,203 @@
+import os
 import threading
 import time
-import tkinter as tk
-from typing import List
+from typing import Callable, Dict, List, Set
 
-from .utils import run_cmd, ts
-
-
-def _prompt(msg: str) -> None:
-    try:
-        input(msg)
-    except EOFError:
-        pass
+from . import backend, display, probe, runner, uevent
+from .utils import ask, pause, run_cmd, ts
 
 
 def test_video_ports(logger) -> None:
     logger.append("video_ports", time=ts(), action="start")
-    code, out, _ = run_cmd(["bash", "-lc", "DISPLAY=:0 xrandr --query || true"]) 
-    logger.append("video_ports", time=ts(), action="ports", output=(out.strip() or "n/a"))
+    connectors = ", ".join(f"{name}:{status}" for name, status in probe.drm_connectors())
+    code, out, _ = run_cmd(["xrandr", "--query"])
+    logger.append("video_ports", time=ts(), action="ports", connectors=connectors or "n/a", output=(out.strip() or "n/a"))
     print("Video Ports Test: connect a display to each port and confirm signal.")
-    _prompt("Press ENTER after validating all ports...")
+    pause("Press ENTER after validating all ports...")
     logger.append("video_ports", time=ts(), action="end")
 
 
-def test_usb_ports(logger) -> None:
-    logger.append("usb_ports", time=ts(), action="start")
-    print("USB Ports Test: We will monitor udev for USB add/remove events.")
-    print("Plug and unplug a USB device in each port.")
-    print("Press Ctrl+C when finished or wait 20 seconds of inactivity.")
+def _udev_events(on_event) -> Callable[[str], None]:
+    # Turns "udevadm monitor --property" output into one dict per event.
+    props: Dict[str, str] = {}
+
+    def on_line(line: str) -> None:
+        if not line.strip():
+            if "ACTION" in props:
+                on_event(dict(props))
+            props.clear()
+        elif "=" in line:
+            k, v = line.split("=", 1)
+            props[k] = v
+    return on_line
 
-    def monitor():
-        run_cmd(["bash", "-lc", "udevadm monitor --udev --subsystem-match=usb --property --env | head -n 1000"],)
 
-    t = threading.Thread(target=monitor, daemon=True)
+def _monitor(subsystem: str, on_event, cancel: runner.Cancel, timeout: float) -> threading.Thread:
+    cmd = ["udevadm", "monitor", "--udev", f"--subsystem-match={subsystem}", "--property"]
+    t = threading.Thread(target=runner.run, args=(cmd,),
+                         kwargs={"timeout": timeout, "on_line": _udev_events(on_event), "cancel": cancel,
+                                 "max_output": 256 * 1024},
+                         name=f"refurb-udev-{subsystem}", daemon=True)
     t.start()
+    return t
+
+
+def _listen(subsystem: str, on_event) -> Callable[[], None]:
+    # Netlink in-process (the udev group adds ID_PATH/ID_MODEL once udevd has
+    # processed the event); one long-lived udevadm reader as a fallback.
+    # Returns the function that stops listening.
+    stop = backend.active().uevents(subsystem, on_event)
+    if stop is not None:
+        return stop
+    group = uevent.GROUP_UDEV if os.path.exists("/run/udev/control") else uevent.GROUP_KERNEL
+    lst = uevent.listener(group)
+    if lst is not None:
+        def on_uevent(ev: Dict[str, str]) -> None:
+            if ev.get("SUBSYSTEM") == subsystem:
+                on_event(ev)
+        lst.subscribe(on_uevent)
+        return lambda: lst.unsubscribe(on_uevent)
+    cancel = runner.Cancel()
+    t = _monitor(subsystem, on_event, cancel, timeout=3600)
+
+    def stop() -> None:
+        cancel.cancel()
+        t.join(5)
+    return stop
+
+
+def _port_line(ports: List[probe.UsbPort], hits: Dict[int, Dict[str, str]], occupied: Set[int]) -> str:
+    cells = [f"[{i + 1}:{'OK' if i in hits else 'in' if i in occupied else '..'}]" for i in range(len(ports))]
+    return f"\r  {' '.join(cells)}  {len(hits)}/{len(ports)} "
+
+
+def test_usb_ports(logger, idle_timeout: float = 20.0) -> None:
+    fixed = set(probe.usb_fixed_ports())
+    ports = [p for p in probe.usb_ports() if not p.internal and not fixed & set(p.names)]
+    by_name = {n: i for i, p in enumerate(ports) for n in p.names}
+    logger.append("usb_ports", time=ts(), action="start", expected=len(ports))
+    print("USB Ports Test: plug a USB device into each port in turn.")
+    print(f"The test ends when all {len(ports)} ports were seen, after {idle_timeout:.0f} s without activity, "
+          "or on Ctrl+C." if ports else f"No ports found in sysfs; ends after {idle_timeout:.0f} s without activity.")
+    hits: Dict[int, Dict[str, str]] = {}
+    # Ports that already hold a device are not verified by it: they stay
+    # "occupied" until a device is plugged in there during the test. Only the
+    # port of the boot stick, which cannot be unplugged, counts as seen.
+    boot = set(probe.boot_usb_ports())
+    occupied: Set[int] = set()
+    for root, name in probe.usb_present().items():
+        idx = by_name.get(root)
+        if idx is None or idx in hits or idx in occupied:
+            continue
+        info = {"root_port": root, "devpath": name, "id_path": "", "speed": probe.usb_speed(name),
+                "product": probe.usb_product(name)}
+        logger.append("usb_ports", time=ts(), action="occupied", port=str(idx + 1), boot=str(root in boot).lower(),
+                      **info)
+        if root in boot:
+            hits[idx] = dict(info, status="boot")
+        else:
+            occupied.add(idx)
+    if occupied:
+        print(f"Already holding a device: port(s) {', '.join(str(i + 1) for i in sorted(occupied))}. "
+              "Unplug it and plug a device in again to verify the port.")
+    changed = threading.Event()
+    lock = threading.Lock()
+    last = [time.monotonic()]
+
+    def on_event(ev: Dict[str, str]) -> None:
+        if ev.get("DEVTYPE") != "usb_device" or ev.get("ACTION") not in ("add", "remove"):
+            return
+        devpath = ev.get("DEVPATH", "")
+        root = probe.usb_port_of(devpath)
+        with lock:
+            last[0] = time.monotonic()
+            if ev["ACTION"] != "add":
+                return
+            idx = by_name.get(root)
+            info = {
+                "root_port": root,
+                "devpath": devpath,
+                "id_path": ev.get("ID_PATH", ""),
+                "speed": probe.usb_speed(devpath),
+                "product": ev.get("ID_MODEL", ev.get("PRODUCT", "")),
+            }
+            logger.append("usb_ports", time=ts(), action="add", port=str(idx + 1) if idx is not None else "", **info)
+            if idx is not None and idx not in hits:
+                hits[idx] = info
+            changed.set()
+
+    stop = _listen("usb", on_event)
+    shown = ""
     try:
-        time.sleep(20)
+        while len(hits) < len(ports) or not ports:
+            line = _port_line(ports, hits, occupied)
+            if line != shown:
+                print(line, end="", flush=True)
+                shown = line
+            changed.wait(0.5)
+            changed.clear()
+            with lock:
+                if time.monotonic() - last[0] >= idle_timeout:
+                    break
     except KeyboardInterrupt:
         pass
-    logger.append("usb_ports", time=ts(), action="end")
+    finally:
+        stop()
+    print(_port_line(ports, hits, occupied))
+    for i, p in enumerate(ports):
+        info = hits.get(i, {})
+        status = info.get("status", "ok") if i in hits else "occupied" if i in occupied else "missing"
+        logger.append("usb_port", time=ts(), port=str(i + 1), names=",".join(p.names), connect_type=p.connect_type,
+                      ok=str(i in hits).lower(), status=status, speed=info.get("speed", ""),
+                      id_path=info.get("id_path", ""), product=info.get("product", ""))
+    logger.append("usb_ports", time=ts(), action="end", expected=len(ports), seen=len(hits),
+                  occupied=len(occupied - set(hits)))
 
 
 def test_audio(logger) -> None:
     logger.append("audio", time=ts(), action="start")
     print("Audio Test: you'll hear white noise on speakers. Adjust volume.")
-    run_cmd(["bash", "-lc", "speaker-test -t pink -l 1 || true"]) 
-    _prompt("Did you hear audio on speakers/headphones? Press ENTER to continue...")
+    run_cmd(["speaker-test", "-t", "pink", "-l", "1"])
+    pause("Did you hear audio on speakers/headphones? Press ENTER to continue...")
     logger.append("audio", time=ts(), action="end")
 
 
-def _color_screen(color: str, seconds: int = 3) -> None:
-    win = tk.Tk()
-    win.title(f"Screen Test - {color}")
-    win.attributes("-fullscreen", True)
-    frame = tk.Frame(win, bg=color)
-    frame.pack(fill=tk.BOTH, expand=True)
-    win.update()
-    win.after(seconds * 1000, win.destroy)
-    win.mainloop()
-
-
 def laptop_screen_test(logger) -> None:
     logger.append("laptop_screen", time=ts(), action="start")
-    print("Internal Screen Test: watch for dead pixels/backlight bleed.")
-    for c in ["red", "green", "blue", "white", "black"]:
-        _color_screen(c)
-    logger.append("laptop_screen", time=ts(), action="end")
+    h = display.harness()
+    if h is None:
+        logger.append("laptop_screen", time=ts(), action="end", ok="false", error="no display")
+        return
+    print("Internal Screen Test: watch for dead pixels, backlight bleed and flicker.")
+    print("Space/Right: next, Left: back, F: mark defect, Esc: stop.")
+    timing = h.frame_timing()
+    logger.append("laptop_screen", time=ts(), action="timing", **timing)
+    flagged = h.run_patterns()
+    ok = not flagged and timing["refresh_ok"] == "true"
+    logger.append("laptop_screen", time=ts(), action="end", ok=str(ok).lower(), flagged=",".join(flagged))
 
 
 def keyboard_tester(logger) -> None:
     logger.append("keyboard", time=ts(), action="start")
-    pressed: List[str] = []
-
-    def on_key(event):
-        k = event.keysym
-        if k not in pressed:
-            pressed.append(k)
-        lbl.config(text=f"Keys pressed: {', '.join(pressed)}")
-
-    win = tk.Tk()
-    win.title("Keyboard Tester - press all keys")
-    win.geometry("800x400")
-    lbl = tk.Label(win, text="Press keys. Close window when done.", font=("Arial", 16))
-    lbl.pack(pady=40)
-    win.bind("<Key>", on_key)
-    win.mainloop()
-    logger.append("keyboard", time=ts(), action="end", count=len(pressed))
+    h = display.harness()
+    if h is None:
+        logger.append("keyboard", time=ts(), action="end", ok="false", error="no display")
+        return
+    print("Keyboard Test: press every key; Esc 3x or a mouse click ends it.")
+    pressed, missing, how = h.keyboard()
+    logger.append("keyboard", time=ts(), action="end", ok=str(not missing).lower(), ended=how, count=len(pressed),
+                  missing=",".join(missing))
 
 
 def wifi_bluetooth_test(logger) -> None:
     logger.append("wireless", time=ts(), action="start")
-    code, out, _ = run_cmd(["bash", "-lc", "iw dev | awk '$1==\"Interface\"{print $2}'"])
-    ifaces = [ln.strip() for ln in out.splitlines() if ln.strip()]
-    for iface in ifaces:
-        code, so, _ = run_cmd(["bash", "-lc", f"iw dev {iface} scan | egrep 'SSID|signal' | head -n 40 || true"])
-        logger.append("wifi", time=ts(), iface=iface, scan=(so.strip() or "n/a"))
-    code, out, _ = run_cmd(["bash", "-lc", "which bluetoothctl >/dev/null 2>&1 && echo yes || echo no"])
-    if out.strip() == "yes":
-        code, bo, _ = run_cmd(["bash", "-lc", "bluetoothctl --timeout 10 scan on | sed -n '1,200p' || true"])
-        logger.append("bluetooth", time=ts(), scan=bo.strip() or "n/a")
+    for iface in probe.wireless_interfaces():
+        code, so, _ = run_cmd(["iw", "dev", iface, "scan"], timeout=30)
+        lines = [ln.strip() for ln in so.splitlines() if "SSID" in ln or "signal" in ln][:40]
+        logger.append("wifi", time=ts(), iface=iface, scan=("\n".join(lines) or "n/a"))
+    if probe.has_bin("bluetoothctl"):
+        code, bo, _ = run_cmd(["bluetoothctl", "--timeout", "10", "scan", "on"], timeout=20)
+        logger.append("bluetooth", time=ts(), scan="\n".join(bo.strip().splitlines()[:200]) or "n/a")
     else:
         logger.append("bluetooth", time=ts(), scan="unsupported")
     logger.append("wireless", time=ts(), action="end")
@@ -105,16 +205,35 @@ def wifi_bluetooth_test(logger) -> None:
 
 def webcam_test(logger) -> None:
     logger.append("webcam", time=ts(), action="start")
-    run_cmd(["bash", "-lc", "fswebcam -r 640x480 -q /tmp/refurb-webcam.jpg || true"]) 
-    _prompt("Webcam captured to /tmp/refurb-webcam.jpg if available. Press ENTER...")
+    run_cmd(["fswebcam", "-r", "640x480", "-q", "/tmp/refurb-webcam.jpg"])
+    pause("Webcam captured to /tmp/refurb-webcam.jpg if available. Press ENTER...")
     logger.append("webcam", time=ts(), action="end")
 
 
-def sdcard_test(logger) -> None:
+def sdcard_test(logger, timeout: float = 60.0) -> None:
     logger.append("sdcard", time=ts(), action="start")
-    print("Insert an SD card. We will detect a new block device.")
-    run_cmd(["bash", "-lc", "udevadm monitor --udev --subsystem-match=block --property --env | head -n 100 || true"]) 
-    logger.append("sdcard", time=ts(), action="end")
+    print(f"Insert an SD card within {timeout:.0f} seconds. We will detect a new block device.")
+    found = threading.Event()
+
+    def on_event(ev: Dict[str, str]) -> None:
+        if ev.get("ACTION") != "add" or ev.get("DEVTYPE") != "disk" or found.is_set():
+            return
+        name = ev.get("DEVNAME", "").rsplit("/", 1)[-1] or ev.get("DEVPATH", "").rsplit("/", 1)[-1]
+        size = probe.block_size(name)
+        logger.append("sdcard", time=ts(), action="detected", device=f"/dev/{name}", id_path=ev.get("ID_PATH", ""),
+                      bus=ev.get("ID_BUS", ""), model=ev.get("ID_MODEL", ""),
+                      size_mb=str(size // (1024 * 1024)) if size else "")
+        print(f"  Detected: /dev/{name}")
+        found.set()
+
+    stop = _listen("block", on_event)
+    try:
+        found.wait(timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+    logger.append("sdcard", time=ts(), action="end", detected=str(found.is_set()).lower())
 
 
 def physical_inspection(logger) -> None:
@@ -127,6 +246,6 @@ def physical_inspection(logger) -> None:
     ]
     results = []
     for q in questions:
-        ans = input(q + " ").strip().lower()
+        ans = ask(q + " ").strip().lower()
         results.append(f"{q} => {ans}")
     logger.append("physical", time=ts(), action="end", notes=" | ".join(results))
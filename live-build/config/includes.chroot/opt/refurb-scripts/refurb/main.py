@@ -2,18 +2,35 @@ from __future__ import annotations
 
 import os
 import sys
-import time
 import xml.etree.ElementTree as ET
+from typing import Dict, Optional, Set, Tuple
 
 from .config import load_config
-from .utils import clear_screen, ask, pause, print_box, ensure_dir
+from .utils import clear_screen, ask, pause, print_box, ensure_dir, ts
 from .smb import mount_share, ensure_device_folder
+from .scheduler import Scheduler
+from .cas import BLOB_DIR, BlobStore, read_xml
+from .checkpoint import Checkpoint, expand
+from .model import Audit
+from .spool import Spool
 from .xmlio import write_xml, XmlLogger
 from . import audit as audit_mod
+from . import battery as battery_mod
+from . import backend
 from . import delta as delta_mod
+from . import display
+from . import fingerprint as fingerprint_mod
+from . import diskbench as diskbench_mod
+from . import erase as erase_mod
+from . import membw as membw_mod
+from . import nettest as nettest_mod
+from . import perf as perf_mod
 from . import stress as stress_mod
+from . import trace
 from . import interactive as inter
 
+TRACE_SUMMARY_SPANS = 20
+
 
 def sanity_check(audit_root: ET.Element) -> bool:
     mem_nodes = audit_root.findall(".//node[@class='memory']")
@@ -48,69 +65,252 @@ def phase_identification(cfg):
     if not ok:
         print(f"Kon SMB share niet mounten: {msg}")
         sys.exit(1)
-    base_path = ensure_device_folder(cfg["REFURB_MOUNTPOINT"], device_id)
-    return device_id, base_path
+    remote_path = ensure_device_folder(cfg["REFURB_MOUNTPOINT"], device_id)
+    store = None
+    if cfg.get("REFURB_CAS", "1") == "1":
+        store = BlobStore(os.path.join(cfg["REFURB_MOUNTPOINT"], BLOB_DIR))
+    spool = Spool(os.path.join(cfg["REFURB_SPOOL_DIR"], f"ID-{device_id}"), remote_path, store=store)
+    spool.seed()
+    return device_id, spool
+
 
+def _save_fingerprint(base_path: str, spool: Spool) -> None:
+    fp_path = os.path.join(base_path, "audit_fingerprint.json")
+    fingerprint_mod.save(fp_path, fingerprint_mod.collect())
+    spool.push_path(fp_path)
 
-def phase_delta(base_path: str) -> str:
+
+def phase_resume(base_path: str, spool: Spool, cfg) -> Checkpoint:
+    cp = Checkpoint(os.path.join(base_path, "progress.json"), on_write=spool.push_path)
+    if cp.finished:
+        cp.new_cycle()
+    try:
+        forced = expand(cfg.get("REFURB_FORCE_RERUN", "").split(","))
+    except ValueError as e:
+        print(f"REFURB_FORCE_RERUN genegeerd: {e}")
+        forced = set()
+    done = [s for s in cp.completed() if s not in forced]
+    while done:
+        print_box("Onderbroken testcyclus gevonden", [f"Voltooid: {', '.join(done)}"])
+        ans = ask("[ENTER] hervatten, [N] volledig opnieuw, of stappen om te herhalen (bv. cpu,keyboard): ").strip()
+        if ans.upper() == "N":
+            cp.new_cycle()
+            break
+        try:
+            forced |= expand(ans.split(","))
+            break
+        except ValueError as e:
+            print(e)
+    if forced:
+        cp.reset(forced)
+    if "audit" in forced:
+        audit_mod.forget()
+    return cp
+
+
+def phase_delta(base_path: str, spool: Spool, cfg) -> Tuple[str, Optional[Tuple[Set[str], Set[str]]]]:
     baseline = os.path.join(base_path, "audit_baseline.xml")
     new_audit_path = os.path.join(base_path, "audit_current.xml")
-    print("Uitvoeren hardware-audit...")
-    audit_mod.save_audit(new_audit_path)
     if not os.path.exists(baseline):
-        return "new"
-    try:
-        old_xml = ET.parse(baseline).getroot()
-        new_xml = ET.parse(new_audit_path).getroot()
-        changes = delta_mod.diff_audits(old_xml, new_xml)
-    except Exception:
-        changes = ["Kon audits niet vergelijken (parse-fout)"]
-    print_box("Wijzigingen sinds laatste audit", changes or ["Geen wijzigingen gedetecteerd."])
+        return "new", None
+    selection: Optional[Tuple[Set[str], Set[str]]] = None
+    keep_raw = cfg.get("REFURB_AUDIT_RAW", "0") == "1"
+    unchanged = fingerprint_mod.matches(os.path.join(base_path, "audit_fingerprint.json"), fingerprint_mod.collect())
+    if unchanged:
+        # Cheap sysfs fingerprint matches the baseline: reuse the stored audit
+        # for this boot instead of running lshw/dmidecode again.
+        print("Hardware-fingerprint ongewijzigd, bestaande audit wordt hergebruikt.")
+        try:
+            audit_mod.prime(Audit.from_xml(read_xml(baseline)))
+            lines, selection = [], (set(), set())
+            if cfg.get("REFURB_AUDIT_REFRESH", "background") == "background":
+                audit_mod.refresh_in_background(new_audit_path, keep_raw, spool.push_path)
+        except (ET.ParseError, OSError, ValueError):
+            unchanged = False
+    if not unchanged:
+        print("Uitvoeren hardware-audit...")
+        audit_mod.save_audit(new_audit_path, keep_raw)
+        spool.push_path(new_audit_path)
+        try:
+            old_xml = read_xml(baseline)
+            new_xml = read_xml(new_audit_path)
+            changes = delta_mod.diff_components(old_xml, new_xml)
+            lines = [str(c) for c in changes]
+            selection = delta_mod.tests_for_changes(changes)
+        except Exception:
+            lines = ["Kon audits niet vergelijken (parse-fout)"]
+    print_box("Wijzigingen sinds laatste audit", lines or ["Geen wijzigingen gedetecteerd."])
+    if selection is not None:
+        auto, interactive = selection
+        print(f"Gedeeltelijke hertest: {', '.join(sorted(auto | interactive)) or 'geen tests'}")
     print("Kies een optie:\n1) Alleen gewijzigde onderdelen testen\n2) Volledige hertest\n3) Wijzigingen accepteren")
     choice = ask("Keuze [1/2/3]: ").strip() or "2"
-    if choice == "1":
-        return "partial"
+    if choice == "1" and selection is not None:
+        return "partial", selection
     if choice == "3":
-        os.replace(new_audit_path, baseline)
-        return "accepted"
-    return "full"
+        if not unchanged:
+            os.replace(new_audit_path, baseline)
+            spool.push_path(new_audit_path)
+            spool.push_path(baseline)
+            _save_fingerprint(base_path, spool)
+        return "accepted", None
+    return "full", None
 
 
-def phase_automated(base_path: str, fast: bool) -> bool:
+def phase_automated(base_path: str, spool: Spool, cfg, cp: Checkpoint, only: Optional[Set[str]] = None) -> bool:
+    fast = cfg.get("REFURB_FAST", "0") == "1"
     audit_path = os.path.join(base_path, "audit_baseline.xml")
-    print("Uitvoeren hardware-audit en sanity check...")
-    audit_mod.save_audit(audit_path)
+    resumed_audit = cp.done("audit") and os.path.exists(audit_path)
+    if resumed_audit:
+        print("Hardware-audit al uitgevoerd in deze cyclus, wordt hergebruikt.")
+    else:
+        print("Uitvoeren hardware-audit en sanity check...")
+        audit_mod.save_audit(audit_path, cfg.get("REFURB_AUDIT_RAW", "0") == "1")
+        spool.push_path(audit_path)
+        _save_fingerprint(base_path, spool)
     try:
         audit_root = ET.parse(audit_path).getroot()
     except Exception:
         print("Kon audit niet parsen.")
         return False
-    if not sanity_check(audit_root):
-        return False
+    if not resumed_audit:
+        if not sanity_check(audit_root):
+            return False
+        cp.mark("audit")
 
     auto_log_path = os.path.join(base_path, "auto_test.xml")
-    auto_logger = XmlLogger(auto_log_path, root_tag="auto_tests")
+    auto_logger = XmlLogger(auto_log_path, root_tag="auto_tests", on_write=spool.push_path)
 
     cpu_duration = 600 if not fast else 10
+    cpu_opts = {
+        "adaptive": cfg.get("REFURB_CPU_MODE", "adaptive") == "adaptive",
+        "min_sec": int(cfg.get("REFURB_CPU_MIN_SEC", "180")) if not fast else 5,
+        "max_sec": int(cfg.get("REFURB_CPU_MAX_SEC", "900")) if not fast else 15,
+        "temp_limit": float(cfg.get("REFURB_CPU_TEMP_LIMIT", "95")),
+    }
+    battery = battery_mod.BatterySampler(float(cfg.get("REFURB_BATTERY_INTERVAL", "10")) if not fast else 2.0)
+    cpu_opts["battery"] = battery
+    battery_opts = {
+        "max_wear_pct": float(cfg.get("REFURB_BATTERY_MAX_WEAR", "30")),
+        "min_runtime_min": float(cfg.get("REFURB_BATTERY_MIN_RUNTIME", "30")),
+    }
+    perf_key = perf_mod.baseline_key(audit_root)
+    if perf_key and not fast:
+        low, high = (float(v) for v in cfg.get("REFURB_PERF_BAND", "2,98").split(","))
+        cpu_opts["baseline"] = perf_mod.PerfBaseline(
+            os.path.join(cfg["REFURB_MOUNTPOINT"], "_baselines", "stress-ng.json"), perf_key,
+            band=(low, high), min_samples=int(cfg.get("REFURB_PERF_MIN_SAMPLES", "5")))
     mem_mb = 2048 if not fast else 64
     mem_duration = 300 if not fast else 20
+    mem_opts = {
+        "mode": cfg.get("REFURB_MEM_MODE", "coverage") if not fast else "fixed",
+        "coverage": float(cfg.get("REFURB_MEM_COVERAGE", "0.85")),
+        "workers": int(cfg.get("REFURB_MEM_WORKERS", "0")) or None,
+        "pass_mbs": float(cfg.get("REFURB_MEM_PASS_MBS", "1.5")),
+    }
+
+    smart_kind = cfg.get("REFURB_SMART_TEST", "short")
+    bench_seconds = float(cfg.get("REFURB_DISKBENCH_SECONDS", "20")) if not fast else 4
+    # Only tasks that finished by themselves are checkpointed, never timed out ones.
+    sched = Scheduler(float(cfg.get("REFURB_AUTO_BUDGET", "0") or 0), on_done=lambda t: cp.mark(t.name, t.ok))
+    sched.add("cpu", "CPU", lambda: stress_mod.cpu_stress(cpu_duration, auto_logger, **cpu_opts), {"cpu"})
+    # memtester keeps its cores busy too, so it must not overlap stress-ng.
+    sched.add("mem", "RAM", lambda: stress_mod.mem_test(mem_mb, mem_duration, auto_logger, **mem_opts), {"memory", "cpu"})
+    sched.add("membw", "Geheugenbandbreedte", lambda: membw_mod.bandwidth_test(
+        audit_root, auto_logger, array_mb=256 if not fast else 32, reps=5 if not fast else 2,
+        min_ratio=float(cfg.get("REFURB_MEMBW_MIN_RATIO", "0.5")),
+        fail_layout=cfg.get("REFURB_MEMBW_FAIL_LAYOUT", "1") == "1"), {"memory", "cpu"})
+    sched.add("storage", "Opslag", lambda: stress_mod.storage_tests(
+        auto_logger, kind=smart_kind, bench_seconds=bench_seconds, thresholds=diskbench_mod.parse_thresholds(cfg)), {"disk-io"})
+    # The battery is measured while the CPU test loads it; without a CPU run
+    # only its wear is judged.
+    battery_wait = max(cpu_duration, cpu_opts["max_sec"]) + 120
+    net_opts = {
+        "seconds": float(cfg.get("REFURB_NET_SECONDS", "10")) if not fast else 2.0,
+        "streams": int(cfg.get("REFURB_NET_STREAMS", "4")),
+        "min_speed": int(cfg.get("REFURB_NET_MIN_SPEED", "1000")),
+        "min_ratio": float(cfg.get("REFURB_NET_MIN_RATIO", "0.7")),
+        "max_rtt_ms": float(cfg.get("REFURB_NET_MAX_RTT_MS", "5")),
+        "max_retrans_pct": float(cfg.get("REFURB_NET_MAX_RETRANS_PCT", "1")),
+    }
+    sched.add("network", "Netwerk", lambda: nettest_mod.network_test(
+        auto_logger, nettest_mod.server_for(cfg), **net_opts), {"network"})
+    sched.add("battery", "Batterij", lambda: stress_mod.battery_health(
+        auto_logger, battery if "cpu" in scheduled else None, wait=battery_wait, **battery_opts), {"passive"})
+    if only is not None:
+        sched.tasks = [t for t in sched.tasks if t.name in only]
+    order = [t.name for t in sched.tasks]
+    resumed = [t for t in sched.tasks if cp.done(t.name)]
+    sched.tasks = [t for t in sched.tasks if not cp.done(t.name)]
+    scheduled = {t.name for t in sched.tasks}
+    tasks = sched.run()
+    for t in resumed:
+        t.ok = bool(cp.get(t.name).get("ok"))
+        t.status = "resumed"
+    tasks = sorted(resumed + tasks, key=lambda t: order.index(t.name))
+    for t in tasks:
+        auto_logger.append("schedule", time=ts(), task=t.name, status=t.status, ok=str(t.ok).lower(),
+                           duration=f"{t.duration:.1f}", error=t.error)
+    auto_logger.close()
 
-    ok_cpu = stress_mod.cpu_stress(cpu_duration, auto_logger)
-    ok_mem = stress_mod.mem_test(mem_mb, mem_duration, auto_logger)
-    ok_storage = stress_mod.storage_tests(auto_logger)
-    ok_battery = stress_mod.battery_health(auto_logger)
-
-    overall = ok_cpu and ok_mem and ok_storage and ok_battery
-    print_box("Samenvatting automatische tests", [
-        f"CPU: {'GESLAAGD' if ok_cpu else 'GEFAALD'}",
-        f"RAM: {'GESLAAGD' if ok_mem else 'GEFAALD'}",
-        f"Opslag: {'GESLAAGD' if ok_storage else 'GEFAALD'}",
-        f"Batterij: {'GESLAAGD' if ok_battery else 'GEFAALD'}",
-        f"Totaal: {'GESLAAGD' if overall else 'GEFAALD'}",
-    ])
+    overall = all(t.ok for t in tasks)
+    notes = {"timeout": " (tijdslimiet)", "skipped": " (overgeslagen)", "resumed": " (eerder voltooid)"}
+    lines = [f"{t.label}: {'GESLAAGD' if t.ok else 'GEFAALD'}{notes.get(t.status, '')}" for t in tasks]
+    lines.append(f"Totaal: {'GESLAAGD' if overall else 'GEFAALD'}")
+    print_box("Samenvatting automatische tests", lines)
     return overall
 
 
+def confirm_erase(cfg, cp: Checkpoint) -> Dict[str, Tuple[int, str]]:
+    # Asked up front, while the operator is still at the machine; the erase
+    # itself runs unattended after the automated tests. Returns the size and
+    # serial of every confirmed disk, checked again before erasing.
+    if cfg.get("REFURB_ERASE", "0") != "1" or cp.done("erase"):
+        return {}
+    lines = []
+    devices = []
+    for dev, reason in erase_mod.candidates():
+        ident = " ".join(v for v in erase_mod.identity(dev).values() if v)
+        skip = f"  OVERGESLAGEN: {reason}" if reason else ""
+        lines.append(f"{dev}  {erase_mod.disk_size(dev) / 1e9:.0f} GB  {ident}{skip}")
+        if not reason:
+            devices.append(dev)
+    if not devices:
+        return {}
+    confirmed = {dev: erase_mod.snapshot(dev) for dev in devices}
+    print_box("Schijven wissen na de automatische tests", lines)
+    if ask("Typ WISSEN om deze schijven definitief te wissen, Enter om over te slaan: ").strip() != "WISSEN":
+        print("Schijven worden niet gewist.")
+        return {}
+    return confirmed
+
+
+def phase_erase(base_path: str, spool: Spool, cfg, cp: Checkpoint, confirmed: Dict[str, Tuple[int, str]],
+                device_id: str) -> bool:
+    # Hours may have passed since the confirmation: a disk that got mounted,
+    # hot-swapped or renamed in the meantime is left alone.
+    skipped = {dev: erase_mod.recheck(dev, snap) for dev, snap in confirmed.items()}
+    skipped = {dev: reason for dev, reason in skipped.items() if reason}
+    devices = [dev for dev in confirmed if dev not in skipped]
+    print(f"Wissen van {len(devices)} schijf/schijven...")
+    samples = int(cfg.get("REFURB_ERASE_VERIFY_SAMPLES", str(erase_mod.VERIFY_SAMPLES)))
+    erases = [erase_mod.Erase(d, cfg.get("REFURB_ERASE_METHOD", "auto"), samples) for d in devices]
+    erase_mod.run_all(erases, lambda es: print(erase_mod.progress_line(es)), 30.0)
+    lines = []
+    for e in erases:
+        path = os.path.join(base_path, f"erase_{e.name}.xml")
+        write_xml(path, e.certificate(device_id))
+        spool.push_path(path)
+        status = {"passed": "GEWIST", "inconclusive": "GEWIST, NIET GEVERIFIEERD"}.get(e.result, "MISLUKT")
+        lines.append(f"{e.dev}: {status} ({e.method or '-'}, {e.duration / 60:.0f} min, "
+                     f"{e.throughput_mbs:.0f} MB/s){' ' + e.error if e.error else ''}")
+    lines += [f"{dev}: OVERGESLAGEN ({reason})" for dev, reason in skipped.items()]
+    ok = bool(erases) and all(e.ok for e in erases) and not skipped
+    print_box("Resultaat wissen", lines)
+    cp.mark("erase", ok, devices=devices, skipped=sorted(skipped))
+    return ok
+
+
 def phase_morning_hand_off(base_path: str) -> str:
     print("[ENTER] verder naar interactieve tests, [R] hertest selectie, [A] afbreken")
     ch = ask("").strip().upper()
@@ -121,52 +321,116 @@ def phase_morning_hand_off(base_path: str) -> str:
     return "continue"
 
 
-def phase_interactive(base_path: str) -> None:
+def phase_interactive(base_path: str, spool: Spool, cp: Checkpoint, only: Optional[Set[str]] = None) -> None:
     os.environ.setdefault("DISPLAY", ":0")
     inter_log_path = os.path.join(base_path, "interactive_test.xml")
-    inter_logger = XmlLogger(inter_log_path, root_tag="interactive_tests")
+    inter_logger = XmlLogger(inter_log_path, root_tag="interactive_tests", on_write=spool.push_path)
 
-    inter.test_video_ports(inter_logger)
-    inter.test_usb_ports(inter_logger)
-    inter.test_audio(inter_logger)
-    inter.laptop_screen_test(inter_logger)
-    inter.keyboard_tester(inter_logger)
-    inter.wifi_bluetooth_test(inter_logger)
-    inter.sdcard_test(inter_logger)
-    inter.webcam_test(inter_logger)
-    inter.physical_inspection(inter_logger)
+    tests = [
+        ("video_ports", inter.test_video_ports),
+        ("usb_ports", inter.test_usb_ports),
+        ("audio", inter.test_audio),
+        ("laptop_screen", inter.laptop_screen_test),
+        ("keyboard", inter.keyboard_tester),
+        ("wireless", inter.wifi_bluetooth_test),
+        ("sdcard", inter.sdcard_test),
+        ("webcam", inter.webcam_test),
+        ("physical", inter.physical_inspection),
+    ]
+    for name, test in tests:
+        if (only is None or name in only) and not cp.done(name):
+            with trace.span(name, "test"):
+                test(inter_logger)
+            cp.mark(name)
+            trace.flush()
+    display.close()
+    inter_logger.close()
 
 
-def phase_final(base_path: str) -> None:
+def _drain_spool(spool: Spool, timeout: float) -> None:
+    print("Resultaten synchroniseren naar share...")
+    while not spool.drain(timeout):
+        print(f"Share niet bereikbaar, {spool.depth()} bestand(en) nog niet gesynchroniseerd ({spool.last_error}).")
+        if ask("[R] opnieuw proberen, [S] toch afsluiten: ").strip().upper() == "S":
+            return
+
+
+def phase_final(base_path: str, spool: Spool, cp: Checkpoint, drain_timeout: float) -> None:
     notes = ask("Voer eventuele opmerkingen in en druk op Enter: ")
     status = ask("Geef de finale status (standaard: 'Klaar voor installatie'): ").strip() or "Klaar voor installatie"
+    _drain_spool(spool, drain_timeout)
     root = ET.Element("summary")
     ET.SubElement(root, "notes").text = notes
     ET.SubElement(root, "status").text = status
-    write_xml(os.path.join(base_path, "summary.xml"), root)
+    ET.SubElement(root, "spool", spool.stats())
+    t = trace.tracer()
+    if t is not None:
+        # Where this session's time went; trace.json has every span.
+        trace.flush()
+        el = ET.SubElement(root, "trace", {"file": "trace.json"})
+        for cat, name, count, wall_ms, cpu_ms in sorted(t.summary(), key=lambda r: -r[3])[:TRACE_SUMMARY_SPANS]:
+            ET.SubElement(el, "span", {"cat": cat, "name": name, "count": str(count), "wall_ms": f"{wall_ms:.1f}",
+                                       "cpu_ms": f"{cpu_ms:.1f}"})
+    summary_path = os.path.join(base_path, "summary.xml")
+    write_xml(summary_path, root)
+    spool.push_path(summary_path)
+    cp.mark("final", status=status)
+    cp.finish()
+    _drain_spool(spool, drain_timeout)
     print("Voltooid. Systeem zal over 30 seconden afsluiten...")
     try:
-        time.sleep(30)
-        os.system("shutdown -h now")
+        backend.active().shutdown(30)
     except Exception:
         pass
 
 
+def _phase(name: str, fn, *args):
+    with trace.span(name):
+        res = fn(*args)
+    trace.flush()
+    return res
+
+
 def main():
+    # Replay keeps device images and scratch files until closed.
+    try:
+        return _main()
+    finally:
+        backend.close()
+
+
+def _main():
     cfg = load_config()
-    device_id, base_path = phase_identification(cfg)
+    if cfg.get("REFURB_TRACE", "1") == "1":
+        trace.start()
+    device_id, spool = _phase("identification", phase_identification, cfg)
+    base_path = spool.local_dir
+    if trace.tracer() is not None:
+        trace.tracer().set_output(os.path.join(base_path, "trace.json"), spool.push_path)
+    cp = _phase("resume", phase_resume, base_path, spool, cfg)
     state = "new" if not os.path.exists(os.path.join(base_path, "audit_baseline.xml")) else "existing"
-    if state == "existing":
-        action = phase_delta(base_path)
+    selection: Optional[Tuple[Set[str], Set[str]]] = None
+    if cp.done("delta"):
+        info = cp.get("delta")
+        if info.get("auto") is not None:
+            selection = (set(info["auto"]), set(info["interactive"]))
+    elif state == "existing" and not cp.done("audit"):
+        action, selection = _phase("delta", phase_delta, base_path, spool, cfg)
         if action == "accepted":
             print("Wijzigingen geaccepteerd. Ga verder met testen.")
-    fast = cfg.get("REFURB_FAST", "0") == "1"
-    ok = phase_automated(base_path, fast)
-    handoff = phase_morning_hand_off(base_path)
-    if handoff == "abort":
-        print("Afgebroken op verzoek technicus.")
-        return 1
-    phase_interactive(base_path)
-    phase_final(base_path)
+        cp.mark("delta", action=action, auto=sorted(selection[0]) if selection else None,
+                interactive=sorted(selection[1]) if selection else None)
+    erase_devices = confirm_erase(cfg, cp)
+    ok = _phase("automated", phase_automated, base_path, spool, cfg, cp, selection[0] if selection else None)
+    if erase_devices:
+        _phase("erase", phase_erase, base_path, spool, cfg, cp, erase_devices, device_id)
+    if not cp.done("handoff"):
+        handoff = _phase("handoff", phase_morning_hand_off, base_path)
+        if handoff == "abort":
+            print("Afgebroken op verzoek technicus.")
+            _drain_spool(spool, float(cfg.get("REFURB_SPOOL_DRAIN_TIMEOUT", "600")))
+            return 1
+        cp.mark("handoff", choice=handoff)
+    _phase("interactive", phase_interactive, base_path, spool, cp, selection[1] if selection else None)
+    _phase("final", phase_final, base_path, spool, cp, float(cfg.get("REFURB_SPOOL_DRAIN_TIMEOUT", "600")))
     return 0
-
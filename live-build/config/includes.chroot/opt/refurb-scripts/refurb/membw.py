@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+from . import backend
+from .utils import ts
+
+KERNELS = ("copy", "scale", "add", "triad")
+# Bytes moved per element, counted the way STREAM does (no write-allocate).
+# NumPy has no fused multiply-add ufunc, so triad is two passes over memory:
+# a = s*c (16) then a += b (24).
+_BYTES = {"copy": 16, "scale": 16, "add": 24, "triad": 40}
+
+
+def _int(text: Optional[str]) -> int:
+    try:
+        return int((text or "").strip())
+    except ValueError:
+        return 0
+
+
+def dimm_layout(audit_root: ET.Element) -> List[Dict[str, str]]:
+    dimms: List[Dict[str, str]] = []
+    for node in audit_root.iter("node"):
+        if node.get("class") != "memory" or not (node.get("id") or "").startswith("bank"):
+            continue
+        dimms.append({
+            "id": node.get("id") or "",
+            "slot": (node.findtext("slot") or "").strip(),
+            "size_mb": str(_int(node.findtext("size")) // (1024 * 1024)),
+            "clock_mhz": str(_int(node.findtext("clock")) // 1000000),
+            "vendor": (node.findtext("vendor") or "").strip(),
+            "product": (node.findtext("product") or "").strip(),
+            "description": (node.findtext("description") or "").strip(),
+        })
+    return dimms
+
+
+def _channel(slot: str) -> str:
+    m = re.search(r"(?:channel|chan|dimm_?)\s*([A-H])", slot, re.IGNORECASE)
+    return m.group(1).upper() if m else ""
+
+
+def expected_bandwidth(dimms: List[Dict[str, str]]) -> Tuple[int, int, int, float, bool]:
+    # Returns (channels, populated channels, MT/s, theoretical MB/s,
+    # mismatched). The channels are those of the board, empty banks
+    # included, so a single DIMM in a dual-channel board is expected to reach
+    # dual-channel bandwidth. Without channel letters in the slot names two
+    # banks or more count as two channels, filled in order. lshw reports the
+    # DDR transfer rate as the clock, so MHz here is MT/s.
+    populated = [d for d in dimms if int(d["size_mb"])]
+    if not populated:
+        return 0, 0, 0, 0.0, False
+    board = {_channel(d["slot"]) for d in dimms} - {""}
+    if board:
+        channels = len(board)
+        used = len({_channel(d["slot"]) for d in populated} - {""})
+    else:
+        channels = min(len(dimms), 2)
+        used = min(len(populated), channels)
+    speeds = [int(d["clock_mhz"]) for d in populated if int(d["clock_mhz"])]
+    mts = min(speeds) if speeds else 0
+    mismatched = len({d["size_mb"] for d in populated}) > 1 or len(set(speeds)) > 1
+    return channels, used, mts, mts * 8.0 * channels, mismatched
+
+
+def stream(n: int, threads: int = 1, reps: int = 5) -> Dict[str, float]:
+    import numpy as np
+
+    a = np.full(n, 1.0)
+    b = np.full(n, 2.0)
+    c = np.zeros(n)
+    s = 3.0
+    bounds = [(i * n // threads, (i + 1) * n // threads) for i in range(threads)]
+
+    def kernel(name: str, lo: int, hi: int) -> None:
+        if name == "copy":
+            np.copyto(c[lo:hi], a[lo:hi])
+        elif name == "scale":
+            np.multiply(c[lo:hi], s, out=b[lo:hi])
+        elif name == "add":
+            np.add(a[lo:hi], b[lo:hi], out=c[lo:hi])
+        else:
+            np.multiply(c[lo:hi], s, out=a[lo:hi])
+            np.add(a[lo:hi], b[lo:hi], out=a[lo:hi])
+
+    best = {k: float("inf") for k in KERNELS}
+    for _ in range(reps):
+        for name in KERNELS:
+            if threads == 1:
+                t0 = time.perf_counter()
+                kernel(name, 0, n)
+                best[name] = min(best[name], time.perf_counter() - t0)
+                continue
+            # numpy releases the GIL inside ufuncs, so threads over disjoint
+            # slices give a real all-core measurement.
+            barrier = threading.Barrier(threads + 1)
+
+            def worker(lo: int, hi: int) -> None:
+                barrier.wait()
+                kernel(name, lo, hi)
+
+            pool = [threading.Thread(target=worker, args=bd) for bd in bounds]
+            for t in pool:
+                t.start()
+            barrier.wait()
+            t0 = time.perf_counter()
+            for t in pool:
+                t.join()
+            best[name] = min(best[name], time.perf_counter() - t0)
+    return {k: _BYTES[k] * n / best[k] / 1e6 for k in KERNELS}
+
+
+def bandwidth_test(audit_root: ET.Element, logger, array_mb: int = 256, reps: int = 5, min_ratio: float = 0.5,
+                   fail_layout: bool = True) -> bool:
+    # Fails below min_ratio of the theoretical bandwidth and, with
+    # fail_layout, on an empty channel or DIMMs of mixed size or speed.
+    dimms = dimm_layout(audit_root)
+    channels, used, mts, theoretical, mismatched = expected_bandwidth(dimms)
+    layout_ok = not fail_layout or (used >= channels and not mismatched)
+    logger.append("membw", time=ts(), action="start", array_mb=array_mb, channels=channels, populated_channels=used,
+                  mts=mts, theoretical_mbs=f"{theoretical:.0f}", mismatched=str(mismatched).lower())
+    skipped = ""
+    if backend.active().name == "replay":
+        # The fixture's DIMMs are not this host's memory.
+        skipped = "replayed machine"
+    else:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            skipped = "numpy not available"
+    if skipped:
+        entry = logger.append("membw", time=ts(), action="end", ok=str(layout_ok).lower(), skipped=skipped)
+        _log_layout(logger, entry, dimms)
+        return layout_ok
+    n = array_mb * 1024 * 1024 // 8
+    threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    single = stream(n, 1, reps)
+    multi = stream(n, threads, reps) if threads > 1 else dict(single)
+    ratio = multi["triad"] / theoretical if theoretical else 0.0
+    ok = layout_ok and (not theoretical or ratio >= min_ratio)
+    entry = logger.append("membw", time=ts(), action="end", ok=str(ok).lower(), threads=threads,
+                          triad_ratio=f"{ratio:.2f}", min_ratio=f"{min_ratio:.2f}")
+    for label, res in (("single", single), ("all", multi)):
+        logger.add(entry, "stream", threads=1 if label == "single" else threads,
+                   **{f"{k}_mbs": f"{v:.0f}" for k, v in res.items()})
+    _log_layout(logger, entry, dimms)
+    return ok
+
+
+def _log_layout(logger, entry: ET.Element, dimms: List[Dict[str, str]]) -> None:
+    layout = logger.add(entry, "dimms", populated=sum(1 for d in dimms if int(d["size_mb"])), slots=len(dimms))
+    for d in dimms:
+        logger.add(layout, "dimm", **d)
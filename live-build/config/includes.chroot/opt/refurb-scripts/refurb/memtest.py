@@ -0,0 +1,139 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import List, Optional
+
+from . import backend, runner, trace
+
+MIN_WORKER_MB = 64
+# MB one memtester worker gets through per second for a full pass (all its
+# pattern tests), with margin; sizes the workers so a pass fits the budget.
+PASS_MBS = 1.5
+
+
+def mem_available_mb() -> int:
+    try:
+        with open(backend.path("/proc/meminfo"), "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except Exception:
+        pass
+    return 0
+
+
+def plan_workers(coverage: float, workers: Optional[int] = None, reserve_mb: int = 512,
+                 budget: Optional[float] = None, pass_mbs: float = PASS_MBS) -> List[int]:
+    total = int(max(0, mem_available_mb() - reserve_mb) * coverage)
+    n = max(1, min(workers or os.cpu_count() or 1, total // MIN_WORKER_MB or 1))
+    size = total // n
+    if budget:
+        # A worker that cannot finish one pass has tested nothing.
+        size = min(size, max(MIN_WORKER_MB, int(budget * pass_mbs)))
+    return [size] * n if total >= MIN_WORKER_MB else []
+
+
+class MemWorker:
+    def __init__(self, cpu: int, mb: int) -> None:
+        self.cpu = cpu
+        self.mb = mb
+        self.loops_started = 0
+        self.completed = False
+        self.failures: List[str] = []
+        self.returncode: Optional[int] = None
+        self.started = 0.0
+        self.finished = 0.0
+        self.proc: Optional[subprocess.Popen] = None
+        self._reader: Optional[threading.Thread] = None
+        self.out_bytes = 0
+        # Open from start() to stop(): the worker outlives any with-block.
+        self._span = trace.span("memtester", "subprocess", cpu=cpu)
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        # No loop count: memtester runs until we stop it at the deadline.
+        cmd = ["memtester", f"{self.mb}M"]
+        self._span.set(argv=" ".join(cmd))
+        self._span.__enter__()
+        try:
+            self.proc = subprocess.Popen(backend.argv(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                         start_new_session=True)
+        except BaseException as e:
+            self._span.__exit__(type(e), e, None)
+            raise
+        try:
+            os.sched_setaffinity(self.proc.pid, {self.cpu})
+        except (AttributeError, OSError):
+            pass
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        assert self.proc is not None and self.proc.stdout is not None
+        for line in self.proc.stdout:
+            self.out_bytes += len(line)
+            line = line.strip()
+            if line.startswith("Loop "):
+                self.loops_started += 1
+            elif "FAILURE" in line:
+                self.failures.append(line)
+
+    def stop(self) -> None:
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+        self.finished = self.finished or time.monotonic()
+        self._span.set(code=self.proc.returncode, out_bytes=self.out_bytes, failures=len(self.failures))
+        self._span.__exit__(None, None, None)
+
+    @property
+    def passes(self) -> int:
+        # The last "Loop N" line is the pass that was interrupted.
+        return self.loops_started if self.completed else max(0, self.loops_started - 1)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures and self.returncode in (0, -signal.SIGTERM) and self.passes > 0
+
+    @property
+    def throughput(self) -> float:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.mb * self.passes / elapsed if elapsed > 0 else 0.0
+
+
+def run_parallel(sizes: List[int], duration_sec: float, poll: float = 1.0) -> List[MemWorker]:
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    workers = [MemWorker(cpus[i % len(cpus)], mb) for i, mb in enumerate(sizes)]
+    deadline = time.monotonic() + duration_sec
+    try:
+        for w in workers:
+            w.start()
+        while time.monotonic() < deadline:
+            running = [w for w in workers if w.proc is not None and w.proc.poll() is None]
+            for w in workers:
+                if w.proc is not None and w.proc.poll() is not None and not w.finished:
+                    w.finished = time.monotonic()
+            if not running or any(w.failures for w in workers):
+                break
+            if runner.sleep(poll):
+                break
+    finally:
+        for w in workers:
+            exited = w.proc is not None and w.proc.poll() is not None
+            w.stop()
+            w.returncode = w.proc.returncode if w.proc is not None else 1
+            w.completed = exited and w.returncode == 0
+    return workers
@@ -0,0 +1,318 @@
+import base64
+import json
+import xml.etree.ElementTree as ET
+import zlib
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+# Text children of an lshw node, in lshw's own order.
+LSHW_FIELDS = ("description", "product", "vendor", "physid", "businfo", "logicalname", "version", "serial",
+               "slot", "size", "capacity", "width", "clock")
+_FIELD_UNITS = {"clock": "Hz", "width": "bits"}
+
+
+def pack(text: str) -> str:
+    return base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+
+
+def unpack(data: str) -> str:
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8", "replace")
+
+
+def _opt_bool(v: Optional[str]) -> Optional[bool]:
+    return None if v in (None, "") else v == "true"
+
+
+def _opt_int(v: Optional[str]) -> Optional[int]:
+    try:
+        return int(v) if v not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _opt_float(v: Optional[str]) -> Optional[float]:
+    try:
+        return float(v) if v not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _attrs(obj, names) -> Dict[str, str]:
+    out = {}
+    for n in names:
+        v = getattr(obj, n)
+        if v is None or v == "":
+            continue
+        out[n] = str(v).lower() if isinstance(v, bool) else (f"{v:g}" if isinstance(v, float) else str(v))
+    return out
+
+
+@dataclass(slots=True)
+class LshwNode:
+    id: str
+    cls: str
+    handle: str = ""
+    claimed: bool = False
+    units: str = ""
+    fields: Dict[str, str] = field(default_factory=dict)
+    config: Dict[str, str] = field(default_factory=dict)
+    children: List["LshwNode"] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, d: dict) -> "LshwNode":
+        fields = {}
+        for k in LSHW_FIELDS:
+            v = d.get(k)
+            if isinstance(v, list):
+                v = v[0] if v else None
+            if v is not None and not isinstance(v, dict):
+                fields[k] = str(v)
+        return cls(
+            id=str(d.get("id", "")),
+            cls=str(d.get("class", "")),
+            handle=str(d.get("handle", "")),
+            claimed=bool(d.get("claimed")),
+            units=str(d.get("units", "")),
+            fields=fields,
+            config={k: str(v) for k, v in (d.get("configuration") or {}).items()},
+            children=[cls.from_json(c) for c in d.get("children") or []],
+        )
+
+    @classmethod
+    def from_xml(cls, el: ET.Element) -> "LshwNode":
+        fields = {k: (el.findtext(k) or "").strip() for k in LSHW_FIELDS if el.find(k) is not None}
+        units = ""
+        for k in ("size", "capacity"):
+            if el.find(k) is not None and el.find(k).get("units"):
+                units = el.find(k).get("units") or ""
+        conf = el.find("configuration")
+        return cls(
+            id=el.get("id") or "",
+            cls=el.get("class") or "",
+            handle=el.get("handle") or "",
+            claimed=el.get("claimed") == "true",
+            units=units,
+            fields=fields,
+            config={s.get("id") or "": s.get("value") or "" for s in conf.findall("setting")} if conf is not None else {},
+            children=[cls.from_xml(c) for c in el.findall("node")],
+        )
+
+    def to_xml(self) -> ET.Element:
+        attrs = {"id": self.id, "class": self.cls}
+        if self.claimed:
+            attrs["claimed"] = "true"
+        if self.handle:
+            attrs["handle"] = self.handle
+        el = ET.Element("node", attrs)
+        for k in LSHW_FIELDS:
+            if k not in self.fields:
+                continue
+            units = self.units if k in ("size", "capacity") else _FIELD_UNITS.get(k, "")
+            ET.SubElement(el, k, {"units": units} if units else {}).text = self.fields[k]
+        if self.config:
+            conf = ET.SubElement(el, "configuration")
+            for k, v in self.config.items():
+                ET.SubElement(conf, "setting", {"id": k, "value": v})
+        for c in self.children:
+            el.append(c.to_xml())
+        return el
+
+
+@dataclass(slots=True)
+class Disk:
+    device: str
+    smart_ok: bool = False
+    protocol: str = ""
+    model: str = ""
+    serial: str = ""
+    firmware: str = ""
+    capacity_bytes: Optional[int] = None
+    smart_passed: Optional[bool] = None
+    power_on_hours: Optional[int] = None
+    temperature_c: Optional[int] = None
+    raw: Optional[str] = None
+
+    _ATTRS = ("device", "smart_ok", "protocol", "model", "serial", "firmware", "capacity_bytes", "smart_passed",
+              "power_on_hours", "temperature_c")
+
+    @classmethod
+    def from_smartctl_json(cls, device: str, code: int, data: dict) -> "Disk":
+        status = data.get("smart_status") or {}
+        return cls(
+            device=device,
+            smart_ok=code == 0 or code == 4,
+            protocol=str((data.get("device") or {}).get("protocol", "")),
+            model=str(data.get("model_name", "")),
+            serial=str(data.get("serial_number", "")),
+            firmware=str(data.get("firmware_version", "")),
+            capacity_bytes=(data.get("user_capacity") or {}).get("bytes"),
+            smart_passed=status.get("passed") if "passed" in status else None,
+            power_on_hours=(data.get("power_on_time") or {}).get("hours"),
+            temperature_c=(data.get("temperature") or {}).get("current"),
+        )
+
+    @classmethod
+    def from_xml(cls, el: ET.Element) -> "Disk":
+        raw = el.find("raw")
+        return cls(
+            device=el.get("device") or "",
+            smart_ok=el.get("smart_ok") == "true",
+            protocol=el.get("protocol") or "",
+            model=el.get("model") or "",
+            serial=el.get("serial") or "",
+            firmware=el.get("firmware") or "",
+            capacity_bytes=_opt_int(el.get("capacity_bytes")),
+            smart_passed=_opt_bool(el.get("smart_passed")),
+            power_on_hours=_opt_int(el.get("power_on_hours")),
+            temperature_c=_opt_int(el.get("temperature_c")),
+            raw=raw.text if raw is not None else None,
+        )
+
+    def to_xml(self) -> ET.Element:
+        el = ET.Element("disk", _attrs(self, self._ATTRS))
+        if self.raw:
+            ET.SubElement(el, "raw", {"encoding": "zlib+base64", "format": "smartctl-json"}).text = self.raw
+        return el
+
+
+@dataclass(slots=True)
+class Battery:
+    name: str
+    path: str = ""
+    manufacturer: str = ""
+    model: str = ""
+    serial: str = ""
+    technology: str = ""
+    status: str = ""
+    capacity_pct: Optional[int] = None
+    energy_now_wh: Optional[float] = None
+    energy_full_wh: Optional[float] = None
+    energy_full_design_wh: Optional[float] = None
+    cycle_count: Optional[int] = None
+
+    _ATTRS = ("name", "path", "manufacturer", "model", "serial", "technology", "status", "capacity_pct",
+              "energy_now_wh", "energy_full_wh", "energy_full_design_wh", "cycle_count")
+
+    @property
+    def wear_pct(self) -> Optional[float]:
+        if not self.energy_full_wh or not self.energy_full_design_wh:
+            return None
+        return max(0.0, 100.0 * (1 - self.energy_full_wh / self.energy_full_design_wh))
+
+    @classmethod
+    def from_xml(cls, el: ET.Element) -> "Battery":
+        return cls(
+            name=el.get("name") or "",
+            path=el.get("path") or "",
+            manufacturer=el.get("manufacturer") or "",
+            model=el.get("model") or "",
+            serial=el.get("serial") or "",
+            technology=el.get("technology") or "",
+            status=el.get("status") or "",
+            capacity_pct=_opt_int(el.get("capacity_pct")),
+            energy_now_wh=_opt_float(el.get("energy_now_wh")),
+            energy_full_wh=_opt_float(el.get("energy_full_wh")),
+            energy_full_design_wh=_opt_float(el.get("energy_full_design_wh")),
+            cycle_count=_opt_int(el.get("cycle_count")),
+        )
+
+    def to_xml(self) -> ET.Element:
+        attrs = _attrs(self, self._ATTRS)
+        if self.wear_pct is not None:
+            attrs["wear_pct"] = f"{self.wear_pct:.1f}"
+        return ET.Element("upower", attrs)
+
+
+@dataclass(slots=True)
+class Collector:
+    name: str
+    duration: float
+    ok: bool = True
+    error: str = ""
+
+
+@dataclass(slots=True)
+class Audit:
+    time: str
+    lshw: List[LshwNode] = field(default_factory=list)
+    lshw_error: str = ""
+    dmi: Dict[str, str] = field(default_factory=dict)
+    dmidecode_raw: Optional[str] = None
+    disks: List[Disk] = field(default_factory=list)
+    batteries: List[Battery] = field(default_factory=list)
+    collectors: List[Collector] = field(default_factory=list)
+    duration: float = 0.0
+
+    def to_xml(self) -> ET.Element:
+        root = ET.Element("audit", {"time": self.time})
+        if self.lshw:
+            lst = ET.SubElement(root, "list")
+            for n in self.lshw:
+                lst.append(n.to_xml())
+        else:
+            ET.SubElement(root, "lshw_raw").text = self.lshw_error
+        ET.SubElement(root, "dmi", {k: v for k, v in self.dmi.items() if v})
+        if self.dmidecode_raw:
+            ET.SubElement(root, "dmidecode", {"encoding": "zlib+base64"}).text = self.dmidecode_raw
+        disks = ET.SubElement(root, "disks")
+        for d in self.disks:
+            disks.append(d.to_xml())
+        bats = ET.SubElement(root, "battery")
+        for b in self.batteries:
+            bats.append(b.to_xml())
+        coll = ET.SubElement(root, "collectors", {"duration": f"{self.duration:.3f}"})
+        for c in self.collectors:
+            attrs = {"name": c.name, "duration": f"{c.duration:.3f}", "ok": str(c.ok).lower()}
+            if c.error:
+                attrs["error"] = c.error
+            ET.SubElement(coll, "collector", attrs)
+        return root
+
+    @classmethod
+    def from_xml(cls, root: ET.Element) -> "Audit":
+        lst = root.find("list")
+        if lst is not None:
+            nodes = [LshwNode.from_xml(n) for n in lst.findall("node")]
+        else:
+            nodes = [LshwNode.from_xml(n) for n in root.findall("node")]
+        dmidecode = root.find("dmidecode")
+        coll = root.find("collectors")
+        return cls(
+            time=root.get("time") or "",
+            lshw=nodes,
+            lshw_error=(root.findtext("lshw_raw") or "").strip(),
+            dmi=dict((root.find("dmi").attrib if root.find("dmi") is not None else {})),
+            dmidecode_raw=dmidecode.text if dmidecode is not None and dmidecode.get("encoding") else None,
+            disks=[Disk.from_xml(d) for d in root.findall("disks/disk")],
+            batteries=[Battery.from_xml(b) for b in root.findall("battery/upower") if b.get("name")],
+            collectors=[Collector(c.get("name") or "", float(c.get("duration") or 0), c.get("ok") == "true",
+                                  c.get("error") or "") for c in (coll.findall("collector") if coll is not None else [])],
+            duration=float(coll.get("duration") or 0) if coll is not None else 0.0,
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Audit":
+        def node(n: dict) -> LshwNode:
+            return LshwNode(**{**n, "children": [node(c) for c in n.get("children", [])]})
+
+        return cls(
+            time=d.get("time", ""),
+            lshw=[node(n) for n in d.get("lshw", [])],
+            lshw_error=d.get("lshw_error", ""),
+            dmi=d.get("dmi", {}),
+            dmidecode_raw=d.get("dmidecode_raw"),
+            disks=[Disk(**x) for x in d.get("disks", [])],
+            batteries=[Battery(**x) for x in d.get("batteries", [])],
+            collectors=[Collector(**x) for x in d.get("collectors", [])],
+            duration=d.get("duration", 0.0),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text: str) -> "Audit":
+        return cls.from_dict(json.loads(text))
@@ -0,0 +1,341 @@
+import argparse
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import backend, probe
+from .utils import ts
+
+DEFAULT_PORT = 5201
+BUF = 128 * 1024
+PING_SIZE = 64
+PINGS = 100
+MAX_SOURCE_SEC = 120.0
+COUNTERS = ("rx_errors", "tx_errors", "rx_crc_errors", "rx_dropped", "tx_dropped")
+# Only these fail the test; the drop counters also count unrelated broadcasts.
+ERROR_COUNTERS = ("rx_errors", "tx_errors", "rx_crc_errors")
+# Offsets of tcpi_total_retrans and tcpi_segs_out in Linux's struct tcp_info.
+TCPI_TOTAL_RETRANS = 100
+TCPI_SEGS_OUT = 136
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # One command line per connection:
+    #   sink        read until EOF, then answer the byte count
+    #   source SEC  send for SEC seconds, then close
+    #   echo        send every PING_SIZE-byte message straight back
+    def handle(self) -> None:
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        words = self.rfile.readline(64).decode("ascii", "replace").split()
+        if not words:
+            return
+        try:
+            if words[0] == "sink":
+                total = 0
+                while True:
+                    data = self.rfile.read1(BUF)
+                    if not data:
+                        break
+                    total += len(data)
+                self.wfile.write(f"{total}\n".encode())
+            elif words[0] == "source" and len(words) > 1:
+                deadline = time.monotonic() + min(MAX_SOURCE_SEC, float(words[1]))
+                buf = bytes(BUF)
+                while time.monotonic() < deadline:
+                    self.connection.sendall(buf)
+            elif words[0] == "echo":
+                while True:
+                    data = self.rfile.read(PING_SIZE)
+                    if len(data) < PING_SIZE:
+                        break
+                    self.wfile.write(data)
+        except (OSError, ValueError):
+            pass
+
+
+class Server(socketserver.ThreadingTCPServer):
+    # The station end: python3 -m refurb.nettest serve. The test starts one
+    # on 127.0.0.1 itself when the server is "local".
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int] = ("0.0.0.0", DEFAULT_PORT)) -> None:
+        super().__init__(addr, _Handler)
+
+    def start(self) -> "Server":
+        threading.Thread(target=self.serve_forever, name="refurb-netserver", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def _read(path: str) -> str:
+    try:
+        with open(backend.path(path), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _int(text: str) -> Optional[int]:
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def link(iface: str) -> Dict[str, str]:
+    base = f"/sys/class/net/{iface}"
+    # speed reads -1 (or fails) without a link.
+    return {"name": iface, "carrier": _read(f"{base}/carrier"), "operstate": _read(f"{base}/operstate"),
+            "speed_mbps": _read(f"{base}/speed"), "duplex": _read(f"{base}/duplex"), "mtu": _read(f"{base}/mtu"),
+            "driver": _read(f"{base}/device/uevent").partition("DRIVER=")[2].split("\n")[0]}
+
+
+def _counters(iface: str) -> Dict[str, int]:
+    return {c: _int(_read(f"/sys/class/net/{iface}/statistics/{c}")) or 0 for c in COUNTERS}
+
+
+def _tcp_segments(s: socket.socket) -> Tuple[int, int]:
+    # (segments sent, segments retransmitted) of this connection only; the
+    # system-wide /proc/net/snmp counters also count the spool's SMB sync.
+    try:
+        info = s.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCPI_SEGS_OUT + 8)
+    except OSError:
+        return 0, 0
+    if len(info) < TCPI_SEGS_OUT + 4:
+        return 0, 0
+    return struct.unpack_from("I", info, TCPI_SEGS_OUT)[0], struct.unpack_from("I", info, TCPI_TOTAL_RETRANS)[0]
+
+
+def _connect(host: str, port: int, cmd: str, timeout: float = 10.0, iface: str = "") -> socket.socket:
+    # With iface the socket is bound to that port (SO_BINDTODEVICE, needs
+    # root), so the traffic cannot take another route to the server.
+    err: Optional[OSError] = None
+    for family, kind, proto, _, addr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        s = socket.socket(family, kind, proto)
+        if iface:
+            try:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, iface.encode())
+            except OSError as e:
+                s.close()
+                raise OSError(f"cannot bind to {iface}: {e}") from e
+        try:
+            s.settimeout(timeout)
+            s.connect(addr)
+        except OSError as e:
+            s.close()
+            err = e
+            continue
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.sendall(f"{cmd}\n".encode())
+        return s
+    raise err or OSError(f"cannot resolve {host}")
+
+
+def latency(host: str, port: int, count: int = PINGS, iface: str = "") -> List[float]:
+    # Round trips of a small message over one connection, in ms.
+    rtts: List[float] = []
+    msg = bytes(PING_SIZE)
+    with _connect(host, port, "echo", iface=iface) as s:
+        for _ in range(count):
+            t0 = time.perf_counter()
+            s.sendall(msg)
+            got = 0
+            while got < PING_SIZE:
+                chunk = s.recv(PING_SIZE - got)
+                if not chunk:
+                    raise OSError("echo connection closed")
+                got += len(chunk)
+            rtts.append((time.perf_counter() - t0) * 1000)
+    return rtts
+
+
+def _upload(host: str, port: int, seconds: float, iface: str) -> Tuple[int, Tuple[int, int]]:
+    buf = bytes(BUF)
+    with _connect(host, port, "sink", seconds + 30, iface) as s:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            s.sendall(buf)
+        s.shutdown(socket.SHUT_WR)
+        # The server's count: only what actually arrived.
+        total = int(s.makefile("rb").readline() or b"0")
+        return total, _tcp_segments(s)
+
+
+def _download(host: str, port: int, seconds: float, iface: str) -> Tuple[int, Tuple[int, int]]:
+    total = 0
+    buf = bytearray(BUF)
+    with _connect(host, port, f"source {seconds:g}", seconds + 30, iface) as s:
+        while True:
+            n = s.recv_into(buf)
+            if not n:
+                return total, _tcp_segments(s)
+            total += n
+
+
+def throughput(host: str, port: int, seconds: float, streams: int, direction: str, iface: str = "",
+               segments: Optional[List[Tuple[int, int]]] = None) -> float:
+    # Total Mbit/s over parallel connections, "up" (to the server) or "down".
+    # segments collects (sent, retransmitted) per connection.
+    fn = _upload if direction == "up" else _download
+    totals: List[int] = []
+    errors: List[str] = []
+
+    def stream() -> None:
+        try:
+            total, segs = fn(host, port, seconds, iface)
+            totals.append(total)
+            if segments is not None:
+                segments.append(segs)
+        except (OSError, ValueError) as e:
+            errors.append(str(e))
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=stream, name=f"refurb-net-{direction}-{i}", daemon=True) for i in range(streams)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(seconds + 60)
+    elapsed = time.monotonic() - start
+    if errors:
+        raise OSError(f"{direction}: {errors[0]}")
+    return sum(totals) * 8 / elapsed / 1e6 if elapsed > 0 else 0.0
+
+
+def _pct(vals: List[float], pct: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(len(vals) * pct / 100))] if vals else 0.0
+
+
+def network_test(logger, server: str, seconds: float = 10.0, streams: int = 4, min_speed: int = 1000,
+                 min_ratio: float = 0.7, max_rtt_ms: float = 5.0, max_retrans_pct: float = 1.0) -> bool:
+    # Link: negotiated speed and duplex of the first port with carrier.
+    # Traffic: round trips, then upload and download over parallel streams
+    # against the station's server (host[:port], or "local" for a server on
+    # 127.0.0.1). The connections are bound to the port under test, except
+    # to the local server. Throughput must reach min_ratio of the negotiated
+    # speed. Retransmissions are those of the test's own connections, so
+    # only what this end sent: mostly the upload.
+    ifaces = probe.wired_interfaces()
+    if not ifaces:
+        logger.append("network_test", time=ts(), present="false")
+        return True
+    logger.append("network_test", time=ts(), action="start", server=server, streams=streams, seconds=f"{seconds:g}")
+    links = [link(i) for i in ifaces]
+    up = [lk for lk in links if lk["carrier"] == "1"]
+    res: Dict[str, str] = {}
+    errors: List[str] = []
+    ok = True
+    iface = up[0]["name"] if up else ""
+    speed = _int(up[0]["speed_mbps"]) if up else None
+    if not up:
+        errors.append("no link on any wired port")
+        ok = False
+    else:
+        if speed is not None and speed > 0:
+            ok = ok and speed >= min_speed
+        if up[0]["duplex"]:
+            ok = ok and up[0]["duplex"] == "full"
+    srv = None
+    before = _counters(iface) if iface else {}
+    segments: List[Tuple[int, int]] = []
+    try:
+        if up:
+            bind = iface
+            if server == "local":
+                srv = Server(("127.0.0.1", 0)).start()
+                host, port = srv.server_address[0], srv.server_address[1]
+                bind = ""
+            else:
+                host, _, p = server.partition(":")
+                port = int(p or DEFAULT_PORT)
+            rtts = latency(host, port, iface=bind)
+            res["rtt_p50_ms"] = f"{_pct(rtts, 50):.3f}"
+            res["rtt_p99_ms"] = f"{_pct(rtts, 99):.3f}"
+            res["rtt_max_ms"] = f"{max(rtts):.3f}"
+            ok = ok and _pct(rtts, 99) <= max_rtt_ms
+            for direction in ("up", "down"):
+                mbps = throughput(host, port, seconds, streams, direction, bind, segments)
+                res[f"{direction}_mbps"] = f"{mbps:.0f}"
+                if speed is not None and speed > 0:
+                    ok = ok and mbps >= min_ratio * speed
+    except (OSError, ValueError) as e:
+        errors.append(str(e))
+        ok = False
+    finally:
+        if srv is not None:
+            srv.stop()
+    out_segs, retrans = sum(s for s, _ in segments), sum(r for _, r in segments)
+    if out_segs > 0:
+        pct = 100.0 * retrans / out_segs
+        res["retrans_pct"] = f"{pct:.2f}"
+        ok = ok and pct <= max_retrans_pct
+    delta = {c: v - before.get(c, 0) for c, v in _counters(iface).items()} if iface else {}
+    ok = ok and not any(delta.get(c) for c in ERROR_COUNTERS)
+    entry = logger.append("network_test", time=ts(), action="end", ok=str(ok).lower(), iface=iface,
+                          speed_mbps=speed if speed is not None else "", duplex=up[0]["duplex"] if up else "",
+                          min_speed_mbps=min_speed, min_ratio=f"{min_ratio:.2f}", max_rtt_ms=f"{max_rtt_ms:g}",
+                          max_retrans_pct=f"{max_retrans_pct:g}", error="; ".join(errors), **res)
+    for lk in links:
+        logger.add(entry, "link", **lk)
+    if delta:
+        logger.add(entry, "counters", iface=iface, **delta)
+    return ok
+
+
+def server_for(cfg: Dict[str, str]) -> str:
+    # Without REFURB_NET_SERVER the share's host runs the server.
+    if cfg.get("REFURB_NET_SERVER"):
+        return cfg["REFURB_NET_SERVER"]
+    url = cfg.get("REFURB_SMB_URL", "")
+    if url.startswith("local:"):
+        return "local"
+    return url.lstrip("/").split("/", 1)[0]
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="python3 -m refurb.nettest", description="Network test server and client")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="run the station end")
+    p.add_argument("--bind", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p = sub.add_parser("run", help="measure against a server (host[:port] or local)")
+    p.add_argument("server")
+    p.add_argument("--seconds", type=float, default=10.0)
+    p.add_argument("--streams", type=int, default=4)
+    p.add_argument("--iface", default="", help="bind the connections to this port (needs root)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "serve":
+        srv = Server((args.bind, args.port))
+        print(f"Listening on {args.bind}:{args.port}")
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        srv.server_close()
+        return 0
+    srv = Server(("127.0.0.1", 0)).start() if args.server == "local" else None
+    host, _, p = args.server.partition(":")
+    host, port = (srv.server_address[0], srv.server_address[1]) if srv else (host, int(p or DEFAULT_PORT))
+    try:
+        rtts = latency(host, port, iface=args.iface)
+        print(f"rtt p50 {_pct(rtts, 50):.3f} ms, p99 {_pct(rtts, 99):.3f} ms, max {max(rtts):.3f} ms")
+        for direction in ("up", "down"):
+            mbps = throughput(host, port, args.seconds, args.streams, direction, args.iface)
+            print(f"{direction}: {mbps:.0f} Mbit/s")
+    finally:
+        if srv is not None:
+            srv.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,99 @@
+import json
+import os
+import re
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Tuple
+
+# stress-ng --metrics-brief rows, e.g.
+# stress-ng: metrc: [1234] cpu   123456   60.00   479.20   0.31   2057.60   257.49
+_METRIC_RE = re.compile(
+    r"stress-ng:\s+(?:info|metrc):\s+\[\d+\]\s+([A-Za-z][\w-]*)\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)"
+)
+MAX_SAMPLES = 500
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    metrics: Dict[str, float] = {}
+    for m in _METRIC_RE.finditer(text or ""):
+        metrics[m.group(1)] = float(m.group(6))
+    return metrics
+
+
+def baseline_key(audit_root: ET.Element) -> str:
+    product = ""
+    for node in audit_root.iter("node"):
+        if node.get("class") == "system":
+            product = (node.findtext("product") or "").strip()
+            break
+    cpu = ""
+    for node in audit_root.iter("node"):
+        if node.get("class") == "processor" and node.findtext("product"):
+            cpu = (node.findtext("product") or "").strip()
+            break
+    return f"{product}|{cpu}" if product or cpu else ""
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    vals = sorted(values)
+    if not vals:
+        return 0.0
+    k = (len(vals) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(vals) - 1)
+    return vals[lo] + (vals[hi] - vals[lo]) * (k - lo)
+
+
+class PerfBaseline:
+    # Per-model stress-ng throughput history, kept as one JSON file on the
+    # share: {key: {stressor: [bogo ops/s, ...]}}. A unit is flagged when a
+    # stressor falls outside the [low, high] percentile band of earlier
+    # passing units of the same model.
+    def __init__(self, path: str, key: str, band: Tuple[float, float] = (2.0, 98.0), min_samples: int = 5) -> None:
+        self.path = path
+        self.key = key
+        self.band = band
+        self.min_samples = min_samples
+
+    def _load(self) -> Dict[str, Dict[str, List[float]]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def check(self, metrics: Dict[str, float]) -> Dict[str, Dict[str, str]]:
+        history = self._load().get(self.key, {})
+        result: Dict[str, Dict[str, str]] = {}
+        for stressor, value in metrics.items():
+            samples = history.get(stressor, [])
+            entry = {"samples": str(len(samples)), "flag": "none"}
+            if len(samples) >= self.min_samples:
+                low = _percentile(samples, self.band[0])
+                high = _percentile(samples, self.band[1])
+                entry.update({"band_low": f"{low:.2f}", "band_high": f"{high:.2f}"})
+                entry["flag"] = "low" if value < low else ("high" if value > high else "ok")
+            result[stressor] = entry
+        return result
+
+    def update(self, metrics: Dict[str, float]) -> None:
+        if not self.key or not metrics:
+            return
+        # Re-read right before writing so concurrent stations lose as little
+        # as possible; the file is replaced atomically.
+        data = self._load()
+        history = data.setdefault(self.key, {})
+        for stressor, value in metrics.items():
+            samples = history.setdefault(stressor, [])
+            samples.append(round(value, 2))
+            del samples[:-MAX_SAMPLES]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # pids repeat across stations sharing the file, a uuid does not.
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
@@ -0,0 +1,254 @@
+import os
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from . import backend, uevent
+
+# Results are memoized for the lifetime of the process (one boot) and dropped
+# when a uevent arrives for the subsystem they were read from. Without a
+# netlink listener nothing is cached: the sysfs reads are cheap anyway.
+_cache: Dict[str, object] = {}
+_lock = threading.Lock()
+_SUBSYSTEM_KEYS = {
+    "block": ("block_devices",),
+    "power_supply": ("batteries",),
+    "net": ("wireless_interfaces", "wired_interfaces"),
+    "drm": ("drm_connectors",),
+}
+_watching = False
+_generation = 0
+
+
+def _on_uevent(event: Dict[str, str]) -> None:
+    global _generation
+    keys = _SUBSYSTEM_KEYS.get(event.get("SUBSYSTEM", ""), ())
+    with _lock:
+        _generation += 1
+        for k in keys:
+            _cache.pop(k, None)
+
+
+def _memo(key: str, fn: Callable[[], object]) -> object:
+    global _watching
+    with _lock:
+        if key in _cache:
+            return _cache[key]
+        if not _watching:
+            lst = uevent.listener()
+            if lst is None:
+                return fn()
+            lst.subscribe(_on_uevent)
+            _watching = True
+        gen = _generation
+    val = fn()
+    with _lock:
+        # Don't cache a value read while an event was being delivered.
+        if gen == _generation:
+            _cache[key] = val
+    return val
+
+
+def invalidate() -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+
+
+def _read(path: str) -> str:
+    try:
+        with open(backend.path(path), "r", errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _listdir(path: str) -> List[str]:
+    try:
+        return sorted(os.listdir(backend.path(path)))
+    except OSError:
+        return []
+
+
+def _block_devices() -> List[str]:
+    # Same set lsblk reports as TYPE "disk": block devices backed by real
+    # hardware (no loop/zram/dm/md) that are not optical drives.
+    out = []
+    for name in _listdir("/sys/block"):
+        if name.startswith("sr") or not os.path.exists(backend.path(f"/sys/block/{name}/device")):
+            continue
+        out.append(f"/dev/{name}")
+    return out
+
+
+def block_devices() -> List[str]:
+    return list(_memo("block_devices", _block_devices))
+
+
+def _batteries() -> List[str]:
+    out = []
+    for name in _listdir("/sys/class/power_supply"):
+        base = f"/sys/class/power_supply/{name}"
+        if _read(f"{base}/type") == "Battery" and _read(f"{base}/scope") != "Device":
+            out.append(name)
+    return out
+
+
+def batteries() -> List[str]:
+    return list(_memo("batteries", _batteries))
+
+
+def upower_path(battery: str) -> str:
+    return f"/org/freedesktop/UPower/devices/battery_{battery}"
+
+
+def _wireless_interfaces() -> List[str]:
+    return [n for n in _listdir("/sys/class/net")
+            if os.path.exists(backend.path(f"/sys/class/net/{n}/wireless"))
+            or os.path.exists(backend.path(f"/sys/class/net/{n}/phy80211"))]
+
+
+def wireless_interfaces() -> List[str]:
+    return list(_memo("wireless_interfaces", _wireless_interfaces))
+
+
+def _wired_interfaces() -> List[str]:
+    # Ethernet (ARPHRD_ETHER) ports on real hardware; no lo, bridges or wifi.
+    wireless = set(_wireless_interfaces())
+    return [n for n in _listdir("/sys/class/net")
+            if n not in wireless and _read(f"/sys/class/net/{n}/type") == "1"
+            and os.path.exists(backend.path(f"/sys/class/net/{n}/device"))]
+
+
+def wired_interfaces() -> List[str]:
+    return list(_memo("wired_interfaces", _wired_interfaces))
+
+
+def _drm_connectors() -> List[Tuple[str, str]]:
+    out = []
+    for name in _listdir("/sys/class/drm"):
+        status = _read(f"/sys/class/drm/{name}/status")
+        if "-" in name and status:
+            out.append((name.split("-", 1)[1], status))
+    return out
+
+
+def drm_connectors() -> List[Tuple[str, str]]:
+    return list(_memo("drm_connectors", _drm_connectors))
+
+
+USB_DEVICES = "/sys/bus/usb/devices"
+
+
+class UsbPort:
+    # One physical connector: the root hub port(s) behind it, e.g.
+    # ("usb1-port2", "usb2-port2") when the USB2 and USB3 halves are peers.
+    def __init__(self, names: Tuple[str, ...], connect_type: str) -> None:
+        self.names = names
+        self.connect_type = connect_type
+
+    @property
+    def internal(self) -> bool:
+        return self.connect_type in ("hardwired", "not used")
+
+
+def _port_key(name: str) -> Tuple[int, int]:
+    bus, _, port = name[3:].partition("-port")
+    return (int(bus), int(port)) if bus.isdigit() and port.isdigit() else (0, 0)
+
+
+def usb_ports() -> List[UsbPort]:
+    seen = set()
+    ports = []
+    hubs = [h for h in _listdir(USB_DEVICES) if h.startswith("usb")]
+    for hub in sorted(hubs, key=lambda h: int(h[3:]) if h[3:].isdigit() else 0):
+        base = os.path.join(USB_DEVICES, hub, f"{hub[3:]}-0:1.0")
+        for name in sorted((n for n in _listdir(base) if n.startswith(f"{hub}-port")), key=_port_key):
+            if name in seen:
+                continue
+            names = [name]
+            peer = backend.path(os.path.join(base, name, "peer"))
+            if os.path.islink(peer):
+                names.append(os.path.basename(os.path.realpath(peer)))
+            seen.update(names)
+            ports.append(UsbPort(tuple(names), _read(os.path.join(base, name, "connect_type"))))
+    return ports
+
+
+def usb_port_of(devpath: str) -> str:
+    # ".../usb1/1-2/1-2.4" -> "usb1-port2": devices behind a hub count for
+    # the root port the hub is plugged into.
+    name = devpath.rstrip("/").rsplit("/", 1)[-1]
+    bus, _, chain = name.partition("-")
+    if not bus.isdigit() or not chain or ":" in chain:
+        return ""
+    return f"usb{bus}-port{chain.split('.', 1)[0]}"
+
+
+def usb_fixed_ports() -> List[str]:
+    # Root ports with a device the firmware reports as non-removable.
+    out = []
+    for name in _listdir(USB_DEVICES):
+        port = usb_port_of(name)
+        if port and "." not in name and _read(os.path.join(USB_DEVICES, name, "removable")) == "fixed":
+            out.append(port)
+    return out
+
+
+def usb_present() -> Dict[str, str]:
+    # Root port -> the device plugged into it right now (first by name).
+    out: Dict[str, str] = {}
+    for name in _listdir(USB_DEVICES):
+        port = usb_port_of(name)
+        if port and port not in out:
+            out[port] = name
+    return out
+
+
+def block_size(name: str) -> int:
+    sectors = _read(f"/sys/block/{name}/size")
+    return int(sectors) * 512 if sectors.isdigit() else 0
+
+
+def _usb_attr(devpath: str, attr: str) -> str:
+    # devpath is a uevent DEVPATH (/devices/...) or a bare device name.
+    if devpath.startswith("/devices/"):
+        return _read(f"/sys{devpath.rstrip('/')}/{attr}")
+    return _read(os.path.join(USB_DEVICES, devpath.rstrip("/").rsplit("/", 1)[-1], attr))
+
+
+def usb_speed(devpath: str) -> str:
+    return _usb_attr(devpath, "speed")
+
+
+def usb_product(devpath: str) -> str:
+    return _usb_attr(devpath, "product")
+
+
+def disk_of(source: str) -> str:
+    # /dev/sda2 -> sda, /dev/mapper/x -> dm-0; partitions resolve to their disk.
+    name = os.path.basename(os.path.realpath(source))
+    sys_path = backend.path(f"/sys/class/block/{name}")
+    if os.path.exists(os.path.join(sys_path, "partition")):
+        return os.path.basename(os.path.dirname(os.path.realpath(sys_path)))
+    return name
+
+
+def boot_usb_ports() -> List[str]:
+    # Root ports of USB disks with a mounted filesystem: the live medium.
+    try:
+        with open(backend.path("/proc/mounts"), "r") as f:
+            disks = {disk_of(ln.split()[0]) for ln in f if ln.startswith("/dev/")}
+    except OSError:
+        return []
+    out = []
+    for disk in sorted(disks):
+        parts = os.path.realpath(backend.path(f"/sys/block/{disk}")).split("/")
+        port = next((usb_port_of(p) for p in reversed(parts) if usb_port_of(p)), "")
+        if port:
+            out.append(port)
+    return out
+
+
+def has_bin(name: str) -> bool:
+    return backend.active().has_bin(name)
@@ -0,0 +1,263 @@
+import asyncio
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, List, Mapping, Optional
+
+from . import trace
+
+LineCallback = Callable[[str], None]
+MAX_OUTPUT = 8 * 1024 * 1024
+KILL_GRACE = 2.0
+# After the main process exits, how long stray children may keep the pipes open.
+EOF_GRACE = 0.5
+_READ_SIZE = 64 * 1024
+
+
+class Cancel:
+    # Thread-safe cancellation token: the UI thread calls cancel(), every
+    # command started with the token is killed (process group) right away.
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._event.set()
+            hooks = list(self._hooks)
+        for fn in hooks:
+            fn()
+
+    def _hook(self, fn: Callable[[], None]) -> Callable[[], None]:
+        with self._lock:
+            if not self._event.is_set():
+                self._hooks.append(fn)
+                return lambda: self._unhook(fn)
+        fn()
+        return lambda: None
+
+    def _unhook(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            if fn in self._hooks:
+                self._hooks.remove(fn)
+
+
+_bound = threading.local()
+
+
+def bind(cancel: Optional[Cancel]) -> None:
+    # Commands started from this thread without their own token get this one;
+    # the scheduler binds each task's token to its worker thread.
+    _bound.cancel = cancel
+
+
+def current() -> Optional[Cancel]:
+    return getattr(_bound, "cancel", None)
+
+
+def on_cancel(fn: Callable[[], None]) -> Callable[[], None]:
+    # For processes started outside run(): fn kills them when the bound token
+    # is cancelled. Returns the unhook function.
+    cancel = current()
+    return cancel._hook(fn) if cancel is not None else (lambda: None)
+
+
+def sleep(seconds: float) -> bool:
+    # time.sleep that wakes up on cancellation of the bound token; True if cancelled.
+    cancel = current()
+    if cancel is None:
+        time.sleep(seconds)
+        return False
+    return cancel.wait(seconds)
+
+
+class Result:
+    def __init__(self) -> None:
+        self.code = 0
+        self.out = ""
+        self.err = ""
+        self.duration = 0.0
+        self.timed_out = False
+        self.cancelled = False
+        self.truncated = False
+
+    @property
+    def ok(self) -> bool:
+        return self.code == 0 and not self.timed_out and not self.cancelled
+
+
+class _Capture:
+    # Keeps at most max_bytes of the tail of a stream and hands complete
+    # lines to the callback as they arrive.
+    def __init__(self, max_bytes: int, on_line: Optional[LineCallback]) -> None:
+        self.max_bytes = max_bytes
+        self.on_line = on_line
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.dropped = 0
+        self._partial = b""
+
+    def feed(self, data: bytes) -> None:
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            self.size -= len(self.chunks[0])
+            self.dropped += len(self.chunks.pop(0))
+        if self.on_line is None:
+            return
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for ln in lines:
+            self._emit(ln)
+
+    def close(self) -> None:
+        if self.on_line is not None and self._partial:
+            self._emit(self._partial)
+            self._partial = b""
+
+    def _emit(self, line: bytes) -> None:
+        try:
+            self.on_line(line.decode("utf-8", "replace").rstrip("\r"))
+        except Exception:
+            pass
+
+    def text(self) -> str:
+        data = b"".join(self.chunks)
+        if len(data) > self.max_bytes:
+            self.dropped += len(data) - self.max_bytes
+            data = data[-self.max_bytes:]
+        text = data.decode("utf-8", "replace")
+        return f"[... {self.dropped} bytes weggelaten ...]\n{text}" if self.dropped else text
+
+
+async def _pump(stream: asyncio.StreamReader, cap: _Capture) -> None:
+    while True:
+        data = await stream.read(_READ_SIZE)
+        if not data:
+            break
+        cap.feed(data)
+    cap.close()
+
+
+def _killpg(proc, sig: int) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _exited(proc) -> int:
+    # Process.wait() also waits for the pipes to close, which never happens
+    # while a stray child keeps them open; returncode is set on exit itself.
+    delay = 0.001
+    while proc.returncode is None:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.05)
+    return proc.returncode
+
+
+async def _terminate(proc) -> None:
+    _killpg(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(_exited(proc), KILL_GRACE)
+    except asyncio.TimeoutError:
+        pass
+    _killpg(proc, signal.SIGKILL)
+    await _exited(proc)
+
+
+async def run_async(cmd: List[str], timeout: Optional[float] = None, on_line: Optional[LineCallback] = None,
+                    on_err_line: Optional[LineCallback] = None, cancel: Optional[Cancel] = None,
+                    max_output: int = MAX_OUTPUT, env: Optional[Mapping[str, str]] = None) -> Result:
+    if cancel is None:
+        cancel = current()
+    t = trace.tracer()
+    if t is None:
+        return await _run_async(cmd, timeout, on_line, on_err_line, cancel, max_output, env)
+    with trace.span(os.path.basename(cmd[0]) if cmd else "?", "subprocess", argv=" ".join(cmd)[:300]) as sp:
+        ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        token = t.command_started()
+        try:
+            res = await _run_async(cmd, timeout, on_line, on_err_line, cancel, max_output, env)
+        finally:
+            overlapped = t.command_finished(token)
+        ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        sp.set(code=res.code, out_bytes=len(res.out), err_bytes=len(res.err), timed_out=res.timed_out,
+               cancelled=res.cancelled, overlapped=overlapped,
+               child_cpu_ms=round((ru1.ru_utime + ru1.ru_stime - ru0.ru_utime - ru0.ru_stime) * 1000, 1))
+    return res
+
+
+async def _run_async(cmd: List[str], timeout: Optional[float], on_line: Optional[LineCallback],
+                     on_err_line: Optional[LineCallback], cancel: Optional[Cancel], max_output: int,
+                     env: Optional[Mapping[str, str]]) -> Result:
+    res = Result()
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    unhook = lambda: None  # noqa: E731
+    if cancel is not None:
+        def wake() -> None:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda: stop.done() or stop.set_result("cancel"))
+        unhook = cancel._hook(wake)
+    # Own session: the whole pipeline can be killed at once, and it never
+    # competes with the console for the terminal. The hook is already in place
+    # so a cancel during the spawn is not lost; it must not outlive a failed one.
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True, env=dict(env) if env is not None else None)
+    except BaseException:
+        unhook()
+        raise
+    out, err = _Capture(max_output, on_line), _Capture(max_output, on_err_line)
+    pumps = asyncio.gather(_pump(proc.stdout, out), _pump(proc.stderr, err))
+    waiter = asyncio.ensure_future(_exited(proc))
+    try:
+        done, _ = await asyncio.wait({waiter, stop}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if waiter not in done:
+            res.cancelled = stop in done
+            res.timed_out = not res.cancelled
+            await _terminate(proc)
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), EOF_GRACE)
+        except asyncio.TimeoutError:
+            # A child outlived the main process and still holds the pipes.
+            _killpg(proc, signal.SIGKILL)
+            await pumps
+    finally:
+        unhook()
+        if proc.returncode is None:
+            _killpg(proc, signal.SIGKILL)
+        if not waiter.done():
+            waiter.cancel()
+        if not pumps.done():
+            pumps.cancel()
+    res.code = proc.returncode if proc.returncode is not None else -signal.SIGKILL
+    res.out, res.err = out.text(), err.text()
+    res.truncated = bool(out.dropped or err.dropped)
+    if res.timed_out:
+        res.err += f"\nCommand {cmd!r} timed out after {timeout} seconds"
+    elif res.cancelled:
+        res.err += f"\nCommand {cmd!r} cancelled"
+    res.duration = time.monotonic() - started
+    return res
+
+
+def run(cmd: List[str], timeout: Optional[float] = None, on_line: Optional[LineCallback] = None,
+        on_err_line: Optional[LineCallback] = None, cancel: Optional[Cancel] = None,
+        max_output: int = MAX_OUTPUT, env: Optional[Mapping[str, str]] = None) -> Result:
+    # Synchronous entry point; safe from any thread that has no running loop.
+    return asyncio.run(run_async(cmd, timeout, on_line, on_err_line, cancel, max_output, env))
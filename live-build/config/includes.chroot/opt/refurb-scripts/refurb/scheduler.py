@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Callable, List, Optional, Set
+
+from . import runner, trace
+
+# After the budget runs out: how long cancelled tasks get to kill their
+# processes and log their end before run() returns without them.
+CANCEL_GRACE = 45.0
+RESOURCES = {"cpu", "memory", "disk-io", "network", "passive"}
+
+
+class Task:
+    def __init__(self, name: str, label: str, fn: Callable[[], bool], resources: Set[str]) -> None:
+        unknown = set(resources) - RESOURCES
+        if unknown:
+            raise ValueError(f"unknown resources for {name}: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.label = label
+        self.fn = fn
+        # "passive" tasks (sampling, waiting on a device) never conflict.
+        self.resources = set(resources) - {"passive"}
+        self.status = "pending"
+        self.ok = False
+        self.error = ""
+        self.started = 0.0
+        self.finished = 0.0
+        self.cancel = runner.Cancel()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def duration(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+class Scheduler:
+    # Greedy list scheduler: tasks start in declaration order as soon as none
+    # of their resources are held by a running task. With a budget, tasks not
+    # started in time are skipped and tasks still running are cancelled: the
+    # processes they started are killed and run() waits up to CANCEL_GRACE
+    # for their threads. on_done is called for every task that finished by
+    # itself, never for a timed out one.
+    def __init__(self, budget: Optional[float] = None, on_done: Optional[Callable[[Task], None]] = None) -> None:
+        self.budget = budget if budget and budget > 0 else None
+        self.on_done = on_done
+        self.tasks: List[Task] = []
+        self._cond = threading.Condition()
+
+    def add(self, name: str, label: str, fn: Callable[[], bool], resources: Set[str]) -> Task:
+        task = Task(name, label, fn, resources)
+        self.tasks.append(task)
+        return task
+
+    def _worker(self, task: Task) -> None:
+        runner.bind(task.cancel)
+        try:
+            with trace.span(task.name, "test"):
+                ok = bool(task.fn())
+            error = ""
+        except Exception as e:
+            ok = False
+            error = str(e) or type(e).__name__
+        with self._cond:
+            done = task.status == "running"
+            if done:
+                task.ok = ok
+                task.error = error
+                task.status = "done"
+                task.finished = time.monotonic()
+            self._cond.notify_all()
+        if done and self.on_done is not None:
+            self.on_done(task)
+
+    def run(self) -> List[Task]:
+        deadline = None if self.budget is None else time.monotonic() + self.budget
+        with self._cond:
+            while True:
+                busy: Set[str] = set()
+                for t in self.tasks:
+                    if t.status == "running":
+                        busy |= t.resources
+                for t in self.tasks:
+                    if t.status == "pending" and not (t.resources & busy):
+                        t.status = "running"
+                        t.started = time.monotonic()
+                        busy |= t.resources
+                        t.thread = threading.Thread(target=self._worker, args=(t,), name=f"refurb-task-{t.name}",
+                                                    daemon=True)
+                        t.thread.start()
+                if not any(t.status in {"pending", "running"} for t in self.tasks):
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    now = time.monotonic()
+                    for t in self.tasks:
+                        if t.status == "running":
+                            t.status = "timeout"
+                            t.finished = now
+                        elif t.status == "pending":
+                            t.status = "skipped"
+                    break
+                self._cond.wait(remaining)
+        timed_out = [t for t in self.tasks if t.status == "timeout"]
+        for t in timed_out:
+            t.cancel.cancel()
+        grace_end = time.monotonic() + CANCEL_GRACE
+        for t in timed_out:
+            if t.thread is not None:
+                t.thread.join(max(0.0, grace_end - time.monotonic()))
+                if t.thread.is_alive():
+                    t.error = t.error or f"still running {CANCEL_GRACE:.0f}s after cancellation"
+        return self.tasks
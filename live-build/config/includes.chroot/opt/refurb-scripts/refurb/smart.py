@@ -0,0 +1,163 @@
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import runner
+from .utils import run_cmd
+
+DEFAULT_POLLING_MIN = {"short": 2, "extended": 120}
+SMARTCTL_TEST = {"short": "short", "extended": "long"}
+
+
+def _smart_json(args: List[str], dev: str) -> Tuple[int, dict]:
+    code, out, _ = run_cmd(["smartctl", "--json", *args, dev], timeout=60)
+    try:
+        return code, json.loads(out)
+    except ValueError:
+        return code, {}
+
+
+class SelfTest:
+    def __init__(self, device: str, kind: str) -> None:
+        self.device = device
+        self.kind = kind
+        self.status = "pending"
+        self.result = ""
+        self.remaining: Optional[int] = None
+        self.polling_min = DEFAULT_POLLING_MIN.get(kind, 2)
+        self.started = 0.0
+        self.finished = 0.0
+        self.health_ok = False
+        self.report = ""
+        # The self-test log as it was before this test started.
+        self.log_before: List[dict] = []
+
+    @property
+    def duration(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def ok(self) -> bool:
+        return self.health_ok and self.status in {"passed", "unsupported", "skipped"}
+
+
+def _progress(dev: str) -> Tuple[Optional[bool], Optional[int]]:
+    # Returns (running, remaining_percent); None where the drive does not say.
+    _, data = _smart_json(["-c", "-l", "selftest"], dev)
+    ata = (data.get("ata_smart_data") or {}).get("self_test") or {}
+    if ata:
+        status = ata.get("status") or {}
+        remaining = status.get("remaining_percent")
+        return remaining is not None or (status.get("value", 0) >> 4) == 0xF, remaining
+    nvme = data.get("nvme_self_test_log") or {}
+    if nvme:
+        op = (nvme.get("current_self_test_operation") or {}).get("value", 0)
+        done = nvme.get("current_self_test_completion_percent")
+        return op != 0, (100 - done) if done is not None else None
+    # smartctl without --json support
+    code, out, _ = run_cmd(["smartctl", "-c", dev], timeout=60)
+    m = re.search(r"(\d+)% of test remaining", out)
+    if m:
+        return True, int(m.group(1))
+    if "Self-test execution status" in out:
+        return False, None
+    return None, None
+
+
+def _selftest_log(dev: str) -> Tuple[str, List[dict]]:
+    # ("ata" or "nvme", entries newest first); ("", []) without a log.
+    _, data = _smart_json(["-l", "selftest"], dev)
+    table = (((data.get("ata_smart_self_test_log") or {}).get("standard") or {}).get("table")) or []
+    if table:
+        return "ata", table
+    table = (data.get("nvme_self_test_log") or {}).get("table") or []
+    return ("nvme", table) if table else ("", [])
+
+
+def _last_result(dev: str, before: List[dict]) -> Tuple[str, str]:
+    # (status, text). The newest entry counts only when the log changed since
+    # the test was started; otherwise it belongs to an earlier run.
+    kind, table = _selftest_log(dev)
+    if not table:
+        return "unsupported", ""
+    if table == before:
+        return "no_result", "self-test log has no new entry"
+    if kind == "ata":
+        status = table[0].get("status") or {}
+        passed = bool(status.get("passed", status.get("value", 1) == 0))
+        return ("passed" if passed else "failed"), status.get("string", "")
+    res = table[0].get("self_test_result") or {}
+    return ("passed" if res.get("value", 1) == 0 else "failed"), res.get("string", "")
+
+
+class SelfTestManager:
+    # Starts SMART self-tests on all disks at once and polls them from a single
+    # background thread, using the drive's remaining percentage and polling-time
+    # estimate to pace the polls and bound the wait. Kind "none" starts no
+    # self-tests but still runs the health check on every disk.
+    def __init__(self, devices: List[str], kind: str = "short", poll_interval: Optional[float] = None) -> None:
+        self.kind = kind
+        self.tests: Dict[str, SelfTest] = {dev: SelfTest(dev, kind) for dev in devices}
+        self.poll_interval = poll_interval
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # The poll thread keeps the starting thread's cancellation token.
+        self._cancel = runner.current()
+
+    def start(self) -> None:
+        for dev, t in self.tests.items():
+            if self.kind == "none":
+                t.status = "skipped"
+                t.started = t.finished = time.monotonic()
+                continue
+            t.log_before = _selftest_log(dev)[1]
+            code, data = _smart_json(["-t", SMARTCTL_TEST.get(self.kind, self.kind)], dev)
+            t.started = time.monotonic()
+            if code & 0b11:
+                t.status = "unsupported"
+                t.result = "self-test could not be started"
+                t.finished = t.started
+                continue
+            polling = (data.get("ata_smart_data") or {}).get("self_test", {}).get("polling_minutes", {})
+            t.polling_min = polling.get(self.kind, t.polling_min)
+            t.status = "running"
+        self._thread = threading.Thread(target=self._poll, name="refurb-smart", daemon=True)
+        self._thread.start()
+
+    def _poll(self) -> None:
+        runner.bind(self._cancel)
+        running = [t for t in self.tests.values() if t.status == "running"]
+        while running:
+            interval = self.poll_interval or min(30.0, max(5.0, max(t.polling_min for t in running) * 60 / 20))
+            if runner.sleep(interval):
+                for t in running:
+                    t.status = "cancelled"
+                    t.finished = time.monotonic()
+                break
+            for t in list(running):
+                busy, remaining = _progress(t.device)
+                t.remaining = remaining
+                if busy and t.duration < t.polling_min * 60 * 2 + 120:
+                    continue
+                t.finished = time.monotonic()
+                if busy:
+                    t.status = "timeout"
+                    t.result = f"still running after {t.duration:.0f}s"
+                else:
+                    t.status, t.result = _last_result(t.device, t.log_before)
+                running.remove(t)
+        for t in self.tests.values():
+            code, out, err = run_cmd(["smartctl", "-H", "-A", t.device], timeout=60)
+            t.health_ok = code == 0
+            t.report = out or err
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> List[SelfTest]:
+        if self._thread is None:
+            self.start()
+        self._done.wait(timeout)
+        return list(self.tests.values())
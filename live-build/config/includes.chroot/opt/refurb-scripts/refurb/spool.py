@@ -0,0 +1,151 @@
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .cas import MANIFEST_SUFFIX, BlobStore, rebuild
+from .utils import ensure_dir
+
+
+class Spool:
+    # Artifacts are written to local_dir (tmpfs) and pushed to remote_dir by a
+    # background thread. Pushing a name that is already queued coalesces into
+    # one copy of whatever is on disk when the syncer gets to it; pushing a
+    # name that no longer exists locally removes it from the share. With a
+    # blob store, XML goes to the share as a "<name>.cas" manifest instead.
+    def __init__(self, local_dir: str, remote_dir: str, max_backoff: float = 30.0,
+                 store: Optional[BlobStore] = None) -> None:
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir
+        self.store = store
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}
+        self._inflight: Optional[str] = None
+        self.synced = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.last_error = ""
+        self._latencies: List[float] = []
+        ensure_dir(local_dir)
+        self._thread = threading.Thread(target=self._run, name="refurb-spool", daemon=True)
+        self._thread.start()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.local_dir, name)
+
+    def seed(self) -> None:
+        try:
+            names = os.listdir(self.remote_dir)
+        except OSError:
+            return
+        for name in names:
+            src = os.path.join(self.remote_dir, name)
+            if not os.path.isfile(src) or name.endswith(".part"):
+                continue
+            if name.endswith(MANIFEST_SUFFIX):
+                dst = self.path(name[:-len(MANIFEST_SUFFIX)])
+                if not os.path.exists(dst):
+                    try:
+                        data = rebuild(src)
+                        with open(dst, "wb") as f:
+                            f.write(data)
+                    except (OSError, ValueError, KeyError):
+                        pass
+            elif not os.path.exists(self.path(name)):
+                try:
+                    shutil.copyfile(src, self.path(name))
+                except OSError:
+                    pass
+
+    def push(self, name: str) -> None:
+        with self._cond:
+            if name in self._pending:
+                self.coalesced += 1
+            else:
+                self._pending[name] = time.monotonic()
+            self.max_depth = max(self.max_depth, len(self._pending))
+            self._cond.notify_all()
+
+    def push_path(self, path: str) -> None:
+        self.push(os.path.relpath(path, self.local_dir))
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending) + (1 if self._inflight else 0)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def stats(self) -> Dict[str, str]:
+        with self._cond:
+            lat = list(self._latencies)
+            depth = len(self._pending) + (1 if self._inflight else 0)
+        out = {
+            "queue_depth": str(depth),
+            "max_depth": str(self.max_depth),
+            "synced": str(self.synced),
+            "failed": str(self.failed),
+            "coalesced": str(self.coalesced),
+            "latency_avg": f"{sum(lat) / len(lat):.3f}" if lat else "0",
+            "latency_max": f"{max(lat):.3f}" if lat else "0",
+        }
+        if self.store is not None:
+            out.update(self.store.stats())
+        return out
+
+    def _sync_one(self, name: str) -> None:
+        src = self.path(name)
+        dst = os.path.join(self.remote_dir, name)
+        manifest = dst + MANIFEST_SUFFIX
+        if not os.path.exists(src):
+            for p in (dst, manifest):
+                if os.path.exists(p):
+                    os.remove(p)
+            return
+        ensure_dir(os.path.dirname(dst))
+        if self.store is not None and name.endswith(".xml"):
+            self.store.store_file(src, manifest)
+            if os.path.exists(dst):
+                os.remove(dst)
+            return
+        part = f"{dst}.part"
+        shutil.copyfile(src, part)
+        os.replace(part, dst)
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                name, queued = min(self._pending.items(), key=lambda kv: kv[1])
+                del self._pending[name]
+                self._inflight = name
+            try:
+                self._sync_one(name)
+            except OSError as e:
+                with self._cond:
+                    self.failed += 1
+                    self.last_error = str(e)
+                    self._pending.setdefault(name, queued)
+                    self._inflight = None
+                    self._cond.notify_all()
+                time.sleep(backoff)
+                backoff = min(self.max_backoff, backoff * 2)
+                continue
+            backoff = 1.0
+            with self._cond:
+                self.synced += 1
+                self._latencies.append(time.monotonic() - queued)
+                self._inflight = None
+                self._cond.notify_all()
@@ -1,19 +1,29 @@
 import os
+import signal
+import subprocess
 import time
-import xml.etree.ElementTree as ET
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from . import backend, probe, runner, trace
+from .audit import read_battery
+from .battery import BatterySampler, on_ac
+from .diskbench import bench_all, external
+from .erase import busy
+from .memtest import PASS_MBS, mem_available_mb, plan_workers, run_parallel
+from .perf import PerfBaseline, parse_metrics
+from .smart import SelfTestManager
+from .thermal import ThermalSampler
 from .utils import run_cmd, ts
 
 
 def _read_thermals() -> List[Tuple[str, int]]:
     temps: List[Tuple[str, int]] = []
-    for tz in sorted(os.listdir("/sys/class/thermal")):
+    for tz in sorted(os.listdir(backend.path("/sys/class/thermal"))):
         if not tz.startswith("thermal_zone"):
             continue
         path = f"/sys/class/thermal/{tz}/temp"
         try:
-            with open(path, "r") as f:
+            with open(backend.path(path), "r") as f:
                 t = int(f.read().strip())
             temps.append((tz, t))
         except Exception:
@@ -21,24 +31,115 @@ def _read_thermals() -> List[Tuple[str, int]]:
     return temps
 
 
-def cpu_stress(duration_sec: int, logger) -> bool:
-    start = time.time()
-    logger.append("cpu_test", time=ts(), action="start")
-    code, _, err = run_cmd(["stress-ng", "--cpu", "0", "--timeout", str(duration_sec), "--metrics-brief"])
-    ok = code == 0
-    temps = _read_thermals()
-    temps_str = ", ".join([f"{n}:{t/1000:.1f}C" for n, t in temps])
-    logger.append("cpu_test", time=ts(), action="end", ok=str(ok).lower(), temps=temps_str)
-    return ok
+def _kill_group(proc: subprocess.Popen) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _stop_process(proc: subprocess.Popen, grace: float = 15.0) -> str:
+    # SIGINT lets stress-ng stop its workers and still print its metrics.
+    if proc.poll() is None:
+        try:
+            os.killpg(proc.pid, signal.SIGINT)
+        except OSError:
+            pass
+    try:
+        out, _ = proc.communicate(timeout=grace)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        out, _ = proc.communicate()
+    return out or ""
+
+
+def cpu_stress(duration_sec: int, logger, adaptive: bool = False, min_sec: Optional[int] = None,
+               max_sec: Optional[int] = None, temp_limit: float = 95.0, interval: float = 2.0,
+               baseline: Optional[PerfBaseline] = None, battery: Optional[BatterySampler] = None) -> bool:
+    min_sec = min(duration_sec, min_sec if min_sec is not None else duration_sec // 3)
+    max_sec = max(duration_sec, max_sec if max_sec is not None else duration_sec * 3 // 2)
+    window = min(60.0, max(interval * 3, min_sec / 2))
+    logger.append("cpu_test", time=ts(), action="start", mode="adaptive" if adaptive else "fixed")
+    sampler = ThermalSampler(interval)
+    sampler.start()
+    if battery is not None:
+        battery.start()
+    start = time.monotonic()
+    verdict = "duration"
+    if not adaptive:
+        code, out, err = run_cmd(["stress-ng", "--cpu", "0", "--timeout", str(duration_sec), "--metrics-brief"])
+        output = out + err
+        if sampler.max_temp() >= temp_limit:
+            verdict = "runaway"
+    else:
+        cmd = ["stress-ng", "--cpu", "0", "--timeout", str(max_sec), "--metrics-brief"]
+        with trace.span(cmd[0], "subprocess", argv=" ".join(cmd)) as sp:
+            try:
+                proc = subprocess.Popen(backend.argv(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                        start_new_session=True)
+                unhook = runner.on_cancel(lambda: _kill_group(proc))
+            except OSError as e:
+                proc = None
+                code = 1
+                verdict = f"error: {e}"
+                output = ""
+            while proc is not None and proc.poll() is None:
+                if runner.sleep(interval):
+                    verdict = "cancelled"
+                    break
+                elapsed = time.monotonic() - start
+                throttling = sampler.throttled(window)
+                if sampler.max_temp() >= temp_limit:
+                    verdict = "runaway"
+                elif elapsed >= min_sec and not throttling and sampler.plateaued(window):
+                    verdict = "plateau"
+                elif elapsed >= duration_sec and not throttling:
+                    verdict = "duration"
+                elif elapsed >= max_sec:
+                    verdict = "throttling" if throttling else "duration"
+                else:
+                    continue
+                break
+            if proc is not None:
+                output = _stop_process(proc)
+                unhook()
+                code = 0 if proc.returncode in (0, -signal.SIGINT) else proc.returncode
+            sp.set(code=proc.returncode if proc is not None else code, out_bytes=len(output), verdict=verdict)
+    sampler.stop()
+    if battery is not None:
+        battery.stop()
+    ok = code == 0 and verdict in {"duration", "plateau"}
+    metrics = parse_metrics(output)
+    checks = baseline.check(metrics) if baseline is not None else {}
+    perf_ok = not any(c["flag"] == "low" for c in checks.values())
+    temps_str = ", ".join([f"{n}:{t/1000:.1f}C" for n, t in _read_thermals()])
+    entry = logger.append("cpu_test", time=ts(), action="end", ok=str(ok and perf_ok).lower(), temps=temps_str,
+                          verdict=verdict, elapsed=f"{time.monotonic() - start:.0f}", perf_ok=str(perf_ok).lower())
+    perf_el = logger.add(entry, "metrics", baseline=baseline.key if baseline is not None else "")
+    for stressor, value in metrics.items():
+        logger.add(perf_el, "stressor", name=stressor, bogo_ops_per_sec=f"{value:.2f}", **checks.get(stressor, {}))
+    sampler.log(logger, entry)
+    if baseline is not None and ok and perf_ok:
+        try:
+            baseline.update(metrics)
+        except OSError:
+            pass
+    return ok and perf_ok
 
 
-def mem_test(max_mb: int, duration_sec: int, logger) -> bool:
+def mem_test(max_mb: int, duration_sec: int, logger, mode: str = "fixed", coverage: float = 0.85,
+             workers: Optional[int] = None, pass_mbs: float = PASS_MBS) -> bool:
+    if mode == "coverage":
+        return _mem_test_coverage(duration_sec, logger, coverage, workers, pass_mbs)
     loops = max(1, duration_sec // 30)
     alloc_mb = max(32, max_mb)
-    logger.append("mem_test", time=ts(), action="start", alloc_mb=str(alloc_mb), loops=str(loops))
+    logger.append("mem_test", time=ts(), action="start", mode="fixed", alloc_mb=str(alloc_mb), loops=str(loops))
     ok = True
     for i in range(loops):
-        code, _, err = run_cmd(["bash", "-lc", f"memtester {alloc_mb}M 1"], timeout=duration_sec or None)
+        code, _, err = run_cmd(["memtester", f"{alloc_mb}M", "1"], timeout=duration_sec or None)
         if code != 0:
             ok = False
             break
@@ -46,45 +147,104 @@ def mem_test(max_mb: int, duration_sec: int, logger) -> bool:
     return ok
 
 
+def _mem_test_coverage(duration_sec: int, logger, coverage: float, workers: Optional[int], pass_mbs: float) -> bool:
+    sizes = plan_workers(coverage, workers, budget=duration_sec, pass_mbs=pass_mbs)
+    logger.append("mem_test", time=ts(), action="start", mode="coverage", available_mb=mem_available_mb(),
+                  target_mb=sum(plan_workers(coverage, workers)), alloc_mb=sum(sizes), workers=len(sizes),
+                  budget=duration_sec)
+    if not sizes:
+        logger.append("mem_test", time=ts(), action="end", ok="false", error="not enough available memory")
+        return False
+    try:
+        results = run_parallel(sizes, duration_sec)
+    except OSError as e:
+        logger.append("mem_test", time=ts(), action="end", ok="false", error=str(e))
+        return False
+    # Every worker must complete a pass: anything less leaves memory untested.
+    tested_mb = sum(w.mb for w in results if w.passes)
+    ok = all(w.ok for w in results) and tested_mb >= sum(sizes)
+    entry = logger.append("mem_test", time=ts(), action="end", ok=str(ok).lower(), alloc_mb=sum(sizes),
+                          tested_mb=tested_mb, passes=min(w.passes for w in results))
+    for w in results:
+        el = logger.add(entry, "worker", cpu=w.cpu, mb=w.mb, passes=w.passes, ok=str(w.ok).lower(),
+                        throughput_mbs=f"{w.throughput:.1f}", exit=w.returncode)
+        for line in w.failures[:20]:
+            logger.add(el, "failure", line)
+    return ok
+
+
 def list_block_devices() -> List[str]:
-    code, out, _ = run_cmd(["bash", "-lc", "lsblk -nd -o NAME,TYPE | awk '$2==\"disk\"{print $1}'"])
-    if code != 0:
-        return []
-    return [f"/dev/{n.strip()}" for n in out.strip().splitlines() if n.strip()]
+    return probe.block_devices()
 
 
-def storage_tests(logger) -> bool:
+def start_storage_tests(logger, kind: str = "short") -> Optional[SelfTestManager]:
+    devs = list_block_devices()
+    manager = SelfTestManager(devs, kind)
+    for dev in devs if kind != "none" else []:
+        logger.append("storage_test", time=ts(), device=dev, action=f"smart_{kind}_start")
+    manager.start()
+    return manager
+
+
+def storage_tests(logger, manager: Optional[SelfTestManager] = None, kind: str = "short", bench_seconds: float = 0,
+                  thresholds: Optional[Dict[str, Tuple[float, float, float]]] = None) -> bool:
     ok_all = True
-    for dev in list_block_devices():
-        logger.append("storage_test", time=ts(), device=dev, action="smart_short_start")
-        run_cmd(["smartctl", "-t", "short", dev])
-        time.sleep(5)
-        code, out, err = run_cmd(["smartctl", "-H", "-A", dev])
-        ok = code == 0
-        entry = logger.append("storage_test", time=ts(), device=dev, action="smart_health", ok=str(ok).lower())
-        el = ET.SubElement(entry, "report")
-        el.text = out or err
-        ok_all = ok_all and ok
+    if bench_seconds > 0:
+        # Only internal disks nothing else is using: a mounted disk (the live
+        # medium) or a USB stick would be judged against the wrong numbers.
+        devs = []
+        for dev in list_block_devices():
+            reason = busy(dev) or external(dev)
+            if reason:
+                logger.append("storage_test", time=ts(), device=dev, action="benchmark", skipped=reason)
+            else:
+                devs.append(dev)
+        # Benchmark before the self-tests start so the two don't compete for the media.
+        for b in bench_all(devs, bench_seconds):
+            ok = b.verdict(thresholds)
+            logger.append("storage_test", time=ts(), device=b.dev, action="benchmark", ok=str(ok).lower(),
+                          interface=b.kind, direct=str(b.direct).lower(), seq_mbs=f"{b.seq_mbs:.1f}",
+                          iops=f"{b.iops:.0f}", p50_ms=f"{b.p50_ms:.2f}", p99_ms=f"{b.p99_ms:.2f}", error=b.error)
+            ok_all = ok_all and ok
+    if manager is None:
+        manager = start_storage_tests(logger, kind)
+    for t in manager.wait():
+        if t.status != "skipped":
+            logger.append("storage_test", time=ts(), device=t.device, action=f"smart_{t.kind}_result",
+                          status=t.status, result=t.result, duration=f"{t.duration:.0f}")
+        entry = logger.append("storage_test", time=ts(), device=t.device, action="smart_health", ok=str(t.health_ok).lower())
+        logger.add_text(entry, "report", t.report)
+        ok_all = ok_all and t.ok
     return ok_all
 
 
-def battery_health(logger) -> bool:
-    code, out, _ = run_cmd(["bash", "-lc", "upower -e | grep -i battery || true"]) 
-    bats = [ln.strip() for ln in out.strip().splitlines() if ln.strip()]
+def battery_health(logger, sampler: Optional[BatterySampler] = None, max_wear_pct: float = 30.0,
+                   min_runtime_min: float = 30.0, wait: Optional[float] = None) -> bool:
+    # Wear against the design capacity always counts; the runtime under CPU
+    # load only when the sampler saw the pack discharging during cpu_stress.
+    bats = probe.batteries()
     if not bats:
         logger.append("battery", time=ts(), present="false")
         return True
+    sampled = sampler is not None and sampler.done.wait(wait)
+    ac = on_ac()
     ok_all = True
-    for bp in bats:
-        code, bout, _ = run_cmd(["upower", "-i", bp])
-        capacity = ""; energy_full = ""; energy_design = ""
-        for ln in bout.splitlines():
-            if "percentage:" in ln:
-                capacity = ln.split(":", 1)[1].strip()
-            if "energy-full:" in ln:
-                energy_full = ln.split(":", 1)[1].strip()
-            if "energy-full-design:" in ln:
-                energy_design = ln.split(":", 1)[1].strip()
-        logger.append("battery", time=ts(), path=bp, capacity=capacity, energy_full=energy_full, energy_design=energy_design)
-        ok_all = ok_all and True
+    for name in bats:
+        bat = read_battery(name)
+        wear = bat.wear_pct
+        ok = wear is None or wear <= max_wear_pct
+        d = sampler.discharge(name, bat.energy_full_wh) if sampled and name in sampler.series else None
+        if d is not None and d.measured and d.runtime_min is not None:
+            ok = ok and d.runtime_min >= min_runtime_min
+        if d is None:
+            note = "not sampled"
+        elif not d.discharging:
+            note = "on AC power" if ac else "not discharging"
+        else:
+            note = "" if d.measured else "no discharge rate"
+        entry = logger.append("battery", time=ts(), ok=str(ok).lower(), max_wear_pct=f"{max_wear_pct:g}",
+                              min_runtime_min=f"{min_runtime_min:g}", runtime_note=note, **bat.to_xml().attrib)
+        if d is not None:
+            sampler.log(logger, entry, name, d)
+        ok_all = ok_all and ok
     return ok_all
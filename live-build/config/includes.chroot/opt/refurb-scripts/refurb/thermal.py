@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Dict, List, Optional
+
+from . import backend
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(backend.path(path), "r") as f:
+            return int(f.read().strip())
+    except Exception:
+        return None
+
+
+def _thermal_zones() -> List[str]:
+    try:
+        return sorted(tz for tz in os.listdir(backend.path("/sys/class/thermal")) if tz.startswith("thermal_zone"))
+    except OSError:
+        return []
+
+
+def _mean_khz(paths: List[str]) -> int:
+    vals = [v for v in (_read_int(p) for p in paths) if v]
+    return sum(vals) // len(vals) if vals else 0
+
+
+def _throttle_count() -> int:
+    paths = backend.glob("/sys/devices/system/cpu/cpu[0-9]*/thermal_throttle/*_throttle_count")
+    return sum(v for v in (_read_int(p) for p in paths) if v)
+
+
+class ThermalSampler:
+    # Samples every thermal zone, the mean scaling_cur_freq and the kernel's
+    # thermal throttle counters into compact arrays (temperatures in 0.1 C,
+    # frequencies in MHz) from a background thread.
+    def __init__(self, interval: float = 2.0) -> None:
+        self.interval = interval
+        self.zones: Dict[str, array] = {tz: array("h") for tz in _thermal_zones()}
+        self.times = array("f")
+        self.freq_mhz = array("I")
+        self.throttles = array("I")
+        self._freq_paths = sorted(backend.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq"))
+        max_paths = backend.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/cpuinfo_max_freq")
+        self.max_freq_mhz = _mean_khz(max_paths) // 1000
+        self._throttle_base = _throttle_count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = 0.0
+
+    def start(self) -> None:
+        self._t0 = time.monotonic()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="refurb-thermal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        temps = {tz: _read_int(f"/sys/class/thermal/{tz}/temp") for tz in self.zones}
+        freq = _mean_khz(self._freq_paths) // 1000
+        throttles = max(0, _throttle_count() - self._throttle_base)
+        with self._lock:
+            self.times.append(time.monotonic() - self._t0)
+            for tz, t in temps.items():
+                self.zones[tz].append(max(-32768, min(32767, (t or 0) // 100)))
+            self.freq_mhz.append(freq)
+            self.throttles.append(throttles)
+
+    def _since(self, window: float) -> int:
+        # Index of the first sample inside the trailing window.
+        with self._lock:
+            if not self.times:
+                return 0
+            cutoff = self.times[-1] - window
+            for i, t in enumerate(self.times):
+                if t >= cutoff:
+                    return i
+            return len(self.times)
+
+    def max_temp(self) -> float:
+        with self._lock:
+            vals = [z[-1] for z in self.zones.values() if z]
+        return max(vals) / 10 if vals else 0.0
+
+    def plateaued(self, window: float, tolerance: float = 1.0) -> bool:
+        if not self.times or self.times[-1] < window:
+            return False
+        i = self._since(window)
+        with self._lock:
+            for z in self.zones.values():
+                recent = z[i:]
+                if recent and (max(recent) - min(recent)) / 10 > tolerance:
+                    return False
+        return bool(self.zones)
+
+    def throttled(self, window: float, freq_ratio: float = 0.5) -> bool:
+        i = self._since(window)
+        with self._lock:
+            if self.throttles and self.throttles[-1] > self.throttles[max(0, i - 1)]:
+                return True
+            recent = [f for f in self.freq_mhz[i:] if f]
+        if recent and self.max_freq_mhz:
+            return sum(recent) / len(recent) < freq_ratio * self.max_freq_mhz
+        return False
+
+    def log(self, logger, parent: ET.Element) -> ET.Element:
+        with self._lock:
+            zones = {tz: array("h", z) for tz, z in self.zones.items() if z}
+            freqs = array("I", self.freq_mhz)
+            samples = len(self.times)
+            throttles = self.throttles[-1] if self.throttles else 0
+        el = logger.add(parent, "thermal", interval=f"{self.interval:g}", samples=samples, throttle_events=throttles)
+        for tz, z in zones.items():
+            logger.add(el, "zone", " ".join(str(v) for v in z), name=tz, unit="0.1C",
+                       min=f"{min(z) / 10:.1f}", max=f"{max(z) / 10:.1f}", mean=f"{sum(z) / len(z) / 10:.1f}")
+        f = [v for v in freqs if v]
+        if f:
+            logger.add(el, "freq", " ".join(str(v) for v in freqs), unit="MHz", max_rated=self.max_freq_mhz,
+                       min=min(f), max=max(f), mean=sum(f) // len(f))
+        return el
@@ -0,0 +1,183 @@
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev). Spans are
+# "complete" events; nesting follows from time containment per thread.
+# With tracing off span() hands out one shared no-op object. Every event
+# carries the session id (boot id + random token) in its args: pids repeat
+# across boots of the same live image, so they cannot tell sessions apart.
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NOOP = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "t0", "cpu0")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.cpu0 = time.thread_time_ns()
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        t1 = time.perf_counter_ns()
+        self.args["cpu_ms"] = round((time.thread_time_ns() - self.cpu0) / 1e6, 3)
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._emit(self.name, self.cat, self.t0, t1, self.args)
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+
+def _session_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            boot = f.read().strip().replace("-", "")[:12]
+    except OSError:
+        boot = "noboot"
+    return f"{boot}-{secrets.token_hex(4)}"
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._events: List[Dict] = []
+        self._threads: Dict[int, str] = {}
+        self._epoch_us = time.time_ns() // 1000
+        self._perf0 = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.session = _session_id()
+        self._events.append({"name": "process_name", "ph": "M", "pid": self.pid,
+                             "args": {"name": f"refurb {self.session}", "session": self.session}})
+        self.path: Optional[str] = None
+        self.on_write: Optional[Callable[[str], None]] = None
+        self._commands = 0
+        self._started = 0
+
+    def _ts(self, perf_ns: int) -> float:
+        return self._epoch_us + (perf_ns - self._perf0) / 1000
+
+    def _emit(self, name: str, cat: str, t0: int, t1: int, args: Dict) -> None:
+        tid = threading.get_native_id()
+        args["session"] = self.session
+        with self._lock:
+            ev = {"name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": tid, "ts": round(self._ts(t0), 1),
+                  "dur": round((t1 - t0) / 1000, 1), "args": args}
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+                self._events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                                     "args": {"name": self._threads[tid], "session": self.session}})
+            self._events.append(ev)
+
+    def command_started(self) -> Tuple[int, int]:
+        with self._lock:
+            self._commands += 1
+            self._started += 1
+            return self._started, self._commands
+
+    def command_finished(self, token: Tuple[int, int]) -> bool:
+        # True when another command ran at some point during this one, which
+        # makes its RUSAGE_CHILDREN delta an upper bound rather than exact.
+        with self._lock:
+            self._commands -= 1
+            return token[1] > 1 or self._started > token[0]
+
+    def set_output(self, path: str, on_write: Optional[Callable[[str], None]] = None) -> None:
+        # Earlier sessions of the same device (resumed cycles) stay in the file.
+        # When one of them had the same pid this session moves to a free one,
+        # so trace viewers keep the sessions apart.
+        previous: List[Dict] = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("traceEvents", [])
+        except (OSError, ValueError, AttributeError):
+            pass
+        with self._lock:
+            self.path = path
+            self.on_write = on_write
+            previous = [e for e in previous if (e.get("args") or {}).get("session") != self.session]
+            pids = {e.get("pid") for e in previous}
+            if self.pid in pids:
+                self.pid = max(p for p in pids if isinstance(p, int)) + 1
+                for e in self._events:
+                    e["pid"] = self.pid
+            self._events[:0] = previous
+
+    def flush(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        if self.on_write:
+            self.on_write(self.path)
+
+    def summary(self) -> List[Tuple[str, str, int, float, float]]:
+        # (cat, name, count, wall_ms, cpu_ms) for this session; commands are
+        # grouped by executable.
+        agg: Dict[Tuple[str, str], List[float]] = {}
+        with self._lock:
+            events = [e for e in self._events if e.get("ph") == "X" and e["args"].get("session") == self.session]
+        for e in events:
+            a = agg.setdefault((e["cat"], e["name"]), [0, 0.0, 0.0])
+            a[0] += 1
+            a[1] += e["dur"] / 1000
+            a[2] += e["args"].get("cpu_ms", 0.0) + e["args"].get("child_cpu_ms", 0.0)
+        return [(cat, name, int(a[0]), a[1], a[2]) for (cat, name), a in agg.items()]
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, cat: str = "phase", **args):
+    t = _tracer
+    if t is None:
+        return _NOOP
+    return _Span(t, name, cat, args)
+
+
+def flush() -> None:
+    t = _tracer
+    if t is not None:
+        try:
+            t.flush()
+        except OSError:
+            pass
@@ -0,0 +1,88 @@
+import socket
+import struct
+import threading
+from typing import Callable, Dict, List, Optional
+
+NETLINK_KOBJECT_UEVENT = 15
+GROUP_KERNEL = 1
+GROUP_UDEV = 2
+_UDEV_MAGIC = 0xFEEDCAFE
+
+
+def parse(data: bytes) -> Optional[Dict[str, str]]:
+    # Kernel messages are "ACTION@DEVPATH\0KEY=VALUE\0..."; udev re-broadcasts
+    # them with a "libudev" header and adds its own properties (ID_PATH, ...).
+    if data.startswith(b"libudev\0"):
+        if len(data) < 40:
+            return None
+        # Only the magic is in network byte order; the rest is host order.
+        (magic,) = struct.unpack_from("!I", data, 8)
+        _, off, length = struct.unpack_from("=III", data, 12)
+        if magic != _UDEV_MAGIC:
+            return None
+        body = data[off:off + length]
+    elif b"@" in data.split(b"\0", 1)[0]:
+        body = data.split(b"\0", 1)[1] if b"\0" in data else b""
+    else:
+        return None
+    props: Dict[str, str] = {}
+    for item in body.split(b"\0"):
+        if b"=" in item:
+            k, v = item.split(b"=", 1)
+            props[k.decode("utf-8", "replace")] = v.decode("utf-8", "replace")
+    return props if "ACTION" in props else None
+
+
+class UeventListener:
+    # One netlink socket per process, fanned out to subscribers from a
+    # daemon thread. Subscribers must be quick; they run on that thread.
+    def __init__(self, group: int = GROUP_KERNEL) -> None:
+        self.group = group
+        self._subs: List[Callable[[Dict[str, str]], None]] = []
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._sock.bind((0, group))
+        self._thread = threading.Thread(target=self._run, name=f"refurb-uevent-{group}", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, fn: Callable[[Dict[str, str]], None]) -> None:
+        with self._lock:
+            self._subs.append(fn)
+
+    def unsubscribe(self, fn: Callable[[Dict[str, str]], None]) -> None:
+        with self._lock:
+            if fn in self._subs:
+                self._subs.remove(fn)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                data = self._sock.recv(1 << 16)
+            except OSError:
+                continue
+            event = parse(data)
+            if event is None:
+                continue
+            with self._lock:
+                subs = list(self._subs)
+            for fn in subs:
+                try:
+                    fn(event)
+                except Exception:
+                    pass
+
+
+_listeners: Dict[int, Optional[UeventListener]] = {}
+_listeners_lock = threading.Lock()
+
+
+def listener(group: int = GROUP_KERNEL) -> Optional[UeventListener]:
+    # None when netlink is unavailable (containers, missing privileges).
+    with _listeners_lock:
+        if group not in _listeners:
+            try:
+                _listeners[group] = UeventListener(group)
+            except OSError:
+                _listeners[group] = None
+        return _listeners[group]
@@ -3,6 +3,8 @@ import subprocess
 import time
 from typing import List, Tuple, Optional
 
+from . import backend
+
 
 def clear_screen() -> None:
     try:
@@ -13,8 +15,7 @@ def clear_screen() -> None:
 
 def run_cmd(cmd: List[str], timeout: Optional[int] = None) -> Tuple[int, str, str]:
     try:
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, check=False)
-        return p.returncode, p.stdout, p.stderr
+        return backend.run(cmd, timeout)
     except Exception as e:
         return 1, "", str(e)
 
@@ -25,14 +26,14 @@ def run_shell(cmd: str, timeout: Optional[int] = None) -> Tuple[int, str, str]:
 
 def ask(prompt: str) -> str:
     try:
-        return input(prompt)
+        return backend.active().ask(prompt)
     except EOFError:
         return ""
 
 
 def pause(msg: str = "Press ENTER to continue...") -> None:
     try:
-        input(msg)
+        backend.active().ask(msg)
     except EOFError:
         pass
 
@@ -1,12 +1,20 @@
+import json
 import os
+import threading
+import time
 import xml.etree.ElementTree as ET
-from typing import Optional
+from typing import Callable, Dict, Optional
 
 
 def write_xml(path: str, root: ET.Element) -> None:
     tree = ET.ElementTree(root)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    tree.write(path, encoding="utf-8", xml_declaration=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        tree.write(f, encoding="utf-8", xml_declaration=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
 
 def new_root(tag: str, attrib: Optional[dict] = None) -> ET.Element:
@@ -14,9 +22,23 @@ def new_root(tag: str, attrib: Optional[dict] = None) -> ET.Element:
 
 
 class XmlLogger:
-    def __init__(self, path: str, root_tag: str = "log") -> None:
+    # Events go to an append-only JSON-lines journal next to the XML, fsynced
+    # in batches. The XML itself is only rewritten (atomically) on
+    # materialize/close, or after replaying a journal left behind by a crash.
+    # Node ids follow document order of the XML, so records written after a
+    # compaction still find their parents when replayed onto the parsed file.
+    # The XML root and the journal's first line carry a generation: a crash
+    # between replacing the XML and removing the journal leaves a journal of
+    # an older generation, which is already in the XML and is dropped.
+    def __init__(self, path: str, root_tag: str = "log", sync_every: int = 16, sync_interval: float = 2.0,
+                 on_write: Optional[Callable[[str], None]] = None) -> None:
         self.path = path
         self.root_tag = root_tag
+        self.journal_path = f"{path}.journal"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.on_write = on_write
+        self._lock = threading.RLock()
         if os.path.exists(path):
             try:
                 self.tree = ET.parse(path)
@@ -27,18 +49,109 @@ class XmlLogger:
         else:
             self.root = ET.Element(root_tag)
             self.tree = ET.ElementTree(self.root)
+        self._ids: Dict[int, int] = {}
+        self._nodes: Dict[int, ET.Element] = {}
+        self._next_id = 0
+        self._seed()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._journal = None
+        if os.path.exists(self.journal_path):
+            self._replay()
+            self.materialize()
 
     def append(self, tag: str, **attrs) -> ET.Element:
-        el = ET.SubElement(self.root, tag, {k: str(v) for k, v in attrs.items()})
-        self._flush()
-        return el
+        return self._add(self.root, tag, {k: str(v) for k, v in attrs.items()}, None)
 
     def add_text(self, parent: ET.Element, tag: str, text: str) -> ET.Element:
-        el = ET.SubElement(parent, tag)
-        el.text = text
-        self._flush()
-        return el
-
-    def _flush(self) -> None:
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        self.tree.write(self.path, encoding="utf-8", xml_declaration=True)
+        return self._add(parent, tag, {}, text)
+
+    def add(self, parent: ET.Element, tag: str, text: Optional[str] = None, **attrs) -> ET.Element:
+        return self._add(parent, tag, {k: str(v) for k, v in attrs.items()}, text)
+
+    def _add(self, parent: ET.Element, tag: str, attrs: Dict[str, str], text: Optional[str]) -> ET.Element:
+        with self._lock:
+            el = ET.SubElement(parent, tag, attrs)
+            if text is not None:
+                el.text = text
+            nid = self._next_id
+            self._next_id += 1
+            self._ids[id(el)] = nid
+            self._nodes[nid] = el
+            rec = {"id": nid, "parent": self._ids.get(id(parent), 0), "tag": tag, "attrs": attrs}
+            if text is not None:
+                rec["text"] = text
+            self._write_record(rec)
+            return el
+
+    def _seed(self) -> None:
+        self._ids = {}
+        self._nodes = {}
+        for nid, el in enumerate(self.root.iter()):
+            self._ids[id(el)] = nid
+            self._nodes[nid] = el
+        self._next_id = len(self._nodes)
+
+    def _write_record(self, rec: dict) -> None:
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            if self._journal.tell() == 0:
+                self._journal.write(json.dumps({"generation": self.root.get("generation", "0")}) + "\n")
+        self._journal.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        self._pending += 1
+        if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self._sync()
+
+    def sync(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        if self._journal is not None and self._pending:
+            os.fsync(self._journal.fileno())
+            if self.on_write:
+                self.on_write(self.journal_path)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _replay(self) -> None:
+        # A crash can leave a torn last line; everything before it is intact.
+        with open(self.journal_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if "generation" in rec:
+                    if rec["generation"] != self.root.get("generation", "0"):
+                        return
+                    continue
+                parent = self._nodes.get(rec.get("parent", 0), self.root)
+                el = ET.SubElement(parent, rec["tag"], rec.get("attrs") or {})
+                if "text" in rec:
+                    el.text = rec["text"]
+                self._ids[id(el)] = rec["id"]
+                self._nodes[rec["id"]] = el
+
+    def materialize(self) -> None:
+        with self._lock:
+            self._materialize()
+
+    def _materialize(self) -> None:
+        self.root.set("generation", str(int(self.root.get("generation", "0")) + 1))
+        write_xml(self.path, self.root)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if self.on_write:
+            self.on_write(self.path)
+            self.on_write(self.journal_path)
+        self._seed()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.materialize()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# Benchmarks the suite against the recorded machines in fixtures/, so it runs
+# on any Linux box: audit collection and (de)serialisation, diff_audits,
+# XmlLogger growth and a full REFURB_FAST run per machine. The full run's
+# wall time is mostly the recorded waits; its CPU time is the suite's own
+# overhead. --save keeps the results as JSON, --compare exits 1 when any
+# result is more than --tolerance slower than the saved one.
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SCRIPTS = os.path.join(ROOT, "live-build", "config", "includes.chroot", "opt", "refurb-scripts")
+FIXTURES = os.path.join(ROOT, "fixtures")
+sys.path.insert(0, SCRIPTS)
+
+from refurb import audit, backend, delta, probe  # noqa: E402
+from refurb.model import Audit  # noqa: E402
+from refurb.xmlio import XmlLogger  # noqa: E402
+
+Results = Dict[str, Tuple[float, str]]
+TO_MS = {"s": 1000.0, "ms": 1.0, "us": 0.001}
+
+
+def best_ms(fn: Callable[[], object], n: int) -> float:
+    best = float("inf")
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def bench_audit(fixtures: List[str], n: int, res: Results) -> Dict[str, bytes]:
+    audits: Dict[str, bytes] = {}
+    for name in fixtures:
+        replay = backend.Replay(os.path.join(FIXTURES, name))
+        previous = backend.use(replay)
+        try:
+            def collect() -> Audit:
+                probe.invalidate()
+                return audit.collect_audit()
+            a = collect()
+            res[f"audit.collect[{name}]"] = (best_ms(collect, n), "ms")
+        finally:
+            backend.use(previous)
+            replay.close()
+        xml = ET.tostring(a.to_xml())
+        text = a.to_json()
+        res[f"audit.to_xml[{name}]"] = (best_ms(lambda: ET.tostring(a.to_xml()), n), "ms")
+        res[f"audit.from_xml[{name}]"] = (best_ms(lambda: Audit.from_xml(ET.fromstring(xml)), n), "ms")
+        res[f"audit.from_json[{name}]"] = (best_ms(lambda: Audit.from_json(text), n), "ms")
+        audits[name] = xml
+    return audits
+
+
+def bench_diff(audits: Dict[str, bytes], n: int, res: Results) -> None:
+    names = sorted(audits)
+    pairs = [(a, a) for a in names] + list(zip(names, names[1:]))
+    for old, new in pairs:
+        old_xml, new_xml = ET.fromstring(audits[old]), ET.fromstring(audits[new])
+        res[f"diff_audits[{old}->{new}]"] = (best_ms(lambda: delta.diff_audits(old_xml, new_xml), n), "ms")
+
+
+def bench_logger(entries: int, res: Results) -> None:
+    # Per-append cost at the start and at the end of a long log; the two
+    # should stay close, whatever the log size.
+    work = tempfile.mkdtemp(prefix="refurb-bench-")
+    try:
+        logger = XmlLogger(os.path.join(work, "auto_test.xml"), root_tag="auto_tests")
+        batch = max(1, entries // 8)
+        per: List[float] = []
+        for b in range(0, entries, batch):
+            t0 = time.perf_counter()
+            for i in range(b, min(entries, b + batch)):
+                logger.append("cpu_sample", time="2026-01-01T00:00:00+0000", i=i, temp="61.5", freq_mhz="2400")
+            per.append((time.perf_counter() - t0) / batch * 1e6)
+        res[f"xmllogger.append[first {batch}]"] = (per[0], "us")
+        res[f"xmllogger.append[last {batch}]"] = (per[-1], "us")
+        res[f"xmllogger.close[{entries}]"] = (best_ms(logger.close, 1), "ms")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def run_pipeline(name: str) -> Tuple[float, float, Dict[str, float]]:
+    # One fast run in a child process, like scripts/smoke-fast.sh: wall and
+    # CPU time of the run, wall time per phase from its trace.
+    fixture = os.path.join(FIXTURES, name)
+    with open(os.path.join(fixture, backend.FIXTURE_FILE), "r", encoding="utf-8") as f:
+        device_id = json.load(f)["answers"][0]
+    work = tempfile.mkdtemp(prefix="refurb-bench-")
+    try:
+        share = os.path.join(work, "share")
+        if os.path.isdir(os.path.join(fixture, "share")):
+            shutil.copytree(os.path.join(fixture, "share"), os.path.join(share, f"ID-{device_id}"))
+        env = dict(os.environ, REFURB_BACKEND=f"replay:{fixture}", REFURB_SMB_URL="local:/", REFURB_MOUNTPOINT=share,
+                   REFURB_SPOOL_DIR=os.path.join(work, "spool"), REFURB_FAST="1", REFURB_TRACE="1", DISPLAY="")
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SCRIPTS, "main.py")], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=600)
+        wall = time.perf_counter() - t0
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) * 1000
+        phases: Dict[str, float] = {}
+        with open(os.path.join(work, "spool", f"ID-{device_id}", "trace.json"), "r", encoding="utf-8") as f:
+            for ev in json.load(f)["traceEvents"]:
+                if ev.get("ph") == "X" and ev.get("cat") == "phase":
+                    phases[ev["name"]] = phases.get(ev["name"], 0.0) + ev["dur"] / 1e6
+        return wall, cpu, phases
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_pipeline(fixtures: List[str], res: Results) -> None:
+    for name in fixtures:
+        wall, cpu, phases = run_pipeline(name)
+        res[f"pipeline.wall[{name}]"] = (wall, "s")
+        res[f"pipeline.cpu[{name}]"] = (cpu, "ms")
+        for phase, sec in phases.items():
+            res[f"pipeline.phase.{phase}[{name}]"] = (sec, "s")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=20, help="repetitions per micro benchmark (best is kept)")
+    ap.add_argument("--fixtures", default="", help="comma-separated fixture names (default: all)")
+    ap.add_argument("--log-entries", type=int, default=8000)
+    ap.add_argument("--skip-pipeline", action="store_true")
+    ap.add_argument("--save", metavar="FILE")
+    ap.add_argument("--compare", metavar="FILE")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against --compare (0.25 = 25%%)")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0,
+                    help="slowdowns smaller than this are noise, whatever the percentage")
+    args = ap.parse_args()
+
+    fixtures = [f for f in args.fixtures.split(",") if f] or sorted(
+        d for d in os.listdir(FIXTURES) if os.path.isfile(os.path.join(FIXTURES, d, backend.FIXTURE_FILE)))
+    res: Results = {}
+    audits = bench_audit(fixtures, args.n, res)
+    bench_diff(audits, args.n, res)
+    bench_logger(args.log_entries, res)
+    if not args.skip_pipeline:
+        bench_pipeline(fixtures, res)
+
+    baseline: Dict[str, float] = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    slower = []
+    width = max(len(k) for k in res)
+    print(f"{'benchmark':<{width}}{'value':>12}{'baseline':>12}{'change':>9}")
+    for key, (value, unit) in res.items():
+        line = f"{key:<{width}}{value:>10.3f}{unit:>2}"
+        if key in baseline and baseline[key] > 0:
+            change = value / baseline[key] - 1
+            line += f"{baseline[key]:>10.3f}{unit:>2}{change:>+8.0%}"
+            if change > args.tolerance and (value - baseline[key]) * TO_MS[unit] > args.min_delta_ms:
+                slower.append(key)
+                line += "  SLOWER"
+        print(line)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({k: round(v, 4) for k, (v, _) in res.items()}, f, indent=1)
+    if slower:
+        print(f"{len(slower)} benchmark(s) more than {args.tolerance:.0%} slower than {args.compare}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Compares the old bash -lc discovery pipelines with the sysfs probes:
+# wall time per call and processes forked (system-wide counter from
+# /proc/stat, so run it on an otherwise idle box).
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "live-build", "config", "includes.chroot",
+                    "opt", "refurb-scripts")
+sys.path.insert(0, ROOT)
+
+from refurb import probe  # noqa: E402
+from refurb.utils import run_cmd  # noqa: E402
+
+LEGACY = {
+    "disks": "lsblk -nd -o NAME,TYPE | awk '$2==\"disk\"{print $1}'",
+    "batteries": "upower -e | grep -i battery || true",
+    "wireless": "iw dev | awk '$1==\"Interface\"{print $2}'",
+    "bluetoothctl": "which bluetoothctl >/dev/null 2>&1 && echo yes || echo no",
+}
+PROBES = {
+    "disks": probe.block_devices,
+    "batteries": probe.batteries,
+    "wireless": probe.wireless_interfaces,
+    "bluetoothctl": lambda: probe.has_bin("bluetoothctl"),
+}
+
+
+def forks() -> int:
+    with open("/proc/stat", "r") as f:
+        for line in f:
+            if line.startswith("processes "):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(fn, n: int):
+    f0 = forks()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1000, (forks() - f0) / n
+
+
+def main() -> int:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'probe':<14}{'legacy ms':>11}{'forks':>8}{'sysfs ms':>11}{'forks':>8}{'cached ms':>11}{'forks':>8}")
+    for name, cmd in LEGACY.items():
+        legacy_ms, legacy_forks = measure(lambda: run_cmd(["bash", "-lc", cmd]), n)
+
+        def cold():
+            probe.invalidate()
+            PROBES[name]()
+
+        cold_ms, cold_forks = measure(cold, n)
+        PROBES[name]()
+        warm_ms, warm_forks = measure(PROBES[name], n)
+        print(f"{name:<14}{legacy_ms:>11.2f}{legacy_forks:>8.1f}{cold_ms:>11.3f}{cold_forks:>8.1f}"
+              f"{warm_ms:>11.4f}{warm_forks:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
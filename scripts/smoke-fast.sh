@@ -1,9 +1,26 @@
 #!/usr/bin/env bash
+# Runs the whole suite against a recorded machine with its scripted answers:
+# no hardware, root, share or display needed. Usage: smoke-fast.sh [fixture]
+# (a name under fixtures/ or a path; default latitude-e7470).
 set -euo pipefail
-ROOT_DIR="$(dirname "$0")/.."
-mkdir -p /tmp/refurbish
+ROOT_DIR="$(cd "$(dirname "$0")/.." && pwd)"
+FIXTURE="${1:-latitude-e7470}"
+[ -d "$FIXTURE" ] || FIXTURE="$ROOT_DIR/fixtures/$FIXTURE"
+FIXTURE="$(cd "$FIXTURE" && pwd)"
+WORK="$(mktemp -d /tmp/refurb-smoke.XXXXXX)"
+trap 'rm -rf "$WORK"' EXIT
+export REFURB_BACKEND="replay:$FIXTURE"
 export REFURB_SMB_URL=local:/
-export REFURB_MOUNTPOINT=/tmp/refurbish
+export REFURB_MOUNTPOINT="$WORK/share"
+export REFURB_SPOOL_DIR="$WORK/spool"
 export REFURB_FAST=1
-python3 -m refurb.main || true
-
+export DISPLAY=
+# Results of an earlier visit (fixture share/) go into the device folder.
+ID="$(python3 -c 'import json, sys; print(json.load(open(sys.argv[1]))["answers"][0])' "$FIXTURE/machine.json")"
+if [ -d "$FIXTURE/share" ]; then
+    mkdir -p "$REFURB_MOUNTPOINT/ID-$ID"
+    cp -r "$FIXTURE/share/." "$REFURB_MOUNTPOINT/ID-$ID/"
+fi
+python3 "$ROOT_DIR/live-build/config/includes.chroot/opt/refurb-scripts/main.py"
+echo "--- ID-$ID on the share:"
+ls -l "$REFURB_MOUNTPOINT/ID-$ID"